@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Purpose: Performance benchmarks for multipass_utils and the TUI
+
+Runs against fake_multipass, so no real multipass is needed and nothing on
+the machine is touched. Results are written as JSON so two versions can be
+compared:
+
+    python benchmark.py --output before.json
+    ... change things ...
+    python benchmark.py --output after.json --compare before.json
+"""
+
+# Libraries
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fake_multipass import FakeMultipass
+import multipass_utils
+from multipass_metrics import CommandMetrics
+from multipass_resources import ResourceSampler
+from multipass_search import InstanceIndex
+
+DEFAULT_SIZES = [10, 100, 1000]
+DEFAULT_ITERATIONS = 20
+# Time from starting the process to the first frame of the TUI. multipass is
+# made slower than this, so anything waiting on it before painting fails.
+STARTUP_BUDGET_SECONDS = 2.0
+STARTUP_RUNS = 3
+
+
+def summarise(samples: List[float]) -> Dict[str, float]:
+    """ Turn a list of durations (seconds) into latency and throughput figures """
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    total = sum(samples)
+    return {
+        'iterations': len(samples),
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': percentile(50) * 1000,
+        'p95_ms': percentile(95) * 1000,
+        'max_ms': ordered[-1] * 1000,
+        'ops_per_sec': len(samples) / total if total else 0.0,
+    }
+
+
+def time_calls(func: Callable[[], Any], iterations: int,
+               setup: Optional[Callable[[], None]] = None) -> Dict[str, float]:
+    """ Time func, calling setup (untimed) before each call """
+    samples = []
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return summarise(samples)
+
+
+async def time_calls_async(func: Callable[[], Awaitable[Any]], iterations: int) -> Dict[str, float]:
+    """ Time an async func """
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - started)
+    return summarise(samples)
+
+
+def bench_utils(iterations: int) -> Dict[str, Dict[str, float]]:
+    """ The multipass_utils query helpers """
+    invalidate = multipass_utils.invalidate_instance_cache
+    sampler = ResourceSampler()
+    metrics = CommandMetrics()
+    argv = ['multipass', 'start', 'vm-0001', 'vm-0002']
+
+    def all_partitions():
+        multipass_utils.get_running_multipass_instances()
+        multipass_utils.get_stopped_multipass_instances()
+        multipass_utils.get_suspended_multipass_instances()
+
+    index = InstanceIndex()
+    index.update(multipass_utils.get_instance_records())
+
+    def type_filter():
+        query = ''
+        for key in 'vm-1 state:run':
+            query += key
+            index.view(query)
+        index.results.clear()
+
+    return {
+        'get_multipass_instances': time_calls(
+            lambda: multipass_utils.get_multipass_instances(force=True), iterations),
+        'state_filters_cold': time_calls(all_partitions, iterations, setup=invalidate),
+        'state_filters_warm': time_calls(all_partitions, iterations),
+        'get_instances_for_textual_datatable': time_calls(
+            multipass_utils.get_instances_for_textual_datatable, iterations),
+        'ResourceSampler.sample_once': time_calls(
+            lambda: asyncio.run(sampler.sample_once()), iterations),
+        # Typing a 15 character filter, a view per keystroke
+        'InstanceIndex.view[typing]': time_calls(type_filter, iterations),
+        # The cost added to every command by the timing instrumentation
+        'CommandMetrics.record': time_calls(
+            lambda: metrics.record(argv, time.time(), 0.0, 0.25, 0, ''), iterations),
+    }
+
+
+async def bench_tui(iterations: int) -> Dict[str, Dict[str, float]]:
+    """ mptui.refresh_table, driven headless through Textual's pilot """
+    # Imported here so the utils benchmarks don't pay for Textual
+    from main_tui import mptui
+
+    app = mptui()
+    async with app.run_test(size=(160, 50)) as pilot:
+        # Only measure what we call ourselves
+        app.workers.cancel_group(app, 'watch')
+        await pilot.pause()
+        results = {'mptui.refresh_table': await time_calls_async(app.refresh_table, iterations)}
+        await pilot.pause()
+    return results
+
+
+def measure_startup() -> float:
+    """ Seconds from starting a fresh python to the TUI's first frame """
+    started = time.perf_counter()
+    probe = subprocess.Popen([sys.executable, __file__, '--startup-probe'],
+                             stdout=subprocess.PIPE, text=True)
+    for line in probe.stdout:
+        if line.strip() == 'READY':
+            break
+    elapsed = time.perf_counter() - started
+    probe.wait()
+    return elapsed
+
+
+def bench_startup(runs: int = STARTUP_RUNS,
+                  budget: float = STARTUP_BUDGET_SECONDS) -> Dict[str, Any]:
+    """ Time to first frame while multipass takes longer than the budget to answer """
+    slow = budget * 1.5
+    with FakeMultipass(instances=10, latency={'list': slow, 'version': slow}):
+        results = summarise([measure_startup() for _ in range(runs)])
+    results['budget_ms'] = budget * 1000
+    results['within_budget'] = results['max_ms'] <= results['budget_ms']
+    return results
+
+
+def _startup_probe() -> None:
+    """ Run in a child process by measure_startup """
+    from main_tui import mptui
+
+    async def first_frame():
+        app = mptui()
+        async with app.run_test():
+            print('READY', flush=True)
+            app.exit()
+
+    asyncio.run(first_frame())
+
+
+def run_benchmarks(sizes: List[int], iterations: int, latency: Dict[str, float],
+                   startup_budget: float = STARTUP_BUDGET_SECONDS) -> Dict[str, Any]:
+    """ Run every benchmark for every fleet size """
+    results: Dict[str, Any] = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'commit': _git_commit(),
+            'iterations': iterations,
+            'latency': latency,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'sizes': {},
+    }
+    results['startup'] = bench_startup(budget=startup_budget)
+    for size in sizes:
+        with FakeMultipass(instances=size, latency=latency):
+            size_results = bench_utils(iterations)
+            size_results.update(asyncio.run(bench_tui(iterations)))
+        # The same query over a persistent socket instead of a fork per call
+        with FakeMultipass(instances=size, latency=latency, serve=True):
+            size_results['get_multipass_instances[socket]'] = time_calls(
+                lambda: multipass_utils.get_multipass_instances(force=True), iterations)
+        results['sizes'][str(size)] = size_results
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any],
+                    threshold: float) -> List[str]:
+    """
+    Find benchmarks that got slower
+
+    Args:
+        baseline (dict): Results from an earlier run.
+        current (dict): Results from this run.
+        threshold (float): How many times slower (p50) counts as a regression.
+
+    Returns:
+        list: A line describing each regression
+    """
+    regressions = []
+    for size, benches in current['sizes'].items():
+        for name, figures in benches.items():
+            before = baseline.get('sizes', {}).get(size, {}).get(name)
+            if not before or not before['p50_ms']:
+                continue
+            ratio = figures['p50_ms'] / before['p50_ms']
+            if ratio > threshold:
+                regressions.append(f"{name} @ {size}: p50 {before['p50_ms']:.2f}ms -> "
+                                   f"{figures['p50_ms']:.2f}ms ({ratio:.2f}x)")
+    return regressions
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    startup = results['startup']
+    print(f"Startup to first frame: p50 {startup['p50_ms']:.0f}ms  max {startup['max_ms']:.0f}ms"
+          f"  (budget {startup['budget_ms']:.0f}ms)")
+    for size, benches in results['sizes'].items():
+        print(f"\n{size} instances")
+        for name, figures in benches.items():
+            print(f"  {name:<38} p50 {figures['p50_ms']:9.2f}ms  p95 {figures['p95_ms']:9.2f}ms"
+                  f"  {figures['ops_per_sec']:9.1f} ops/s")
+
+
+def get_args():
+    """ Get passed args """
+    parser = argparse.ArgumentParser(description='Benchmark MultiPasser against a fake multipass')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='Comma separated fleet sizes')
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Extra seconds every fake multipass call takes')
+    parser.add_argument('--list-latency', type=float, default=None,
+                        help='Extra seconds a fake `multipass list` takes')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', metavar='BASELINE_JSON',
+                        help='Fail if anything is slower than in this earlier result')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='Slowdown (x) that counts as a regression')
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET_SECONDS,
+                        help='Seconds the TUI may take to paint its first frame')
+    parser.add_argument('--startup-probe', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    """ Execute program """
+    args = get_args()
+    if args.startup_probe:
+        _startup_probe()
+        return
+    latency = {'default': args.latency}
+    if args.list_latency is not None:
+        latency['list'] = args.list_latency
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    results = run_benchmarks(sizes, args.iterations, latency, args.startup_budget)
+    print_results(results)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_results(json.load(f), results, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION: {line}")
+        if regressions:
+            sys.exit(1)
+    if not results['startup']['within_budget']:
+        print("REGRESSION: startup went over its budget")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""pytest options for test.py"""
+
+import pytest
+
+
+def pytest_addoption(parser):
+    parser.addoption('--fake-multipass', action='store_true', default=False,
+                     help='Run the tests against fake_multipass instead of a real multipass')
+    parser.addoption('--timing', action='store_true', default=False,
+                     help='Also run the tests marked timing, which assert on wall clock time')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'timing: asserts on wall clock time, only run with --timing')
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip the timing tests unless asked, they fail on a busy or slow machine"""
+    if config.getoption('--timing'):
+        return
+    skip = pytest.mark.skip(reason='asserts on wall clock time, run with --timing')
+    for item in items:
+        if 'timing' in item.keywords:
+            item.add_marker(skip)
+
+
+def _fake_multipass_class():
+    """FakeMultipass, or skip the test where it can't run"""
+    from fake_multipass import FakeMultipass, SUPPORTED
+    if not SUPPORTED:
+        pytest.skip('fake_multipass needs a POSIX system')
+    return FakeMultipass
+
+
+@pytest.fixture(scope='session', autouse=True)
+def fake_multipass_session(request):
+    """Put a fake multipass with a small mixed fleet on PATH when asked to"""
+    if not request.config.getoption('--fake-multipass'):
+        yield None
+        return
+    with _fake_multipass_class()(instances=3) as fake:
+        yield fake
+
+
+@pytest.fixture
+def fake_multipass():
+    """A fake multipass with its own fleet, for tests that count calls"""
+    with _fake_multipass_class()(instances=6) as fake:
+        yield fake
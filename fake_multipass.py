@@ -0,0 +1,1039 @@
+#!/usr/bin/env python3
+"""
+Purpose: A fake `multipass` executable for tests and benchmarks
+
+It keeps its instances in a JSON file in a state directory (FAKE_MULTIPASS_STATE)
+instead of talking to multipassd, so fleets of any size can be simulated
+without a real multipass install. Every call is appended to calls.log in the
+state directory so tests can count how many processes were forked.
+
+Latency can be added per subcommand with a config.json in the state directory,
+e.g. {"latency": {"default": 0.05, "list": 0.3, "launch": 2}}, or for every
+command with FAKE_MULTIPASS_LATENCY=<seconds>.
+
+It can also answer the same commands over a unix socket (--serve or
+FakeMultipass(serve=True)), as a stand-in daemon for SocketTransport, and
+stand in for other hosts reached over ssh (FakeMultipass.add_host), with a
+fake `ssh` that runs the commands against that host's own state directory.
+
+Typical use from Python:
+
+    with FakeMultipass(instances=100) as fake:
+        get_multipass_instances()
+"""
+
+# Libraries
+import argparse
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import random
+import shlex
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, List, Optional, Sequence, Tuple
+try:
+    import fcntl
+except ImportError:
+    # Windows, where the module can still be imported, see SUPPORTED
+    fcntl = None
+    import msvcrt
+
+VERSION = '1.15.0'
+DEFAULT_RELEASE = 'Ubuntu 22.04 LTS'
+# How the states of seeded instances are spread out
+SEED_STATES = ('Running', 'Stopped', 'Suspended')
+
+STATE_ENV = 'FAKE_MULTIPASS_STATE'
+LATENCY_ENV = 'FAKE_MULTIPASS_LATENCY'
+# Same as multipass_transport.SOCKET_ENV and SOCKET_PROTOCOL
+SOCKET_ENV = 'MULTIPASSER_SOCKET'
+SOCKET_PROTOCOL = 'multipasser/1'
+# Where the fake ssh finds the other hosts' state directories
+HOSTS_ENV = 'FAKE_SSH_HOSTS'
+# Same as multipass_utils.CACHE_DIR_ENV, pointed into the fake's directory
+CACHE_DIR_ENV = 'MULTIPASSER_CACHE'
+
+# Whether FakeMultipass works here: it puts `#!` scripts on PATH in place of
+# multipass and ssh, and serves a unix socket, none of which Windows runs
+SUPPORTED = sys.platform != 'win32'
+
+# What `multipass find` lists: name -> (aliases, os, release, remote)
+FIND_IMAGES = {
+    '20.04': (['focal'], 'Ubuntu', '20.04 LTS', ''),
+    '22.04': (['jammy'], 'Ubuntu', '22.04 LTS', ''),
+    '24.04': (['noble', 'lts'], 'Ubuntu', '24.04 LTS', ''),
+    'daily:25.04': (['plucky', 'devel'], 'Ubuntu', '25.04', 'daily'),
+    'core24': ([], 'Ubuntu', 'Core 24', ''),
+}
+FIND_BLUEPRINTS = ['anbox-cloud-appliance', 'charm-dev', 'docker', 'jellyfin', 'minikube', 'ros2-humble']
+
+
+class FakeMultipassError(Exception):
+    """ Reported on stderr with a non-zero exit code, like multipass does """
+
+    def __init__(self, message: str, code: int = 2):
+        super().__init__(message)
+        self.code = code
+
+
+# --------------------------------------------------
+# State handling
+
+def _state_file(state_dir: str) -> str:
+    return os.path.join(state_dir, 'instances.json')
+
+
+def _lock(lock, write: bool) -> None:
+    if fcntl is not None:
+        fcntl.flock(lock, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+    else:
+        # No shared locks, readers wait for each other too
+        lock.seek(0)
+        msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock(lock) -> None:
+    if fcntl is not None:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    else:
+        lock.seek(0)
+        msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def locked_state(state_dir: str, write: bool = True):
+    """ Load the instances under a lock, and save them again if write is True """
+    with open(os.path.join(state_dir, '.lock'), 'a') as lock:
+        _lock(lock, write)
+        try:
+            try:
+                with open(_state_file(state_dir)) as f:
+                    instances = json.load(f)
+            except FileNotFoundError:
+                instances = {}
+            yield instances
+            if write:
+                tmp = _state_file(state_dir) + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(instances, f)
+                os.replace(tmp, _state_file(state_dir))
+        finally:
+            _unlock(lock)
+
+
+def make_instance(name: str, state: str = 'Running', release: str = DEFAULT_RELEASE,
+                  index: int = 0, cpus: int = 1, memory: int = 1024 ** 3,
+                  disk: int = 5 * 1024 ** 3, image: str = '22.04') -> Dict[str, Any]:
+    """ Build the stored record for one instance """
+    return {
+        'name': name,
+        'state': state,
+        'release': release,
+        'image': image,
+        'ipv4': [_ip_for(index)] if state == 'Running' else [],
+        'index': index,
+        'cpus': cpus,
+        'memory': memory,
+        'disk': disk,
+        'snapshots': {},
+    }
+
+
+def _ip_for(index: int) -> str:
+    return f'10.{(index >> 16) & 255}.{(index >> 8) & 255}.{(index & 255) or 1}'
+
+
+def seed_fleet(state_dir: str, count: int, prefix: str = 'vm',
+               states: Sequence[str] = SEED_STATES) -> List[str]:
+    """
+    Replace the fake's instances with a generated fleet
+
+    Args:
+        state_dir (str): The fake's state directory.
+        count (int): How many instances to create.
+        prefix (str): Names are <prefix>-0001, <prefix>-0002, ...
+        states (list): States handed out round robin.
+
+    Returns:
+        list: The instance names
+    """
+    width = max(4, len(str(count)))
+    names = [f'{prefix}-{i:0{width}d}' for i in range(1, count + 1)]
+    with locked_state(state_dir) as instances:
+        instances.clear()
+        for i, name in enumerate(names, start=1):
+            instances[name] = make_instance(name, states[(i - 1) % len(states)], index=i)
+    return names
+
+
+def set_latency(state_dir: str, latency: Dict[str, float]) -> None:
+    """ Set per-subcommand latency in seconds, 'default' applies to the rest """
+    config = _load_config(state_dir)
+    config['latency'] = dict(latency)
+    with open(os.path.join(state_dir, 'config.json'), 'w') as f:
+        json.dump(config, f)
+
+
+def _load_config(state_dir: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(state_dir, 'config.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def read_calls(state_dir: str) -> List[List[str]]:
+    """ Every argv the fake has been run with, oldest first """
+    try:
+        with open(os.path.join(state_dir, 'calls.log')) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def clear_calls(state_dir: str) -> None:
+    """ Forget the recorded calls """
+    open(os.path.join(state_dir, 'calls.log'), 'w').close()
+
+
+# --------------------------------------------------
+# Output formats
+
+def _list_json(instances: Dict[str, Any]) -> str:
+    items = [{'ipv4': item['ipv4'], 'name': item['name'],
+              'release': item['release'], 'state': item['state']}
+             for item in sorted(instances.values(), key=lambda i: i['name'])]
+    return json.dumps({'list': items}, indent=4)
+
+
+def _list_csv(instances: Dict[str, Any]) -> str:
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(['Name', 'State', 'IPv4', 'IPv6', 'Release', 'AliasesFor'])
+    for item in sorted(instances.values(), key=lambda i: i['name']):
+        writer.writerow([item['name'], item['state'], ','.join(item['ipv4']), '',
+                         item['release'], ''])
+    return out.getvalue().rstrip('\n')
+
+
+def _list_table(instances: Dict[str, Any]) -> str:
+    if not instances:
+        return 'No instances found.'
+    lines = [f"{'Name':<24}{'State':<18}{'IPv4':<17}Image"]
+    for item in sorted(instances.values(), key=lambda i: i['name']):
+        lines.append(f"{item['name']:<24}{item['state']:<18}"
+                     f"{(item['ipv4'] or ['--'])[0]:<17}{item['release']}")
+    return '\n'.join(lines)
+
+
+def _info_record(item: Dict[str, Any]) -> Dict[str, Any]:
+    running = item['state'] == 'Running'
+    # Deterministic but different per instance, so sparklines have something to show
+    rng = random.Random(f"{item['name']}:{int(time.time() // 5)}")
+    return {
+        'cpu_count': str(item['cpus']),
+        'disks': {'sda1': {'total': str(item['disk']),
+                           'used': str(item['disk'] // 3) if running else ''}},
+        'image_hash': hashlib.sha256(item['image'].encode()).hexdigest(),
+        'image_release': item['image'],
+        'ipv4': item['ipv4'],
+        'load': [round(rng.random() * item['cpus'], 2) for _ in range(3)] if running else [],
+        'memory': {'total': item['memory'],
+                   'used': int(item['memory'] * (0.2 + rng.random() * 0.6))} if running else {},
+        'mounts': {},
+        'release': item['release'],
+        'snapshot_count': str(len(item['snapshots'])),
+        'state': item['state'],
+    }
+
+
+# --------------------------------------------------
+# Commands
+
+def _resolve(instances: Dict[str, Any], names: List[str], use_all: bool,
+             include_deleted: bool = False) -> List[str]:
+    if use_all:
+        return [name for name, item in sorted(instances.items())
+                if include_deleted or item['state'] != 'Deleted']
+    if not names:
+        raise FakeMultipassError('Name argument or --all is required')
+    missing = [name for name in names if name not in instances]
+    if missing:
+        raise FakeMultipassError(f'instance "{missing[0]}" does not exist')
+    return names
+
+
+def cmd_list(state_dir: str, args: argparse.Namespace) -> str:
+    with locked_state(state_dir, write=False) as instances:
+        if args.snapshots:
+            info = {name: {snapshot: {'comment': item['comment'], 'parent': item['parent']}
+                           for snapshot, item in instances[name]['snapshots'].items()}
+                    for name in sorted(instances) if instances[name]['snapshots']}
+            return json.dumps({'errors': [], 'info': info}, indent=4)
+        if args.format == 'json':
+            return _list_json(instances)
+        if args.format == 'csv':
+            return _list_csv(instances)
+        return _list_table(instances)
+
+
+def cmd_info(state_dir: str, args: argparse.Namespace) -> str:
+    with locked_state(state_dir, write=False) as instances:
+        names = _resolve(instances, args.names, args.all, include_deleted=True)
+        return json.dumps({'errors': [],
+                           'info': {name: _info_record(instances[name]) for name in names}},
+                          indent=4)
+
+
+def _change_state(state_dir: str, args: argparse.Namespace, allowed_from: Sequence[str],
+                  new_state: str) -> str:
+    with locked_state(state_dir) as instances:
+        for name in _resolve(instances, args.names, args.all):
+            item = instances[name]
+            if item['state'] == 'Deleted':
+                raise FakeMultipassError(f'instance "{name}" is deleted')
+            if item['state'] in allowed_from:
+                item['state'] = new_state
+                item['ipv4'] = [_ip_for(item['index'])] if new_state == 'Running' else []
+    return ''
+
+
+def cmd_start(state_dir: str, args: argparse.Namespace) -> str:
+    return _change_state(state_dir, args, ('Stopped', 'Suspended', 'Running'), 'Running')
+
+
+def cmd_stop(state_dir: str, args: argparse.Namespace) -> str:
+    return _change_state(state_dir, args, ('Running', 'Suspended', 'Stopped'), 'Stopped')
+
+
+def cmd_suspend(state_dir: str, args: argparse.Namespace) -> str:
+    with locked_state(state_dir, write=False) as instances:
+        for name in _resolve(instances, args.names, args.all):
+            if instances[name]['state'] == 'Stopped':
+                raise FakeMultipassError(f'instance "{name}" is not running')
+    return _change_state(state_dir, args, ('Running', 'Suspended'), 'Suspended')
+
+
+def cmd_delete(state_dir: str, args: argparse.Namespace) -> str:
+    with locked_state(state_dir) as instances:
+        for name in _resolve(instances, args.names, args.all):
+            if args.purge:
+                del instances[name]
+            else:
+                instances[name]['state'] = 'Deleted'
+                instances[name]['ipv4'] = []
+    return ''
+
+
+def cmd_recover(state_dir: str, args: argparse.Namespace) -> str:
+    with locked_state(state_dir) as instances:
+        for name in _resolve(instances, args.names, args.all, include_deleted=True):
+            if instances[name]['state'] == 'Deleted':
+                instances[name]['state'] = 'Stopped'
+    return ''
+
+
+def cmd_shell(state_dir: str, args: argparse.Namespace) -> str:
+    """ A pretend login shell on stdin/stdout, it knows `hostname` and `exit` """
+    args.names, args.all = [args.name], False
+    # Like multipass, shelling into a stopped instance starts it
+    _change_state(state_dir, args, ('Stopped', 'Suspended'), 'Running')
+    prompt = f'ubuntu@{args.name}:~$ '
+    sys.stdout.write(f'Welcome to {args.name}\n{prompt}')
+    sys.stdout.flush()
+    for line in sys.stdin:
+        command = line.strip()
+        if command in ('exit', 'logout'):
+            break
+        if command == 'hostname':
+            sys.stdout.write(f'{args.name}\n')
+        elif command:
+            sys.stdout.write(f'{command.split()[0]}: command not found\n')
+        sys.stdout.write(prompt)
+        sys.stdout.flush()
+    return ''
+
+
+def cmd_exec(state_dir: str, args: argparse.Namespace) -> str:
+    """
+    Pretend to run a command in an instance, printing as it goes
+
+    It knows echo, seq N (a line per number), yes N (N lines to stderr),
+    sleep S, hostname, true, false, exit N and sha256sum of transferred files.
+    """
+    with locked_state(state_dir, write=False) as instances:
+        _resolve(instances, [args.name], False)
+        if instances[args.name]['state'] != 'Running':
+            raise FakeMultipassError(f'instance "{args.name}" is not running')
+        files = dict(instances[args.name].get('files', {}))
+    command = args.command_args[1:] if args.command_args[:1] == ['--'] else args.command_args
+    if not command:
+        raise FakeMultipassError('no command given', code=1)
+    program, rest = command[0], command[1:]
+    if program == 'echo':
+        args.write('stdout', ' '.join(rest))
+    elif program == 'seq':
+        for number in range(1, int(rest[0]) + 1):
+            args.write('stdout', str(number))
+    elif program == 'yes':
+        for _ in range(int(rest[0])):
+            args.write('stderr', 'y')
+    elif program == 'sleep':
+        time.sleep(float(rest[0]))
+    elif program == 'hostname':
+        args.write('stdout', args.name)
+    elif program == 'sha256sum':
+        for path in rest:
+            if path not in files:
+                raise FakeMultipassError(f'sha256sum: {path}: No such file or directory', code=1)
+            args.write('stdout', f'{files[path]}  {path}')
+    elif program in ('false', 'exit'):
+        raise FakeMultipassError('', code=int(rest[0]) if rest else 1)
+    elif program != 'true':
+        raise FakeMultipassError(f'bash: line 1: {program}: command not found', code=127)
+    return ''
+
+
+def cmd_purge(state_dir: str, args: argparse.Namespace) -> str:
+    with locked_state(state_dir) as instances:
+        for name in [name for name, item in instances.items() if item['state'] == 'Deleted']:
+            del instances[name]
+    return ''
+
+
+def _parse_size(size: str) -> int:
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    size = size.upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def cmd_launch(state_dir: str, args: argparse.Namespace) -> str:
+    with locked_state(state_dir, write=False) as instances:
+        name = args.name
+        if name is None:
+            words = ['brave', 'calm', 'eager', 'fancy', 'jolly', 'lucky', 'proud', 'witty']
+            animals = ['otter', 'lynx', 'heron', 'bison', 'koala', 'gecko', 'tapir', 'quail']
+            while name is None or name in instances:
+                name = f'{random.choice(words)}-{random.choice(animals)}-{random.randint(0, 999)}'
+        elif name in instances:
+            raise FakeMultipassError(f'instance "{name}" already exists')
+
+    # Print progress like multipass does, spread over the launch latency
+    steps = [f'Retrieving image: {percent}%' for percent in (0, 25, 50, 75, 100)]
+    steps += ['Verifying image', 'Preparing image for launch', f'Configuring {name}',
+              f'Starting {name}', 'Waiting for initialization to complete']
+    pause = _latency_for(state_dir, 'launch') / len(steps)
+    for step in steps:
+        args.progress(step)
+        if pause:
+            time.sleep(pause)
+
+    with locked_state(state_dir) as instances:
+        if name in instances:
+            raise FakeMultipassError(f'instance "{name}" already exists')
+        index = max([item['index'] for item in instances.values()] or [0]) + 1
+        instances[name] = make_instance(
+            name, 'Running', index=index, cpus=int(args.cpus),
+            memory=_parse_size(args.memory), disk=_parse_size(args.disk),
+            image=args.image or '22.04')
+    return f'Launched: {name}'
+
+
+def cmd_clone(state_dir: str, args: argparse.Namespace) -> str:
+    with locked_state(state_dir, write=False) as instances:
+        _resolve(instances, [args.source], False)
+        if instances[args.source]['state'] != 'Stopped':
+            raise FakeMultipassError('Multipass can only clone stopped instances.')
+    with locked_state(state_dir) as instances:
+        name = args.name
+        if name is None:
+            number = 1
+            while f'{args.source}-clone{number}' in instances:
+                number += 1
+            name = f'{args.source}-clone{number}'
+        elif name in instances:
+            raise FakeMultipassError(f'instance "{name}" already exists')
+        source = instances[args.source]
+        index = max(item['index'] for item in instances.values()) + 1
+        instances[name] = make_instance(
+            name, 'Stopped', release=source['release'], index=index, cpus=source['cpus'],
+            memory=source['memory'], disk=source['disk'], image=source['image'])
+    return f'Cloned from {args.source} to {name}.'
+
+
+def _snapshot_target(instances: Dict[str, Any], target: str) -> Tuple[Dict[str, Any], str]:
+    """ 'foo.snapshot1' -> (foo's record, 'snapshot1') """
+    name, _, snapshot = target.partition('.')
+    _resolve(instances, [name], False)
+    if snapshot not in instances[name]['snapshots']:
+        raise FakeMultipassError(f'snapshot "{snapshot}" does not exist')
+    return instances[name], snapshot
+
+
+def cmd_snapshot(state_dir: str, args: argparse.Namespace) -> str:
+    with locked_state(state_dir) as instances:
+        _resolve(instances, [args.instance], False)
+        item = instances[args.instance]
+        if item['state'] != 'Stopped':
+            raise FakeMultipassError('Multipass can only take snapshots of stopped instances.')
+        snapshots = item['snapshots']
+        name = args.name or f'snapshot{item.get("snapshots_taken", 0) + 1}'
+        if name in snapshots:
+            raise FakeMultipassError(f'snapshot "{name}" already exists')
+        item['snapshots_taken'] = item.get('snapshots_taken', 0) + 1
+        snapshots[name] = {'comment': args.comment or '', 'parent': item.get('current_snapshot', ''),
+                           'cpus': item['cpus'], 'memory': item['memory'], 'disk': item['disk'],
+                           'files': dict(item.get('files', {}))}
+        item['current_snapshot'] = name
+    return f'Snapshot taken: {args.instance}.{name}'
+
+
+def cmd_restore(state_dir: str, args: argparse.Namespace) -> str:
+    with locked_state(state_dir) as instances:
+        item, snapshot = _snapshot_target(instances, args.target)
+        if item['state'] != 'Stopped':
+            raise FakeMultipassError('Multipass can only restore snapshots of stopped instances.')
+        if not args.destructive:
+            raise FakeMultipassError('Need --destructive when not run interactively')
+        for key in ('cpus', 'memory', 'disk'):
+            item[key] = item['snapshots'][snapshot][key]
+        item['files'] = dict(item['snapshots'][snapshot].get('files', {}))
+        item['current_snapshot'] = snapshot
+    return f'Snapshot restored: {args.target}'
+
+
+def cmd_transfer(state_dir: str, args: argparse.Namespace) -> str:
+    """ Copy local files into an instance. The fake keeps each file's sha256, not its content. """
+    if len(args.paths) < 2:
+        raise FakeMultipassError('transfer: need a source and a destination', code=1)
+    *sources, destination = args.paths
+    name, separator, target = destination.partition(':')
+    if not separator:
+        raise FakeMultipassError('the fake only copies into instances', code=1)
+    digests = {}
+    for source in sources:
+        try:
+            with open(source, 'rb') as f:
+                digests[source] = hashlib.sha256(f.read()).hexdigest()
+        except OSError as e:
+            raise FakeMultipassError(f'source "{source}": {e.strerror}', code=1)
+    with locked_state(state_dir) as instances:
+        _resolve(instances, [name], False)
+        item = instances[name]
+        if item['state'] != 'Running':
+            raise FakeMultipassError(f'instance "{name}" is not running')
+        files = item.setdefault('files', {})
+        into_directory = len(sources) > 1 or target.endswith('/')
+        for source, digest in digests.items():
+            path = f"{target.rstrip('/')}/{os.path.basename(source)}" if into_directory else target
+            files[path] = digest
+    return ''
+
+
+def cmd_find(state_dir: str, args: argparse.Namespace) -> str:
+    version = time.strftime('%Y%m%d')
+    images = {name: {'aliases': aliases, 'os': os_name, 'release': release, 'remote': remote,
+                     'version': version}
+              for name, (aliases, os_name, release, remote) in FIND_IMAGES.items()}
+    blueprints = {name: {'aliases': [], 'os': '', 'release': '', 'remote': '', 'version': '0.1'}
+                  for name in FIND_BLUEPRINTS}
+    if args.format == 'json':
+        return json.dumps({'blueprints': blueprints, 'errors': [], 'images': images}, indent=4)
+    lines = [f"{'Image':<28}{'Aliases':<18}{'Version':<12}Description"]
+    for name, item in images.items():
+        lines.append(f"{name:<28}{','.join(item['aliases']):<18}{version:<12}{item['os']} {item['release']}")
+    return '\n'.join(lines)
+
+
+def cmd_version(state_dir: str, args: argparse.Namespace) -> str:
+    return f'multipass   {VERSION}\nmultipassd  {VERSION}'
+
+
+class _ArgumentParser(argparse.ArgumentParser):
+    """ Report bad arguments as an error instead of exiting, so the server survives them """
+
+    def error(self, message):
+        raise FakeMultipassError(f'{self.prog}: error: {message}', code=1)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """ The subset of the multipass CLI the fake understands """
+    parser = _ArgumentParser(prog='multipass')
+    parser.add_argument('--version', action='store_true')
+    subparsers = parser.add_subparsers(dest='command')
+
+    list_parser = subparsers.add_parser('list', aliases=['ls'])
+    list_parser.add_argument('--format', default='table', choices=['table', 'json', 'csv', 'yaml'])
+    list_parser.add_argument('--snapshots', action='store_true')
+    list_parser.set_defaults(func=cmd_list)
+
+    info_parser = subparsers.add_parser('info')
+    info_parser.add_argument('names', nargs='*')
+    info_parser.add_argument('--all', action='store_true')
+    info_parser.add_argument('--format', default='json')
+    info_parser.set_defaults(func=cmd_info)
+
+    for command, func in [('start', cmd_start), ('stop', cmd_stop), ('suspend', cmd_suspend),
+                          ('recover', cmd_recover)]:
+        sub = subparsers.add_parser(command)
+        sub.add_argument('names', nargs='*')
+        sub.add_argument('--all', action='store_true')
+        sub.set_defaults(func=func)
+
+    delete_parser = subparsers.add_parser('delete')
+    delete_parser.add_argument('names', nargs='*')
+    delete_parser.add_argument('--all', action='store_true')
+    delete_parser.add_argument('-p', '--purge', action='store_true')
+    delete_parser.set_defaults(func=cmd_delete)
+
+    exec_parser = subparsers.add_parser('exec')
+    exec_parser.add_argument('name')
+    exec_parser.add_argument('-d', '--working-directory')
+    exec_parser.add_argument('command_args', nargs=argparse.REMAINDER)
+    exec_parser.set_defaults(func=cmd_exec)
+
+    shell_parser = subparsers.add_parser('shell')
+    shell_parser.add_argument('name', nargs='?', default='primary')
+    shell_parser.set_defaults(func=cmd_shell)
+
+    purge_parser = subparsers.add_parser('purge')
+    purge_parser.set_defaults(func=cmd_purge)
+
+    launch_parser = subparsers.add_parser('launch')
+    launch_parser.add_argument('image', nargs='?')
+    launch_parser.add_argument('-n', '--name')
+    launch_parser.add_argument('-c', '--cpus', default='1')
+    launch_parser.add_argument('-m', '--memory', default='1G')
+    launch_parser.add_argument('-d', '--disk', default='5G')
+    launch_parser.add_argument('--cloud-init')
+    launch_parser.set_defaults(func=cmd_launch)
+
+    clone_parser = subparsers.add_parser('clone')
+    clone_parser.add_argument('source')
+    clone_parser.add_argument('-n', '--name')
+    clone_parser.set_defaults(func=cmd_clone)
+
+    transfer_parser = subparsers.add_parser('transfer')
+    transfer_parser.add_argument('-r', '--recursive', action='store_true')
+    transfer_parser.add_argument('-p', '--parents', action='store_true')
+    transfer_parser.add_argument('paths', nargs='+')
+    transfer_parser.set_defaults(func=cmd_transfer)
+
+    find_parser = subparsers.add_parser('find')
+    find_parser.add_argument('--format', default='table', choices=['table', 'json'])
+    find_parser.set_defaults(func=cmd_find)
+
+    snapshot_parser = subparsers.add_parser('snapshot')
+    snapshot_parser.add_argument('instance')
+    snapshot_parser.add_argument('-n', '--name')
+    snapshot_parser.add_argument('--comment')
+    snapshot_parser.set_defaults(func=cmd_snapshot)
+
+    restore_parser = subparsers.add_parser('restore')
+    restore_parser.add_argument('target')
+    restore_parser.add_argument('-d', '--destructive', action='store_true')
+    restore_parser.set_defaults(func=cmd_restore)
+
+    return parser
+
+
+def _latency_for(state_dir: str, command: str) -> float:
+    latency = _load_config(state_dir).get('latency', {})
+    seconds = latency.get(command, latency.get('default', 0))
+    if os.environ.get(LATENCY_ENV):
+        seconds = float(os.environ[LATENCY_ENV])
+    return seconds
+
+
+def _sleep_for(state_dir: str, command: str) -> None:
+    seconds = _latency_for(state_dir, command)
+    if seconds:
+        time.sleep(seconds)
+
+
+def run_command(argv: List[str], state_dir: str,
+                progress: Optional[Callable[[str], None]] = None,
+                write: Optional[Callable[[str, str], None]] = None) -> Tuple[int, str, str]:
+    """
+    Run one fake multipass command
+
+    Args:
+        argv (list): The arguments after `multipass`.
+        state_dir (str): The fake's state directory.
+        progress (callable): Gets progress lines as they happen, otherwise
+            they are put at the start of stdout.
+        write (callable): Gets ('stdout' or 'stderr', line) for output of
+            `exec` as it happens, otherwise it is returned with the rest.
+
+    Returns:
+        tuple: (returncode, stdout, stderr)
+    """
+    progress_lines: List[str] = []
+    written: Dict[str, List[str]] = {'stdout': [], 'stderr': []}
+    os.makedirs(state_dir, exist_ok=True)
+    with open(os.path.join(state_dir, 'calls.log'), 'a') as log:
+        log.write(json.dumps(argv) + '\n')
+    try:
+        args = build_parser().parse_args(argv)
+        if args.version:
+            args.func = cmd_version
+            args.command = 'version'
+        elif args.command is None:
+            return 1, '', 'Usage: multipass <command>\n'
+        args.progress = progress or (lambda text: progress_lines.append(f'{text}\r'))
+        args.write = write or (lambda stream, line: written[stream].append(f'{line}\n'))
+        if args.command != 'launch':
+            _sleep_for(state_dir, args.command)
+        output = args.func(state_dir, args)
+    except FakeMultipassError as e:
+        return (e.code, ''.join(progress_lines + written['stdout']),
+                ''.join(written['stderr']) + (f'{e}\n' if str(e) else ''))
+    return (0, ''.join(progress_lines + written['stdout']) + (f'{output}\n' if output else ''),
+            ''.join(written['stderr']))
+
+
+def main(argv: Optional[List[str]] = None, state_dir: Optional[str] = None) -> int:
+    """ Run one fake multipass command as the CLI """
+    argv = sys.argv[1:] if argv is None else argv
+    state_dir = state_dir or os.environ.get(STATE_ENV)
+    if not state_dir:
+        print(f'{STATE_ENV} is not set', file=sys.stderr)
+        return 1
+    def progress(text: str) -> None:
+        sys.stdout.write(f'{text}\r')
+        sys.stdout.flush()
+
+    def write(stream: str, line: str) -> None:
+        out = sys.stdout if stream == 'stdout' else sys.stderr
+        out.write(f'{line}\n')
+        out.flush()
+
+    returncode, stdout, stderr = run_command(argv, state_dir, progress, write)
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    return returncode
+
+
+# --------------------------------------------------
+# Serving it over a socket, see multipass_transport.SocketTransport
+
+async def _handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                         state_dir: str) -> None:
+    write_lock = asyncio.Lock()
+
+    async def answer(request: Dict[str, Any]) -> None:
+        returncode, stdout, stderr = await asyncio.to_thread(run_command, request['argv'], state_dir)
+        reply = {'id': request['id'], 'returncode': returncode, 'stdout': stdout, 'stderr': stderr}
+        async with write_lock:
+            writer.write(json.dumps(reply).encode() + b'\n')
+            await writer.drain()
+
+    tasks = set()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            request = json.loads(line)
+            if 'hello' in request:
+                async with write_lock:
+                    writer.write(json.dumps({'hello': SOCKET_PROTOCOL}).encode() + b'\n')
+                    await writer.drain()
+                continue
+            task = asyncio.ensure_future(answer(request))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    except (ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(socket_path: str, state_dir: str) -> asyncio.AbstractServer:
+    """ Answer MultiPasser's JSON line protocol on a unix socket, the stand-in for multipassd """
+    return await asyncio.start_unix_server(
+        lambda reader, writer: _handle_client(reader, writer, state_dir), path=socket_path)
+
+
+class FakeMultipassServer:
+    """ serve() running on its own thread, so synchronous code can use it """
+
+    def __init__(self, socket_path: str, state_dir: str):
+        self.socket_path = socket_path
+        self.state_dir = state_dir
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def start(self) -> 'FakeMultipassServer':
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(
+            serve(self.socket_path, self.state_dir), self._loop).result()
+        return self
+
+    def stop(self) -> None:
+        async def close():
+            self._server.close()
+            await self._server.wait_closed()
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+# --------------------------------------------------
+# A fake ssh, for multipass on other hosts (multipass_transport.SshTransport)
+
+def set_handshake(state_dir: str, seconds: float) -> None:
+    """ How long a new ssh connection to this host takes, before any command runs """
+    config = _load_config(state_dir)
+    config['handshake'] = seconds
+    with open(os.path.join(state_dir, 'config.json'), 'w') as f:
+        json.dump(config, f)
+
+
+def _control_path(pattern: str, address: str, port: str, user: str) -> str:
+    # ssh's %C is a hash of the connection details
+    digest = hashlib.sha1(f'{address}\0{port}\0{user}'.encode()).hexdigest()
+    return pattern.replace('%C', digest)
+
+
+def ssh_main(argv: Optional[List[str]] = None) -> int:
+    """
+    Run one command "on another host", like ssh would
+
+    Each host is a state directory under FAKE_SSH_HOSTS named after the
+    address, and only multipass commands can be run on it. Without a
+    ControlMaster connection to reuse, the host's handshake time is waited
+    out and a control file is left at the ControlPath, so later commands
+    that share it start straight away, as with ssh connection multiplexing.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    options: Dict[str, str] = {}
+    port, user, control_command = '22', os.environ.get('USER', ''), None
+    args = iter(argv)
+    address = None
+    for arg in args:
+        if arg == '-o':
+            key, _, value = next(args, '').partition('=')
+            options[key] = value
+        elif arg == '-p':
+            port = next(args, port)
+        elif arg == '-l':
+            user = next(args, user)
+        elif arg == '-O':
+            control_command = next(args, None)
+        elif arg.startswith('-'):
+            print(f'ssh: unknown option {arg}', file=sys.stderr)
+            return 255
+        else:
+            address = arg
+            break
+    remote = list(args)
+    if remote[:1] == ['--']:
+        remote = remote[1:]
+    hosts_dir = os.environ.get(HOSTS_ENV)
+    state_dir = os.path.join(hosts_dir, address) if hosts_dir and address else None
+    if state_dir is None or not os.path.isdir(state_dir):
+        print(f'ssh: Could not resolve hostname {address}: Name or service not known', file=sys.stderr)
+        return 255
+    control_path = None
+    if options.get('ControlPath') and options.get('ControlMaster', 'no') != 'no':
+        control_path = _control_path(options['ControlPath'], address, port, user)
+    if control_command == 'exit':
+        if control_path and os.path.exists(control_path):
+            os.remove(control_path)
+        return 0
+    if control_path is None or not os.path.exists(control_path):
+        handshake = _load_config(state_dir).get('handshake', 0)
+        if handshake:
+            time.sleep(handshake)
+        if control_path is not None:
+            open(control_path, 'a').close()
+    command = shlex.split(' '.join(remote))
+    if not command or command[0] != 'multipass':
+        print(f'bash: {command[0] if command else ""}: command not found', file=sys.stderr)
+        return 127
+    return main(command[1:], state_dir)
+
+
+# --------------------------------------------------
+# Installing it on PATH
+
+def _install_launcher(path: str, function: str, env: Optional[Dict[str, str]]) -> str:
+    here = os.path.dirname(os.path.abspath(__file__))
+    # Baked in for programs that run it with a clean environment (textual_terminal does)
+    defaults = ''.join(f'os.environ.setdefault({key!r}, {value!r})\n' for key, value in (env or {}).items())
+    with open(path, 'w') as f:
+        f.write(f'#!{sys.executable}\n'
+                'import os\n'
+                'import sys\n'
+                f'{defaults}'
+                f'sys.path.insert(0, {here!r})\n'
+                f'from fake_multipass import {function}\n'
+                f'sys.exit({function}())\n')
+    os.chmod(path, 0o755)
+    return path
+
+
+def install_fake_multipass(bin_dir: str, env: Optional[Dict[str, str]] = None) -> str:
+    """ Write a `multipass` launcher for this module into bin_dir, env sets defaults for its variables """
+    os.makedirs(bin_dir, exist_ok=True)
+    return _install_launcher(os.path.join(bin_dir, 'multipass'), 'main', env)
+
+
+def install_fake_ssh(bin_dir: str, env: Optional[Dict[str, str]] = None) -> str:
+    """ Write an `ssh` launcher for ssh_main into bin_dir """
+    os.makedirs(bin_dir, exist_ok=True)
+    return _install_launcher(os.path.join(bin_dir, 'ssh'), 'ssh_main', env)
+
+
+class FakeMultipass:
+    """
+    Put a fake multipass first on PATH for the duration of a with block
+
+    Args:
+        instances (int): How many instances to seed the fleet with.
+        latency (dict): Per-subcommand latency, see set_latency.
+        serve (bool): Also answer on a unix socket and point MULTIPASSER_SOCKET at it.
+
+    A fake `ssh` is put on PATH too, for hosts added with add_host.
+    """
+
+    def __init__(self, instances: int = 0, latency: Optional[Dict[str, float]] = None,
+                 prefix: str = 'vm', serve: bool = False):
+        self.instances = instances
+        self.serve = serve
+        self.server: Optional[FakeMultipassServer] = None
+        self.latency = latency or {}
+        self.prefix = prefix
+        self.root: Optional[str] = None
+        self.state_dir: Optional[str] = None
+        self.names: List[str] = []
+        self._saved_env: Dict[str, Optional[str]] = {}
+
+    def __enter__(self) -> 'FakeMultipass':
+        self.root = tempfile.mkdtemp(prefix='fake-multipass-')
+        self.state_dir = os.path.join(self.root, 'state')
+        self.hosts_dir = os.path.join(self.root, 'hosts')
+        # For SshTransport's control_dir, so pooled connections go away with the fake
+        self.ssh_control_dir = os.path.join(self.root, 'ssh')
+        bin_dir = os.path.join(self.root, 'bin')
+        os.makedirs(self.state_dir)
+        os.makedirs(self.hosts_dir)
+        install_fake_multipass(bin_dir, {STATE_ENV: self.state_dir})
+        install_fake_ssh(bin_dir, {HOSTS_ENV: self.hosts_dir})
+        for key in ('PATH', STATE_ENV, SOCKET_ENV, HOSTS_ENV, CACHE_DIR_ENV):
+            self._saved_env[key] = os.environ.get(key)
+        os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+        os.environ[STATE_ENV] = self.state_dir
+        os.environ[HOSTS_ENV] = self.hosts_dir
+        # Keep the image catalog cache away from the real one
+        os.environ[CACHE_DIR_ENV] = os.path.join(self.root, 'cache')
+        os.environ.pop(SOCKET_ENV, None)
+        self.names = seed_fleet(self.state_dir, self.instances, self.prefix)
+        set_latency(self.state_dir, self.latency)
+        if self.serve:
+            self.socket_path = os.path.join(self.root, 'multipass.sock')
+            self.server = FakeMultipassServer(self.socket_path, self.state_dir).start()
+            os.environ[SOCKET_ENV] = self.socket_path
+        self._reset_utils()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.server is not None:
+            self.server.stop()
+        for key, value in self._saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        shutil.rmtree(self.root, ignore_errors=True)
+        self._reset_utils()
+
+    @staticmethod
+    def _reset_utils() -> None:
+        # Don't let another fleet's instances leak in through the cache, and
+        # pick the transport again now MULTIPASSER_SOCKET has changed
+        if 'multipass_utils' in sys.modules:
+            sys.modules['multipass_utils'].remove_hosts()
+            sys.modules['multipass_utils'].invalidate_instance_cache()
+            sys.modules['multipass_utils'].set_transport(None)
+        if 'multipass_catalog' in sys.modules:
+            sys.modules['multipass_catalog'].image_catalog.forget()
+
+    @staticmethod
+    def _invalidate_cache() -> None:
+        if 'multipass_utils' in sys.modules:
+            sys.modules['multipass_utils'].invalidate_instance_cache()
+
+    def seed(self, count: int, states: Sequence[str] = SEED_STATES) -> List[str]:
+        self.names = seed_fleet(self.state_dir, count, self.prefix, states)
+        self._invalidate_cache()
+        return self.names
+
+    def set_latency(self, latency: Dict[str, float]) -> None:
+        set_latency(self.state_dir, latency)
+
+    def calls(self) -> List[List[str]]:
+        return read_calls(self.state_dir)
+
+    def clear_calls(self) -> None:
+        clear_calls(self.state_dir)
+
+    def instances_by_name(self) -> Dict[str, Any]:
+        with locked_state(self.state_dir, write=False) as instances:
+            return dict(instances)
+
+    def add_host(self, name: str, instances: int = 0, latency: Optional[Dict[str, float]] = None,
+                 handshake: float = 0.0, prefix: Optional[str] = None) -> List[str]:
+        """
+        Make another host the fake ssh can reach, at address `name`
+
+        Args:
+            name (str): The host's address.
+            instances (int): How many instances to seed it with.
+            latency (dict): Per-subcommand latency on that host, see set_latency.
+            handshake (float): Seconds a new ssh connection takes.
+            prefix (str): Instance name prefix, the same as this machine's by default.
+
+        Returns:
+            list: The instance names on that host
+        """
+        state_dir = self.host_state_dir(name)
+        os.makedirs(state_dir, exist_ok=True)
+        names = seed_fleet(state_dir, instances, prefix or self.prefix)
+        set_latency(state_dir, latency or {})
+        set_handshake(state_dir, handshake)
+        self._invalidate_cache()
+        return names
+
+    def host_state_dir(self, name: str) -> str:
+        return os.path.join(self.hosts_dir, name)
+
+    def host_calls(self, name: str) -> List[List[str]]:
+        """ The multipass argvs run on another host, oldest first """
+        return read_calls(self.host_state_dir(name))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--serve':
+        # python fake_multipass.py --serve /tmp/multipasser.sock
+        async def serve_forever():
+            server = await serve(sys.argv[2], os.environ[STATE_ENV])
+            await server.serve_forever()
+        asyncio.run(serve_forever())
+    else:
+        sys.exit(main())
@@ -5,20 +5,129 @@ Purpose: Multipass TU
 """
 
 # Python Files
+# Only what the first frame needs, the table and what mptui() builds. The
+# headless commands, other hosts, the warm pool, the image catalog, exec,
+# snapshots and sync are imported by the action, worker or branch using them.
 from multipass_utils import *
+from multipass_metrics import command_metrics, format_metrics
+from multipass_operations import OperationQueue
+from multipass_search import InstanceIndex
+from multipass_activity import ActivityEntry, ActivityLog, ACTIVITY_CAPACITY
+from multipass_shells import ShellPool, SHELL_POOL_SIZE, SHELL_PREWARM_DELAY
+from multipass_resources import ResourceSampler, sparkline, RESOURCE_SAMPLE_INTERVAL, RESOURCE_RETENTION
 # Generic Libraries
 import argparse
-from typing import Dict, Any
+import os
+import shlex
+import shutil
+import sys
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Any, List, Optional, Set, Tuple
+if TYPE_CHECKING:
+    from multipass_catalog import ImageCatalog
+    from multipass_pool import WarmPool
 # Textual
-from textual import log, on
-from textual.app import App, ComposeResult, events
-from textual.containers import Container
-from textual.widgets import Header, Footer, DataTable, Input, Button, Label, RichLog
-from textual.widgets.data_table import RowDoesNotExist
+# Only what the first frame needs is imported here, anything used by a single
+# feature (screens, progress bars, the terminal) is imported when it's used.
+from textual import log, work
+from textual.app import App, ComposeResult
+from textual.containers import Container, Horizontal, Vertical
+from textual.widgets import Header, Footer, DataTable, Label, Static
+from textual.geometry import Size
 from textual.screen import ModalScreen
-# https://github.com/mitosch/textual-terminal/pull/11/files
-# nano /Users/iain/Code/Github/MultiPasser/venv/lib/python3.12/site-packages/textual_terminal/_terminal.py
-from textual_terminal import Terminal
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+from textual.suggester import Suggester
+from textual.worker import get_current_worker
+from rich.text import Text
+
+
+def diff_table_rows(current: Dict[str, List[str]], rows: List[List[str]]
+                    ) -> Tuple[List[List[str]], List[str], List[Tuple[str, int, str]]]:
+    """
+    Work out what has to change to turn the table into the new rows.
+
+    Rows are keyed by instance name, which is always column 0.
+
+    Args:
+        current (dict): Instance name -> the cells currently shown.
+        rows (list): The new rows, without the header.
+
+    Returns:
+        tuple: (rows to add, names to remove, (name, column index, value) cells to update)
+    """
+    added = []
+    changed = []
+    seen = set()
+    for row in rows:
+        name = row[0]
+        seen.add(name)
+        old_row = current.get(name)
+        if old_row is None:
+            added.append(row)
+            continue
+        if old_row is row:
+            # The caller passed back what's already shown
+            continue
+        for index, value in enumerate(row):
+            if index >= len(old_row) or old_row[index] != value:
+                changed.append((name, index, value))
+    removed = [name for name in current if name not in seen]
+    return added, removed, changed
+
+
+def format_bytes(value: Any) -> str:
+    """1073741824 -> '1.0GiB'"""
+    try:
+        size = float(value)
+    except (TypeError, ValueError):
+        return "--"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TiB"
+
+
+def format_instance_info(name: str, info: Dict[str, Any]) -> str:
+    """The detail pane text for one instance's `multipass info`"""
+    memory = info.get("memory") or {}
+    disks = info.get("disks") or {}
+    mounts = info.get("mounts") or {}
+    lines = [
+        f"[b]{name}[/b]",
+        f"State:     {info.get('state', '--')}",
+        f"Release:   {info.get('release') or '--'}",
+        f"Image:     {(info.get('image_hash') or '--')[:12]} ({info.get('image_release') or '--'})",
+        f"IPv4:      {', '.join(info.get('ipv4') or []) or '--'}",
+        f"CPUs:      {info.get('cpu_count') or '--'}",
+        f"Load:      {' '.join(str(load) for load in info.get('load') or []) or '--'}",
+        f"Memory:    {format_bytes(memory.get('used'))} / {format_bytes(memory.get('total'))}",
+    ]
+    for disk, usage in disks.items():
+        lines.append(f"Disk {disk}: {format_bytes(usage.get('used'))} / {format_bytes(usage.get('total'))}")
+    lines.append(f"Snapshots: {info.get('snapshot_count', '0')}")
+    lines.append(f"Mounts:    {len(mounts) or '--'}")
+    for target, mount in mounts.items():
+        lines.append(f"  {mount.get('source_path', '?')} => {target}")
+    return "\n".join(lines)
+
+
+# Wait this long after the cursor stops before asking multipass for details
+DETAILS_DEBOUNCE = 0.3
+
+# Key and marker of the bulk selection column
+SELECTED_COLUMN = "_selected"
+SELECTED_MARK = "✔"
+# Removing more rows than this at once rebuilds the table instead
+TABLE_REBUILD_THRESHOLD = 20
+
+# How often (seconds) the stats panel redraws while it is open
+STATS_REFRESH_INTERVAL = 1.0
+
+# Sparkline columns: key -> (heading, metric)
+SPARKLINE_COLUMNS = {"_load": ("Load", "load"), "_memory": ("Memory", "memory")}
+SPARKLINE_WIDTH = 12
 
 
 class HelpScreen(ModalScreen[None]):
@@ -45,25 +154,162 @@ class HelpScreen(ModalScreen[None]):
     """
 
     def compose(self) -> ComposeResult:
+        from textual.widgets import Input
         with Container(id="help-screen-container"):
             yield Label("A MultiPasss Text UI")
             yield Label("Hopefully you find it useful.")
             yield Input()
             yield Label("Press ESC to exit.", id="exit")
 
-    @on(Input.Submitted)
-    def on_input_submitted(self):
-        input = self.query_one(Input)
-        return input.value
+    def on_input_submitted(self, event) -> str:
+        return event.value
+
+
+class LaunchProgressRow(Horizontal):
+    """A label and progress bar for one launch in flight"""
+
+    DEFAULT_CSS = """
+    LaunchProgressRow {
+        height: 1;
+
+        & > Label {
+            width: 50;
+        }
+    }
+    """
+
+    def __init__(self, title: str) -> None:
+        super().__init__()
+        self.title = title
+
+    def compose(self) -> ComposeResult:
+        from textual.widgets import ProgressBar
+        yield Label(f"{self.title}: Starting launch")
+        yield ProgressBar(total=100, show_eta=False)
+
+    def show_progress(self, progress: LaunchProgress) -> None:
+        if progress.name:
+            self.title = progress.name
+        self.query_one(Label).update(f"{self.title}: {progress.message}")
+        self.query_one("ProgressBar").update(progress=progress.overall)
+
+
+class CatalogSuggester(Suggester):
+    """Completes image names and aliases from the cached `multipass find` catalog"""
+
+    def __init__(self, catalog: "ImageCatalog") -> None:
+        # The catalog can change under it, and a lookup is cheap anyway
+        super().__init__(use_cache=False)
+        self.catalog = catalog
+
+    async def get_suggestion(self, value: str) -> Optional[str]:
+        return self.catalog.complete(value)
+
+
+def format_activity_entry(entry: ActivityEntry) -> Text:
+    """One log line: the time, the instance, then the text, red if it's an error"""
+    return Text.assemble((time.strftime("%H:%M:%S ", time.localtime(entry.time)), "dim"),
+                         (f"[{entry.instance}] " if entry.instance else "", "bold"),
+                         (entry.text, "red" if entry.result in ("failed", "stderr") else ""))
+
+
+class ActivityView(ScrollView):
+    """
+    The activity log, or what a search of it matched
+
+    Nothing is copied into the widget, only the lines on screen are drawn,
+    straight from the log's ring, so it costs the same however long the
+    session runs.
+    """
+
+    DEFAULT_CSS = """
+    ActivityView {
+        height: 10;
+        border-top: solid $primary;
+    }
+    """
+
+    def __init__(self, activity: ActivityLog, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.activity = activity
+        # What the last search matched, None to show the log as it grows
+        self.matches: Optional[List[ActivityEntry]] = None
+        # Longest line seen, for the horizontal scrollbar
+        self.widest = 0
+        self.border_title = "Activity"
+
+    @property
+    def shown(self):
+        return self.activity if self.matches is None else self.matches
+
+    def on_mount(self) -> None:
+        self.activity.subscribe(self.on_entry_added)
+        self.widest = max((format_activity_entry(entry).cell_len for entry in self.activity), default=0)
+        self.virtual_size = Size(self.widest, len(self.shown))
+
+    def on_entry_added(self, entry: ActivityEntry) -> None:
+        self.widest = max(self.widest, format_activity_entry(entry).cell_len)
+        if self.matches is not None:
+            # A search is a snapshot, it's not redone as entries arrive
+            return
+        following = self.is_vertical_scroll_end
+        if not following and len(self.activity) == self.activity.capacity:
+            # Everything moved up one, keep the same lines in view
+            self.scroll_to(y=max(0, self.scroll_y - 1), animate=False, immediate=True)
+        self.virtual_size = Size(self.widest, len(self.activity))
+        if following:
+            self.scroll_end(animate=False, immediate=True, x_axis=False)
+        self.refresh()
+
+    def search(self, query: str) -> None:
+        """Show only the entries matching query, in memory and on disk, or the whole log again if it's empty"""
+        query = query.strip()
+        if query:
+            self.border_title = f"Activity: searching for {query!r}"
+            self.search_in_thread(query)
+        else:
+            self.workers.cancel_group(self, "activity-search")
+            self.show_matches(query, None)
+
+    @work(group="activity-search", exclusive=True, thread=True)
+    def search_in_thread(self, query: str) -> None:
+        """Search off the event loop, the files on disk can be 20MB"""
+        matches = self.activity.search(query)
+        if not get_current_worker().is_cancelled:
+            self.app.call_from_thread(self.show_matches, query, matches)
+
+    def show_matches(self, query: str, matches: Optional[List[ActivityEntry]]) -> None:
+        self.matches = matches
+        if matches is None:
+            self.border_title = "Activity"
+        else:
+            self.border_title = f"Activity: {len(matches)} matching {query!r} (a, then enter to clear)"
+        self.virtual_size = Size(self.widest, len(self.shown))
+        self.scroll_end(animate=False, immediate=True, x_axis=False)
+        self.refresh()
+
+    def render_line(self, y: int) -> Strip:
+        scroll_x, scroll_y = self.scroll_offset
+        width = self.scrollable_content_region.width
+        shown = self.shown
+        index = scroll_y + y
+        if index >= len(shown):
+            return Strip.blank(width, self.rich_style)
+        strip = Strip(list(format_activity_entry(shown[index]).render(self.app.console)))
+        return strip.crop_extend(scroll_x, scroll_x + width, self.rich_style)
 
 
 # https://textual.textualize.io/tutorial/
 class mptui(App):
     """A Textual app to manage multipass."""
 
+    # Not the filter bar, it's hidden until asked for
+    AUTO_FOCUS = "#datatable"
+
     BINDINGS = [
                 ("h", "get_help", "Help"),
                 ("c", "quick_create_instance", "Quick Create"),
+                ("n", "launch_instance", "Launch"),
                 ("[", "stop_instance", "Stop"),
                 ("]", "start_instance", "Start"),
                 ("p", "suspend_instance", "Suspend"),
@@ -74,133 +320,940 @@ class mptui(App):
                 ("!", "purge_all", "Purge ALL"),
                 ("/", "refresh_table", "Refresh Table"),
                 ("s", "shell_into", "Shell"),               
+                ("space", "toggle_selection", "Select"),
+                ("*", "select_same_state", "Select State"),
+                ("escape", "clear_selection", "Clear Selection"),
+                ("m", "toggle_stats", "Stats"),
+                ("f", "filter", "Filter"),
+                ("x", "exec_command", "Exec"),
+                ("t", "snapshot_instances", "Snapshot"),
+                ("u", "restore_instances", "Restore"),
+                ("k", "clone_instances", "Clone"),
+                ("l", "list_snapshots", "Snapshots"),
+                ("y", "sync_directory", "Sync"),
+                ("a", "search_activity", "Search Log"),
                 ("q", "quit", "QUIT")
                 ]
 
+    def __init__(self, *args, sample_interval: float = RESOURCE_SAMPLE_INTERVAL,
+                 sample_retention: int = RESOURCE_RETENTION, shell_pool_size: int = SHELL_POOL_SIZE,
+                 prewarm_shells: bool = False, exec_parallel: Optional[int] = None,
+                 warm_pool: Optional["WarmPool"] = None, snapshot_parallel: Optional[int] = None,
+                 sync_parallel: Optional[int] = None, activity_log: Optional[ActivityLog] = None,
+                 **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        # What the table is currently showing, so refreshes can be diffed
+        self.table_columns: List[str] = []
+        self.table_rows: Dict[str, List[str]] = {}
+        # Instance names picked for bulk actions
+        self.selected_instances: Set[str] = set()
+        # Numbers the launch progress bars
+        self.launches_started = 0
+        # Pending detail pane fetch, restarted on every cursor move
+        self.details_timer = None
+        # Keeps the table live in the background
+        self.watcher = InstanceWatcher()
+        # Load and memory history for the sparklines
+        self.sampler = ResourceSampler(sample_interval, sample_retention)
+        # Start/stop/etc. per instance, collapsed while they wait
+        self.operations = OperationQueue()
+        # Redraws the stats panel, only while it's open
+        self.stats_timer = None
+        # Every instance, for filtering and sorting the table
+        self.index = InstanceIndex()
+        self.filter_query = ""
+        # The names in the table, in order, as of the last show_instances
+        self.shown_names: List[str] = []
+        # Table column heading and whether it's reversed
+        self.sort_column: Tuple[str, bool] = ("Name", False)
+        # Shells left open per instance, so going back to one is instant
+        self.shells = ShellPool(self.open_shell, self.close_shell,
+                                lambda terminal: terminal.emulator is not None, shell_pool_size)
+        # Open a shell in the background for the running instance under the cursor
+        self.prewarm_shells = prewarm_shells
+        self.prewarm_timer = None
+        # How many instances an exec runs on at once, None for EXEC_PARALLEL
+        self.exec_parallel = exec_parallel
+        # Instances launched ahead of time for Quick Create, None if it's off
+        self.warm_pool = warm_pool
+        # How many instances are snapshotted, restored or cloned at once, None for SNAPSHOT_PARALLEL
+        self.snapshot_parallel = snapshot_parallel
+        # How many instances a sync copies to at once, None for SYNC_PARALLEL
+        self.sync_parallel = sync_parallel
+        # What the State column shows while a snapshot, restore, clone or sync is underway
+        self.progress_labels: Dict[str, str] = {}
+        # What has happened, the newest in memory and the rest on disk
+        self.activity = activity_log if activity_log is not None else ActivityLog()
+        # Gets what was typed in the prompt bar (exec, snapshot names, sync paths)
+        self.prompt_callback: Optional[Callable[[str], None]] = None
+
+    DEFAULT_CSS = """
+    #launches {
+        height: auto;
+    }
+
+    #main {
+        height: 1fr;
+    }
+
+    #details {
+        width: 48;
+        padding: 0 1;
+        border-left: solid $primary;
+    }
+
+    #filter {
+        display: none;
+    }
+
+    #filter.open {
+        display: block;
+    }
+
+    #prompt {
+        display: none;
+    }
+
+    #prompt.open {
+        display: block;
+    }
+
+    #shells {
+        display: none;
+        height: 1fr;
+        border-top: solid $primary;
+    }
+
+    #shells.open {
+        display: block;
+    }
+
+    #stats {
+        display: none;
+        height: auto;
+        max-height: 16;
+        padding: 0 1;
+        border-top: solid $primary;
+    }
+
+    #stats.open {
+        display: block;
+    }
+    """
+
     def compose(self) -> ComposeResult:
         """Create child widgets for the app."""
+        from textual.widgets import Input
         yield Header()
-        yield DataTable(cursor_type="row", id="datatable")
-        yield RichLog()
-        # yield Terminal(id="terminal_bash")
+        yield Input(placeholder="Filter: name, state:running, release:24.04, ip:10.0", id="filter")
+        yield Input(id="prompt")
+        with Horizontal(id="main"):
+            yield DataTable(cursor_type="row", id="datatable")
+            yield Static(id="details")
+        # The pooled shells, only the one being used is shown
+        yield Container(id="shells")
+        yield Vertical(id="launches")
+        yield Static(id="stats")
+        yield ActivityView(self.activity, id="activity")
         yield Footer()
 
     def action_get_help(self) -> None:
         value = self.push_screen(HelpScreen())
         self.notify(f"Help Screen: {value}")
-        # self.query_one(RichLog).write(value)
 
-    def refresh_table(self) -> None:
-        rows = get_instances_for_textual_datatable()
+    async def refresh_table(self, force: bool = False) -> None:
+        records = await get_instance_records_async(force=force)
+        if records is None:
+            return
+        self.index.update(records)
+        self.show_instances()
+
+    def show_instances(self, reproject: bool = True) -> None:
+        """
+        Show the instances that match the filter, in the chosen order
+
+        Args:
+            reproject (bool): The instances changed, rebuild every row. If only
+                the filter or the order changed, rows already shown are reused.
+        """
+        column, reverse = self.sort_column
+        names = self.index.view(self.filter_query, INSTANCE_TABLE_COLUMNS[column], reverse)
+        search = self.query_one("#filter")
+        search.border_title = f"{len(names)} of {len(self.index)}" if self.filter_query else ""
+        columns = instance_table_columns()
+        if reproject or columns != self.table_columns:
+            rows = instance_table_rows([self.index.records[name] for name in names], columns)
+            rows = self.with_pending_states(columns, rows)
+        elif names == self.shown_names:
+            return
+        else:
+            missing = [name for name in names if name not in self.table_rows]
+            new_rows = instance_table_rows([self.index.records[name] for name in missing], columns)
+            fresh = dict(zip(missing, self.with_pending_states(columns, new_rows)))
+            rows = [self.table_rows.get(name) or fresh[name] for name in names]
+        self.update_table(columns, rows)
+        self.shown_names = names
         table = self.query_one(DataTable)
-        table = table.clear(columns=True)
-        table.add_columns(*rows[0])
-        table.add_rows(rows[1:])
+        if [row.key.value for row in table.ordered_rows] != names:
+            position = {name: index for index, name in enumerate(names)}
+            table.sort("Name", key=lambda name: position[name])
+
+    def with_pending_states(self, columns: List[str], rows: List[List[str]]) -> List[List[str]]:
+        """Show what queued operations will do rather than what multipass last said"""
+        if "State" not in columns:
+            return rows
+        state_index = columns.index("State")
+        for row in rows:
+            label = self.operations.label(row[0]) or self.progress_labels.get(row[0])
+            if label is not None:
+                row[state_index] = label
+        return rows
 
-    def get_selected_instance_name(self) -> str:
+    def update_table(self, columns: List[str], rows: List[List[str]]) -> None:
+        """Apply only what changed to the table, keeping the cursor on the same instance"""
         table = self.query_one(DataTable)
-        value = table.get_row_at(table.cursor_row)
-        # Name has to 'always' be 0 column
-        instance_name = value[0]
+        if columns != self.table_columns:
+            # Only happens on the first load, or if multipass changes its output
+            table.clear(columns=True)
+            self.table_columns = list(columns)
+            self.table_rows = {}
+            # Ticked for rows in the bulk selection
+            table.add_column(" ", key=SELECTED_COLUMN)
+            for column in columns:
+                table.add_column(column, key=column)
+            for key, (heading, _) in SPARKLINE_COLUMNS.items():
+                table.add_column(heading, key=key, width=SPARKLINE_WIDTH)
+        selected = self.get_selected_instance_name()
+        added, removed, changed = diff_table_rows(self.table_rows, rows)
+        if len(removed) > TABLE_REBUILD_THRESHOLD:
+            # Each remove_row renumbers every row, so start again instead
+            table.clear()
+            self.selected_instances.intersection_update(row[0] for row in rows)
+            self.table_rows = {}
+            added, removed, changed = rows, [], []
+        for name in removed:
+            table.remove_row(name)
+            del self.table_rows[name]
+            self.selected_instances.discard(name)
+        for name, index, value in changed:
+            table.update_cell(name, columns[index], value)
+            self.table_rows[name][index] = value
+        for row in added:
+            table.add_row(self.selection_mark(row[0]), *row, *self.sparklines(row[0]), key=row[0])
+            self.table_rows[row[0]] = list(row)
+        if selected in self.table_rows:
+            table.move_cursor(row=table.get_row_index(selected))
+
+    def sparklines(self, instance_name: str) -> List[str]:
+        return [sparkline(self.sampler.history.series(instance_name, metric), SPARKLINE_WIDTH)
+                for _, metric in SPARKLINE_COLUMNS.values()]
+
+    def on_resources_sampled(self, instance_names: List[str]) -> None:
+        """Redraw the sparklines of the instances that were just sampled"""
+        table = self.query_one(DataTable)
+        for instance_name in instance_names:
+            if instance_name not in self.table_rows:
+                continue
+            for key, line in zip(SPARKLINE_COLUMNS, self.sparklines(instance_name)):
+                table.update_cell(instance_name, key, line)
+
+    def selection_mark(self, instance_name: str) -> str:
+        return SELECTED_MARK if instance_name in self.selected_instances else ""
+
+    def set_selected(self, instance_name: str, selected: bool) -> None:
+        if selected:
+            self.selected_instances.add(instance_name)
+        else:
+            self.selected_instances.discard(instance_name)
+        self.query_one(DataTable).update_cell(instance_name, SELECTED_COLUMN,
+                                              self.selection_mark(instance_name))
+
+    def get_target_instance_names(self) -> List[str]:
+        """The selected instances, or the one under the cursor if nothing is selected"""
+        if self.selected_instances:
+            return sorted(self.selected_instances)
+        instance_name = self.get_selected_instance_name()
+        if instance_name is None:
+            self.notify("No instances", severity="error")
+            return []
+        return [instance_name]
+
+    def get_selected_instance_name(self) -> Optional[str]:
+        """The instance under the cursor, None if the table is empty"""
+        table = self.query_one(DataTable)
+        if table.row_count == 0:
+            return None
+        # Rows are keyed by the instance name
+        row_key, _ = table.coordinate_to_cell_key(table.cursor_coordinate)
+        instance_name = row_key.value
         return instance_name
 
     def on_mount(self) -> None:
-        self.refresh_table()
-        # terminal_bash: Terminal = self.query_one("#terminal_bash")
-        # terminal_bash.start()
+        # Nothing here waits on multipass, so the first frame paints straight away
+        self.check_multipass_version()
+        self.run_worker(self.refresh_table(), group="refresh", exclusive=True)
+        self.watcher.subscribe(self.on_instances_changed)
+        self.run_worker(self.watcher.run(), group="watch", exclusive=True)
+        self.sampler.subscribe(self.on_resources_sampled)
+        self.operations.subscribe(self.on_operations_changed)
+        self.run_worker(self.sampler.run(), group="sampler", exclusive=True)
+        # Load the image catalog from disk for the launch prompt, refreshing it if it's stale
+        self.run_worker(self.load_image_catalog(), group="catalog", exclusive=True)
+        if self.warm_pool is not None and self.warm_pool.size:
+            self.run_worker(self.warm_pool.run(), group="pool", exclusive=True)
+
+    @work(group="startup")
+    async def check_multipass_version(self) -> None:
+        """Show the multipass version, or complain if there isn't one"""
+        version = await get_multipass_version_async()
+        log(f"MP Version is: {version}")
+        if version is None:
+            self.notify("Can't run multipass, is it installed?", severity="error", timeout=30)
+        else:
+            self.sub_title = f"multipass {version}"
+
+    @work(group="multipass")
+    async def run_multipass_operation(self, operation, *args) -> None:
+        """Run a multipass operation off the event loop, then refresh the table"""
+        await operation(*args)
+        self.watcher.poke()
+        await self.refresh_table()
+
+    def on_operations_changed(self, operation: str, instance_names: List[str],
+                              results: Optional[Dict[str, bool]]) -> None:
+        """Show queued operations straight away, and refresh once they have run"""
+        if results is None:
+            if "State" not in self.table_columns:
+                return
+            for instance_name in instance_names:
+                label = self.operations.label(instance_name)
+                if label is not None:
+                    self.set_state_cell(instance_name, label)
+            return
+        for instance_name, ok in results.items():
+            self.activity.add(f"{operation} {'done' if ok else 'failed'}", instance_name, operation,
+                              "ok" if ok else "failed")
+        failed = [instance_name for instance_name, ok in results.items() if not ok]
+        if failed:
+            self.notify(f"Couldn't {operation} {', '.join(failed)}", severity="error")
+        self.watcher.poke()
+        self.run_worker(self.refresh_table(), group="refresh", exclusive=True)
+
+    def set_state_cell(self, instance_name: str, label: str) -> None:
+        """Show something other than what multipass last said in an instance's State column"""
+        if "State" not in self.table_columns or instance_name not in self.table_rows:
+            return
+        self.query_one(DataTable).update_cell(instance_name, "State", label)
+        self.table_rows[instance_name][self.table_columns.index("State")] = label
+
+    def on_data_table_row_highlighted(self, event: DataTable.RowHighlighted) -> None:
+        """Show the details of the highlighted instance once the cursor settles"""
+        if event.row_key is None or event.row_key.value is None:
+            return
+        if self.details_timer is not None:
+            self.details_timer.stop()
+        name = event.row_key.value
+        self.details_timer = self.set_timer(DETAILS_DEBOUNCE, lambda: self.show_details(name))
+        if self.prewarm_shells:
+            if self.prewarm_timer is not None:
+                self.prewarm_timer.stop()
+            self.prewarm_timer = self.set_timer(SHELL_PREWARM_DELAY, lambda: self.prewarm_shell(name))
+
+    @work(group="details", exclusive=True)
+    async def show_details(self, name: str) -> None:
+        """Fill the detail pane from the info cache, fetching only if needed"""
+        # What multipass last said, not a label like "Stopping…" in the State column
+        record = self.index.records.get(name)
+        info = await get_instance_info_async(name, record.state if record is not None else None)
+        details = self.query_one("#details", Static)
+        if info is None:
+            details.update(f"[b]{name}[/b]\nNo details available")
+        else:
+            details.update(format_instance_info(name, info))
+
+    def on_instances_changed(self, events: List[InstanceEvent]) -> None:
+        """Called by the watcher when instances appear, vanish or change"""
+        for event in events:
+            if isinstance(event, (InstanceStateChanged, InstanceRemoved, InstanceIpChanged)):
+                instance_info_cache.invalidate(event.name)
+            if (isinstance(event, InstanceRemoved)
+                    or isinstance(event, InstanceStateChanged) and event.new_state != "Running"):
+                # Its shell has gone (or will), don't keep it around
+                if event.name == self.shells.active:
+                    self.hide_shells()
+                self.shells.discard(event.name)
+            if self.warm_pool is not None and self.warm_pool.is_member(event.name):
+                # Someone else started or deleted it, or a launch finished
+                self.warm_pool.poke()
+            if isinstance(event, InstanceStateChanged):
+                self.activity.add(f"{event.old_state} -> {event.new_state}", event.name, "state")
+            elif isinstance(event, InstanceIpChanged):
+                self.activity.add(f"IPv4 {', '.join(event.new_ipv4) or '--'}", event.name, "ip")
+            elif isinstance(event, InstanceRemoved):
+                self.activity.add("removed", event.name, "state")
+                from multipass_sync import forget_manifests
+                forget_manifests(event.name)
+        self.run_worker(self.refresh_table(), group="refresh", exclusive=True)
 
     # ACTIONS
     def action_refresh_table(self) -> None:
         """An action to refresh the table"""
-        self.refresh_table()
+        self.run_worker(self.refresh_table(force=True), group="refresh", exclusive=True)
 
     def action_stop_all(self) -> None:
         """An action to stop all instances"""
-        self.notify(f"Stopped ALL Instances")
-        stop_all_instances()
-        self.refresh_table()
+        self.notify("Stopped ALL Instances")
+        self.run_multipass_operation(stop_all_instances_async)
 
     def action_start_all(self) -> None:
         """An action to start all instances"""
-        self.notify(f"Started ALL Instances")
-        start_all_instances()
-        self.refresh_table()
+        self.notify("Started ALL Instances")
+        self.run_multipass_operation(start_all_instances_async)
 
     def action_start_instance(self) -> None:
         """An action to start the selected instances"""
-        instance_name = self.get_selected_instance_name()
-        self.notify(f"Started {instance_name}")
-        start_instance(instance_name)
-        self.refresh_table()
+        instance_names = self.get_target_instance_names()
+        if instance_names:
+            self.operations.submit(instance_names, "start")
 
     def action_suspend_instance(self) -> None:
         """An action to suspend the selected instances"""
-        instance_name = self.get_selected_instance_name()
-        self.notify(f"Suspended {instance_name}")
-        suspend_instance(instance_name)
-        self.refresh_table()
+        instance_names = self.get_target_instance_names()
+        if instance_names:
+            self.operations.submit(instance_names, "suspend")
 
     def action_stop_instance(self) -> None:
         """An action to stop the selected instances"""
-        instance_name = self.get_selected_instance_name()
-        self.notify(f"Stopped {instance_name}")
-        stop_instance(instance_name)
-        self.refresh_table()
+        instance_names = self.get_target_instance_names()
+        if instance_names:
+            self.operations.submit(instance_names, "stop")
 
     def action_delete_instance(self) -> None:
         """An action to delete the selected instances"""
-        instance_name = self.get_selected_instance_name()
-        self.notify(f"Deleted {instance_name}")
-        delete_instance(instance_name)
-        self.refresh_table()
+        instance_names = self.get_target_instance_names()
+        if instance_names:
+            self.operations.submit(instance_names, "delete")
 
     def action_recover_instance(self) -> None:
         """An action to rescover the selected instances"""
-        instance_name = self.get_selected_instance_name()
-        self.notify(f"Recovered {instance_name}")
-        recover_instance(instance_name)
-        self.refresh_table()
+        instance_names = self.get_target_instance_names()
+        if instance_names:
+            self.operations.submit(instance_names, "recover")
 
     def action_quick_create_instance(self) -> None:
         """An action to quickly create an instance"""
-        self.notify(f"Creating Instance")
-        quick_create_instance()
-        self.refresh_table()
+        self.notify("Creating Instance")
+        self.launches_started += 1
+        if self.warm_pool is not None and self.warm_pool.size:
+            self.quick_create_from_pool(f"Launch {self.launches_started}")
+        else:
+            self.launch_with_progress(f"Launch {self.launches_started}")
+
+    def action_launch_instance(self) -> None:
+        """An action to launch an instance of an image picked from `multipass find`"""
+        from multipass_catalog import image_catalog
+        # Served from the cache, this only starts a fetch if it's stale
+        self.run_worker(self.load_image_catalog(), group="catalog", exclusive=True)
+        self.open_prompt("Launch", "Image, e.g. 24.04, noble or docker (→ completes, empty for the default)",
+                         self.submit_launch, CatalogSuggester(image_catalog))
+
+    async def load_image_catalog(self) -> None:
+        from multipass_catalog import image_catalog
+        await image_catalog.get_async()
+
+    def submit_launch(self, image: str) -> None:
+        """Launch what was typed in the prompt, if the catalog knows it"""
+        from multipass_catalog import image_catalog
+        if image and image_catalog.images and image_catalog.lookup(image) is None:
+            self.notify(f"{image} isn't in the image catalog (multipass find)", severity="error")
+            return
+        self.launches_started += 1
+        self.launch_with_progress(f"Launch {self.launches_started}", image=image or None)
+
+    @work(group="launch")
+    async def quick_create_from_pool(self, title: str) -> None:
+        """Copy a warm pool instance, or launch one the slow way if none is ready"""
+        started = time.monotonic()
+        name = await self.warm_pool.take_async()
+        if name is None:
+            self.notify("No warm instance ready, launching one")
+            self.launch_with_progress(title, **self.warm_pool.launch_options)
+            return
+        self.activity.add(f"created from the warm pool in {time.monotonic() - started:.1f}s", name,
+                          "launch", "ok")
+        self.notify(f"Created {name} from the warm pool in {time.monotonic() - started:.1f}s")
+        self.watcher.poke()
+        await self.refresh_table()
+
+    @work(group="launch")
+    async def launch_with_progress(self, title: str, **launch_options) -> None:
+        """Launch an instance, showing its progress until it is up"""
+        row = LaunchProgressRow(title)
+        await self.query_one("#launches").mount(row)
+        try:
+            name = await launch_instance_async(on_progress=row.show_progress, **launch_options)
+        finally:
+            await row.remove()
+        if name:
+            self.activity.add("launched", name, "launch", "ok")
+            self.notify(f"Launched {name}")
+        else:
+            self.activity.add(f"{title} failed", operation="launch", result="failed")
+            self.notify(f"{title} failed", severity="error")
+        self.watcher.poke()
+        await self.refresh_table()
 
     def action_purge_all(self) -> None:
         """An action to purge all instances"""
-        self.notify(f"Purged All Instances")
-        purge_instances()
-        self.refresh_table()
+        self.notify("Purged All Instances")
+        self.run_multipass_operation(purge_instances_async)
+
+    def open_shell(self, name: str):
+        """Start `multipass shell` for an instance in a terminal, hidden until it's attached"""
+        # textual_terminal is only needed once a shell is opened
+        from textual_terminal import Terminal
+        argv = shell_argv(name)
+        # The terminal runs it without our PATH, so find it here
+        argv[0] = shutil.which(argv[0]) or argv[0]
+        terminal = Terminal(command=shlex.join(argv))
+        terminal.display = False
+        self.query_one("#shells").mount(terminal)
+        terminal.start()
+        return terminal
+
+    def close_shell(self, name: str, terminal) -> None:
+        terminal.stop()
+        terminal.remove()
+
+    def prewarm_shell(self, name: str) -> None:
+        """Open a shell in the background if the instance is running and hasn't one"""
+        row = self.table_rows.get(name)
+        if row is None or "State" not in self.table_columns:
+            return
+        if row[self.table_columns.index("State")] != "Running":
+            return
+        try:
+            if self.shells.prewarm(name) is not None:
+                log(f"Pre-warmed a shell for {name}")
+        except (OSError, TransportError) as e:
+            log(f"Couldn't pre-warm a shell for {name}: {e}")
+
+    def on_descendant_blur(self, event) -> None:
+        """Leaving a shell (ctrl+f1) drops focus altogether, so give it to the table"""
+        if event.widget.parent is self.query_one("#shells"):
+            self.call_after_refresh(self.focus_table_if_unfocused)
+
+    def focus_table_if_unfocused(self) -> None:
+        if self.focused is None:
+            self.query_one(DataTable).focus()
+
+    def hide_shells(self) -> None:
+        """Put the shell away, leaving it running in the pool"""
+        self.query_one("#shells").remove_class("open")
+        self.shells.detach()
+        self.query_one(DataTable).focus()
 
     def action_shell_into(self) -> None:
-        """An action to shell into the selected instances"""
+        """An action to shell into the highlighted instance, or put its shell away"""
+        instance_name = self.get_selected_instance_name()
+        if instance_name is None:
+            self.notify("No instances", severity="error")
+            return
+        shells = self.query_one("#shells")
+        if shells.has_class("open") and self.shells.active == instance_name:
+            self.hide_shells()
+            return
+        try:
+            terminal, reused = self.shells.attach(instance_name)
+        except (OSError, TransportError) as e:
+            self.notify(f"Couldn't open a shell in {instance_name}: {e}", severity="error")
+            return
+        for other in shells.children:
+            other.display = other is terminal
+        shells.add_class("open")
+        terminal.focus()
+        self.notify(f"{'Back in' if reused else 'Shelling into'} {instance_name} (ctrl+f1 to leave)")
+
+    def action_toggle_selection(self) -> None:
+        """An action to add or remove the highlighted instance from the selection"""
+        instance_name = self.get_selected_instance_name()
+        if instance_name is None:
+            self.notify("No instances", severity="error")
+            return
+        self.set_selected(instance_name, instance_name not in self.selected_instances)
+        self.query_one(DataTable).action_cursor_down()
+
+    def action_select_same_state(self) -> None:
+        """An action to select every instance in the same state as the highlighted one"""
+        if "State" not in self.table_columns:
+            return
         instance_name = self.get_selected_instance_name()
-        self.notify(f"Shelling into {instance_name}")
-        # shell_into(instance_name)
+        if instance_name is None:
+            self.notify("No instances", severity="error")
+            return
+        state_index = self.table_columns.index("State")
+        state = self.table_rows[instance_name][state_index]
+        for instance_name, row in self.table_rows.items():
+            if row[state_index] == state:
+                self.set_selected(instance_name, True)
+        self.notify(f"Selected {len(self.selected_instances)} Instances")
+
+    def action_clear_selection(self) -> None:
+        """An action to clear the selection, or close the prompt bar if it's open"""
+        if self.query_one("#prompt").has_class("open"):
+            self.close_prompt()
+            return
+        for instance_name in list(self.selected_instances):
+            self.set_selected(instance_name, False)
+
+    def action_filter(self) -> None:
+        """An action to open the filter bar"""
+        search = self.query_one("#filter")
+        search.add_class("open")
+        search.focus()
+
+    def get_bulk_instance_names(self) -> List[str]:
+        """The selected instances, else everything the filter shows, else the one under the cursor"""
+        if self.selected_instances:
+            return sorted(self.selected_instances)
+        if self.filter_query.strip():
+            names = list(self.shown_names)
+        else:
+            names = [name for name in [self.get_selected_instance_name()] if name]
+        if not names:
+            self.notify("No instances", severity="error")
+        return names
+
+    def open_prompt(self, title: str, placeholder: str, on_submit: Callable[[str], None],
+                    suggester: Optional[Suggester] = None) -> None:
+        """Ask for a line of text in the prompt bar, on_submit gets it"""
+        prompt = self.query_one("#prompt")
+        prompt.border_title = title
+        prompt.placeholder = placeholder
+        prompt.suggester = suggester
+        prompt.value = ""
+        self.prompt_callback = on_submit
+        prompt.add_class("open")
+        prompt.focus()
+
+    def close_prompt(self) -> None:
+        self.query_one("#prompt").remove_class("open")
+        self.prompt_callback = None
+        self.query_one(DataTable).focus()
+
+    def action_exec_command(self) -> None:
+        """An action to run a command on the target instances"""
+        names = self.get_bulk_instance_names()
+        if not names:
+            return
+        self.open_prompt(f"Run on {len(names)} instance{'' if len(names) == 1 else 's'}",
+                         "Command to run, e.g. sudo apt-get update", self.submit_exec)
+
+    def submit_exec(self, value: str) -> None:
+        """Run what was typed in the prompt, an empty one does nothing"""
+        try:
+            command = shlex.split(value)
+        except ValueError as e:
+            self.notify(f"Can't run that: {e}", severity="error")
+            return
+        names = self.get_bulk_instance_names()
+        if command and names:
+            self.exec_on_instances(names, command)
+
+    @work(group="exec")
+    async def exec_on_instances(self, names: List[str], command: List[str]) -> None:
+        """Run a command on instances at once, streaming the output into the log"""
+        self.activity.add(f"$ {shlex.join(command)}  ({len(names)} instance{'' if len(names) == 1 else 's'})",
+                          operation="exec")
+
+        def on_line(name: str, stream_name: str, line: str) -> None:
+            self.activity.add(line, name, "exec", "stderr" if stream_name == "stderr" else "")
+
+        from multipass_exec import exec_on_instances_async, format_exec_summary, EXEC_PARALLEL
+        parallel = EXEC_PARALLEL if self.exec_parallel is None else self.exec_parallel
+        results = await exec_on_instances_async(names, command, on_line, parallel=parallel)
+        self.log_summary("exec", format_exec_summary(results), results)
+        failed = sum(1 for result in results if not result.ok)
+        if failed:
+            self.notify(f"{shlex.join(command)} failed on {failed} of {len(results)}", severity="error")
+        else:
+            self.notify(f"{shlex.join(command)} succeeded on {len(results)}")
+
+    def action_snapshot_instances(self) -> None:
+        """An action to snapshot the target instances, stopping them first"""
+        names = self.get_bulk_instance_names()
+        if not names:
+            return
+        self.open_prompt(f"Snapshot {len(names)} instance{'' if len(names) == 1 else 's'}",
+                         "Snapshot name, empty for multipass's own (ESC to cancel)",
+                         lambda snapshot: self.run_snapshot_workflow("Snapshot", names, snapshot or None))
+
+    def action_restore_instances(self) -> None:
+        """An action to put the target instances back to a snapshot"""
+        names = self.get_bulk_instance_names()
+        if not names:
+            return
+        self.open_prompt(f"Restore {len(names)} instance{'' if len(names) == 1 else 's'}",
+                         "Snapshot to go back to, e.g. golden (this throws away their current state)",
+                         lambda snapshot: self.submit_restore(names, snapshot))
+
+    def submit_restore(self, names: List[str], snapshot: str) -> None:
+        """Restore to what was typed in the prompt, an empty one does nothing"""
+        if snapshot:
+            # The prompt says the current state is thrown away, typing a name is asking for that
+            self.run_snapshot_workflow("Restore", names, snapshot, True)
+
+    def action_clone_instances(self) -> None:
+        """An action to clone the target instances"""
+        self.run_snapshot_workflow("Clone", self.get_bulk_instance_names())
+
+    @work(group="snapshots")
+    async def run_snapshot_workflow(self, action: str, names: List[str], *args) -> None:
+        """Snapshot, restore or clone instances at once, showing each one's progress in the table"""
+        if not names:
+            return
+        from multipass_snapshots import (clone_instances_async, format_snapshot_summary, restore_instances_async,
+                                         snapshot_instances_async, SNAPSHOT_PARALLEL, SNAPSHOT_STAGES)
+        workflow = {"Snapshot": snapshot_instances_async, "Restore": restore_instances_async,
+                    "Clone": clone_instances_async}[action]
+        parallel = SNAPSHOT_PARALLEL if self.snapshot_parallel is None else self.snapshot_parallel
+
+        def on_progress(name: str, stage: str) -> None:
+            label = SNAPSHOT_STAGES.get(stage)
+            if label is None:
+                self.progress_labels.pop(name, None)
+            else:
+                self.progress_labels[name] = label
+                self.set_state_cell(name, label)
+
+        self.activity.add(f"{action} {len(names)} instance{'' if len(names) == 1 else 's'}",
+                          operation=action.lower())
+        try:
+            results = await workflow(names, *args, on_progress=on_progress, parallel=parallel)
+        finally:
+            for name in names:
+                self.progress_labels.pop(name, None)
+        self.log_summary(action.lower(), format_snapshot_summary(action, results), results)
+        failed = [result.name for result in results if not result.ok]
+        if failed:
+            self.notify(f"{action} failed for {', '.join(failed)}", severity="error")
+        else:
+            self.notify(f"{action} done for {len(results)} instance{'' if len(results) == 1 else 's'}")
+        self.watcher.poke()
+        await self.refresh_table(force=True)
+
+    def action_list_snapshots(self) -> None:
+        """An action to write the target instances' snapshots to the log"""
+        names = self.get_bulk_instance_names()
+        if names:
+            self.show_snapshots(names)
+
+    @work(group="snapshots")
+    async def show_snapshots(self, names: List[str]) -> None:
+        """Write the instances' snapshots to the log"""
+        snapshots = await list_snapshots_async(names)
+        if snapshots is None:
+            self.notify("Couldn't list the snapshots", severity="error")
+            return
+        for name in names:
+            items = snapshots.get(name, [])
+            self.activity.add(', '.join(item.name for item in items) or 'no snapshots', name, "snapshots")
+
+    def action_sync_directory(self) -> None:
+        """An action to copy a local directory to the target instances"""
+        names = self.get_bulk_instance_names()
+        if not names:
+            return
+        self.open_prompt(f"Sync to {len(names)} instance{'' if len(names) == 1 else 's'}",
+                         "LOCAL_DIR REMOTE_DIR, e.g. ./app /home/ubuntu/app (only changed files are sent)",
+                         lambda value: self.submit_sync(names, value))
+
+    def submit_sync(self, names: List[str], value: str) -> None:
+        """Sync what was typed in the prompt, an empty one does nothing"""
+        try:
+            paths = shlex.split(value)
+        except ValueError as e:
+            self.notify(f"Can't sync that: {e}", severity="error")
+            return
+        if not paths or not names:
+            return
+        if len(paths) != 2 or not os.path.isdir(paths[0]):
+            self.notify("Give a local directory and where it goes, e.g. ./app /home/ubuntu/app",
+                        severity="error")
+            return
+        self.sync_directory(names, paths[0], paths[1])
+
+    @work(group="sync")
+    async def sync_directory(self, names: List[str], source: str, destination: str) -> None:
+        """Copy the changed files of a directory to instances at once, showing each one's progress in the table"""
+        def on_progress(name: str, sent: int, total: int) -> None:
+            if sent < total:
+                label = self.progress_labels[name] = f"Syncing {sent}/{total}"
+                self.set_state_cell(name, label)
+
+        from multipass_sync import format_sync_summary, sync_to_instances_async, SYNC_PARALLEL
+        self.activity.add(f"{source} -> {destination}  ({len(names)} instance{'' if len(names) == 1 else 's'})",
+                          operation="sync")
+        started = time.monotonic()
+        try:
+            results = await sync_to_instances_async(
+                source, destination, names, on_progress=on_progress,
+                parallel=SYNC_PARALLEL if self.sync_parallel is None else self.sync_parallel)
+        finally:
+            for name in names:
+                self.progress_labels.pop(name, None)
+        self.log_summary("sync", format_sync_summary(results, time.monotonic() - started), results)
+        failed = [result.name for result in results if not result.ok]
+        if failed:
+            self.notify(f"Sync failed for {', '.join(failed)}", severity="error")
+        else:
+            self.notify(f"Synced {sum(result.sent for result in results)} files "
+                        f"to {len(results)} instance{'' if len(results) == 1 else 's'}")
+        await self.refresh_table(force=True)
+
+    def log_summary(self, operation: str, lines: List[str], results) -> None:
+        """Add a results summary to the activity log, lines about an instance as that instance's result"""
+        outcomes = {result.name: result.ok for result in results}
+        for line in lines:
+            name, _, rest = line.partition(" ")
+            if name in outcomes:
+                self.activity.add(rest.strip(), name, operation, "ok" if outcomes[name] else "failed")
+            else:
+                self.activity.add(line, operation=operation)
+
+    def action_search_activity(self) -> None:
+        """An action to show only the activity log entries matching a search"""
+        self.open_prompt("Search the activity log",
+                         "Words, instance:NAME, op:exec or result:failed (empty shows everything again)",
+                         self.query_one(ActivityView).search)
+
+    def on_input_changed(self, event) -> None:
+        """Narrow the table as the filter is typed"""
+        if event.input.id != "filter":
+            return
+        self.filter_query = event.value
+        self.show_instances(reproject=False)
+
+    def on_input_submitted(self, event) -> None:
+        """Back to the table, closing the filter bar if it's empty"""
+        if event.input.id == "prompt":
+            callback = self.prompt_callback
+            self.close_prompt()
+            if callback is not None:
+                callback(event.value.strip())
+            return
+        if event.input.id != "filter":
+            return
+        if not event.value.strip():
+            event.input.remove_class("open")
+        self.query_one(DataTable).focus()
+
+    def on_data_table_header_selected(self, event: DataTable.HeaderSelected) -> None:
+        """Sort by the clicked column, again to reverse it"""
+        column = event.column_key.value
+        if column not in INSTANCE_TABLE_COLUMNS:
+            return
+        current, reverse = self.sort_column
+        self.sort_column = (column, not reverse if column == current else False)
+        self.show_instances(reproject=False)
+
+    def action_toggle_stats(self) -> None:
+        """An action to show or hide how long multipass commands are taking"""
+        stats = self.query_one("#stats", Static)
+        stats.toggle_class("open")
+        if stats.has_class("open"):
+            self.update_stats()
+            self.stats_timer = self.set_interval(STATS_REFRESH_INTERVAL, self.update_stats)
+        elif self.stats_timer is not None:
+            self.stats_timer.stop()
+            self.stats_timer = None
+
+    def update_stats(self) -> None:
+        text = format_metrics(command_metrics)
+        if self.warm_pool is not None and self.warm_pool.size:
+            from multipass_pool import format_pool_stats
+            text += "\n" + format_pool_stats(self.warm_pool)
+        self.query_one("#stats", Static).update(text)
 
     def action_quit(self):
         self.exit()
 
+    async def on_unmount(self) -> None:
+        # However the app exits (q, ctrl+c, an error), stop the shells, flush
+        # the activity log and close the ssh connections to other hosts
+        self.shells.clear()
+        self.activity.close()
+        if get_hosts():
+            from multipass_hosts import close_hosts_async
+            await close_hosts_async()
+
 
-def get_args():
+def get_args(argv=None):
     """ Get passed args """
-    parser = argparse.ArgumentParser(description='Get Help')
-    parser.add_argument('-h', '--help', metavar='help',
-                        default='Runs a Text Interface for Multipass',
-                        help='Info on this util')
-    return parser.parse_args()
+    from multipass_cli import add_cli_arguments
+    from multipass_exec import EXEC_PARALLEL
+    from multipass_pool import WARM_POOL_PREFIX
+    parser = argparse.ArgumentParser(
+        prog='multipasser',
+        description='Runs a Text Interface for Multipass, or one of the commands below without it')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='Append a JSON line to FILE for every multipass command run')
+    parser.add_argument('--shells', type=int, default=SHELL_POOL_SIZE, metavar='N',
+                        help=f'How many shells to keep open for quick switching (default {SHELL_POOL_SIZE})')
+    parser.add_argument('--prewarm-shell', action='store_true',
+                        help='Open a shell in the background for the running instance under the cursor')
+    parser.add_argument('--exec-parallel', type=int, default=EXEC_PARALLEL, metavar='N',
+                        help=f'How many instances the Exec action runs on at once (default {EXEC_PARALLEL})')
+    parser.add_argument('--warm-pool', type=int, default=0, metavar='N',
+                        help='Keep N instances launched and stopped, so Quick Create only has to copy one')
+    parser.add_argument('--warm-image', metavar='IMAGE',
+                        help='What the warm pool (and Quick Create) launches, e.g. 24.04')
+    parser.add_argument('--warm-cpus', type=int, metavar='N', help='CPUs of warm pool instances')
+    parser.add_argument('--warm-memory', metavar='SIZE', help='Memory of warm pool instances, e.g. 2G')
+    parser.add_argument('--warm-disk', metavar='SIZE', help='Disk of warm pool instances, e.g. 10G')
+    parser.add_argument('--warm-prefix', default=WARM_POOL_PREFIX, metavar='PREFIX',
+                        help=f'What warm pool instances are named, PREFIX1, PREFIX2, ... '
+                             f'(default {WARM_POOL_PREFIX})')
+    parser.add_argument('--sample-interval', type=float, default=RESOURCE_SAMPLE_INTERVAL, metavar='SECONDS',
+                        help=f'How often CPU, memory and disk use are sampled for the sparklines '
+                             f'(default {RESOURCE_SAMPLE_INTERVAL:g})')
+    parser.add_argument('--sample-retention', type=int, default=RESOURCE_RETENTION, metavar='N',
+                        help=f'How many samples are kept per instance (default {RESOURCE_RETENTION})')
+    parser.add_argument('--activity-lines', type=int, default=ACTIVITY_CAPACITY, metavar='N',
+                        help=f'Activity log entries kept in memory, older ones go to a file '
+                             f'(default {ACTIVITY_CAPACITY})')
+    parser.add_argument('--hosts', metavar='FILE',
+                        help='Also manage the multipass instances on the hosts in FILE (YAML), over ssh')
+    add_cli_arguments(parser)
+    return parser.parse_args(argv)
 
 
 def main():
     """ Execute program """
 
+    args = get_args()
+    if args.metrics:
+        command_metrics.open_sink(args.metrics)
+    if args.hosts:
+        from multipass_hosts import HostInventoryError, use_inventory
+        try:
+            use_inventory(args.hosts)
+        except HostInventoryError as e:
+            print(f"Error: {e}")
+            sys.exit(2)
+    if args.command:
+        from multipass_cli import run_cli
+        sys.exit(run_cli(args))
     log("*** Program Started ***")
-    mp_version = get_multipass_version()
-    print(f"MP Version is: {mp_version}")
-    print("*** Program Ended ***")
     #-----------------------------------------------------
-    app = mptui()
+    from multipass_pool import WarmPool
+    warm_pool = WarmPool(args.warm_pool, image=args.warm_image, cpus=args.warm_cpus,
+                         memory=args.warm_memory, disk=args.warm_disk,
+                         prefix=args.warm_prefix) if args.warm_pool else None
+    app = mptui(sample_interval=args.sample_interval, sample_retention=args.sample_retention,
+                shell_pool_size=args.shells, prewarm_shells=args.prewarm_shell,
+                exec_parallel=args.exec_parallel, warm_pool=warm_pool,
+                activity_log=ActivityLog(args.activity_lines))
     app.run()
     #-----------------------------------------------------
 
@@ -0,0 +1,230 @@
+# Libraries
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Callable, Iterator, List, Optional, Tuple
+# Python Files
+from multipass_utils import cache_dir
+
+# How many entries are kept in memory. Older ones are appended to
+# ACTIVITY_FILE in cache_dir(), which is rotated at ACTIVITY_FILE_BYTES with
+# ACTIVITY_FILE_BACKUPS old files kept, so memory and disk use are both fixed
+# however long the UI runs.
+ACTIVITY_CAPACITY = 2000
+ACTIVITY_FILE = 'activity.log'
+ACTIVITY_FILE_BYTES = 5 * 1024 * 1024
+ACTIVITY_FILE_BACKUPS = 3
+
+# Longer text is cut, one runaway line shouldn't cost more than the rest
+ACTIVITY_TEXT_LIMIT = 500
+
+# Most matches a search returns, newest kept
+ACTIVITY_SEARCH_LIMIT = 1000
+
+# What a search term can be limited to with field:value, e.g. result:failed
+ACTIVITY_FIELDS = {'instance': 'instance', 'name': 'instance', 'op': 'operation',
+                   'operation': 'operation', 'result': 'result'}
+
+# A search term: (field or None for any, lower case text)
+Term = Tuple[Optional[str], str]
+
+# Called with each entry as it's added
+ActivityCallback = Callable[['ActivityEntry'], None]
+
+
+@dataclass(slots=True)
+class ActivityEntry:
+    """ One thing that happened """
+    # Wall clock time
+    time: float
+    text: str
+    # Instance key, '' if it's not about one
+    instance: str = ''
+    # e.g. exec, start, state
+    operation: str = ''
+    # ok or failed when something finished, stderr for error output, else ''
+    result: str = ''
+
+    def matches(self, terms: List[Term]) -> bool:
+        """ True if every term is in its field, or anywhere for a plain term """
+        for field, value in terms:
+            if field is not None:
+                if value not in getattr(self, field).lower():
+                    return False
+            elif not any(value in text.lower()
+                         for text in (self.text, self.instance, self.operation, self.result)):
+                return False
+        return True
+
+
+def parse_activity_query(query: str) -> List[Term]:
+    """
+    Split a search into terms, all of which have to match
+
+    'apt op:exec result:failed' -> [(None, 'apt'), ('operation', 'exec'), ('result', 'failed')]
+    """
+    terms = []
+    for word in query.lower().split():
+        field, _, value = word.partition(':')
+        if value and field in ACTIVITY_FIELDS:
+            terms.append((ACTIVITY_FIELDS[field], value))
+        else:
+            terms.append((None, word))
+    return terms
+
+
+class ActivityLog:
+    """
+    What the UI has been doing, newest last
+
+    The newest entries are kept in a fixed size ring, which is what the view
+    draws from. Entries pushed out of it are written to a file as JSON lines,
+    so they can still be searched, and the file is rotated by size.
+
+    Entries are added on the UI's thread, searches can run on another.
+    """
+
+    def __init__(self, capacity: int = ACTIVITY_CAPACITY, path: Optional[str] = None,
+                 max_bytes: int = ACTIVITY_FILE_BYTES, backups: int = ACTIVITY_FILE_BACKUPS):
+        self.entries: List[Optional[ActivityEntry]] = [None] * max(1, capacity)
+        self.head = 0
+        self.count = 0
+        # Entries ever added, and how many of them went to disk
+        self.added = 0
+        self.spilled = 0
+        # None to follow MULTIPASSER_CACHE, which tests point elsewhere
+        self._path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = None
+        self._callbacks: List[ActivityCallback] = []
+        # Held while the ring or the file changes, and while a search copies them
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return self._path or os.path.join(cache_dir(), ACTIVITY_FILE)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.entries)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> ActivityEntry:
+        """ The index-th entry in memory, 0 is the oldest """
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return self.entries[(self.head - self.count + index) % self.capacity]
+
+    def __iter__(self) -> Iterator[ActivityEntry]:
+        """ Oldest to newest """
+        for index in range(self.count):
+            yield self[index]
+
+    def subscribe(self, callback: ActivityCallback) -> None:
+        self._callbacks.append(callback)
+
+    def add(self, text: str, instance: str = '', operation: str = '', result: str = '') -> ActivityEntry:
+        """ Record something, pushing the oldest entry to disk if the ring is full """
+        entry = ActivityEntry(time.time(), text[:ACTIVITY_TEXT_LIMIT], instance, operation, result)
+        with self._lock:
+            if self.count == self.capacity:
+                self._spill([self.entries[self.head]])
+            self.entries[self.head] = entry
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+            self.added += 1
+        for callback in self._callbacks:
+            callback(entry)
+        return entry
+
+    def _spill(self, entries: List[ActivityEntry]) -> None:
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, 'a', buffering=1)
+            for entry in entries:
+                self._file.write(json.dumps(asdict(entry)) + '\n')
+            self.spilled += len(entries)
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            print(f"Error writing the activity log: {e}")
+
+    def _rotate(self) -> None:
+        """ activity.log -> activity.log.1 -> ... -> activity.log.N, the oldest is dropped """
+        self._file.close()
+        self._file = None
+        if self.backups < 1:
+            os.remove(self.path)
+            return
+        for number in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{number}'):
+                os.replace(f'{self.path}.{number}', f'{self.path}.{number + 1}')
+        os.replace(self.path, f'{self.path}.1')
+
+    def files(self) -> List[str]:
+        """ The spilled files that exist, newest first """
+        candidates = [self.path] + [f'{self.path}.{number}' for number in range(1, self.backups + 1)]
+        return [path for path in candidates if os.path.exists(path)]
+
+    def search(self, query: str, limit: int = ACTIVITY_SEARCH_LIMIT,
+               spilled: bool = True) -> List[ActivityEntry]:
+        """
+        The newest entries matching a query, in memory and then on disk
+
+        Reading the files can take a while, so the UI runs this in a thread.
+
+        Args:
+            query (str): Words that all have to be there, or field:value,
+                e.g. 'vm-0001 result:failed'. Empty matches everything.
+            limit (int): Most entries to return, the newest are kept.
+            spilled (bool): Also search what was written to disk.
+
+        Returns:
+            list: The matching entries, oldest first
+        """
+        terms = parse_activity_query(query)
+        with self._lock:
+            in_memory = list(self)
+            if self._file is not None:
+                self._file.flush()
+            paths = self.files()
+        found = deque((entry for entry in in_memory if entry.matches(terms)), maxlen=limit)
+        if not spilled or len(found) >= limit:
+            return list(found)
+        for path in paths:
+            # Only the newest matches of each file are held on to
+            older: deque = deque(maxlen=limit - len(found))
+            try:
+                with open(path) as f:
+                    for line in f:
+                        try:
+                            entry = ActivityEntry(**json.loads(line))
+                        except (ValueError, TypeError):
+                            continue
+                        if entry.matches(terms):
+                            older.append(entry)
+            except OSError:
+                continue
+            found.extendleft(reversed(older))
+            if len(found) >= limit:
+                break
+        return list(found)
+
+    def close(self) -> None:
+        """ Write what's in memory to disk too, so the next run can search it """
+        with self._lock:
+            if self.count:
+                self._spill(list(self))
+            self.entries = [None] * self.capacity
+            self.head = 0
+            self.count = 0
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,214 @@
+# Libraries
+import asyncio
+import bisect
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+# Python Files
+from multipass_utils import cache_dir, run_multipass_command_async
+
+# Kept in cache_dir() between runs
+CATALOG_FILE = 'find.json'
+
+# How long (seconds) the catalog is used before it is fetched again. Images
+# are published daily at most, and a stale catalog is still served while
+# the new one is fetched.
+CATALOG_TTL = 6 * 60 * 60
+
+
+@dataclass
+class CatalogImage:
+    """ One image or blueprint from `multipass find` """
+    # What to pass to launch, e.g. '24.04' or 'daily:25.04'
+    name: str
+    aliases: List[str] = field(default_factory=list)
+    os: str = ''
+    release: str = ''
+    version: str = ''
+    remote: str = ''
+    blueprint: bool = False
+
+
+def parse_catalog(data: Dict[str, Any]) -> List[CatalogImage]:
+    """ Turn `multipass find --format json` into CatalogImages, images then blueprints """
+    images = []
+    for section, blueprint in (('images', False), ('blueprints', True)):
+        for name, item in (data.get(section) or {}).items():
+            images.append(CatalogImage(name=name, aliases=list(item.get('aliases') or []),
+                                       os=item.get('os') or '', release=item.get('release') or '',
+                                       version=item.get('version') or '', remote=item.get('remote') or '',
+                                       blueprint=blueprint))
+    return images
+
+
+class ImageCatalog:
+    """
+    What `multipass find` lists, kept on disk and in memory
+
+    `multipass find` takes seconds (the daemon may go to the network), so
+    the result is saved and served from then on. Once it is older than the
+    TTL it is still served, and a fetch is started in the background to
+    replace it (stale-while-revalidate). Only the very first fetch, with
+    nothing on disk, is waited for.
+
+    Every name and alias is indexed, so looking one up or completing a
+    prefix as it's typed doesn't run anything.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: float = CATALOG_TTL):
+        # None to follow MULTIPASSER_CACHE, which tests point elsewhere
+        self._path = path
+        self.ttl = ttl
+        self.images: List[CatalogImage] = []
+        # Wall clock time the catalog was fetched, 0 if it never was
+        self.fetched_at = 0.0
+        # Lower case name or alias (with and without remote:) -> image
+        self.by_name: Dict[str, CatalogImage] = {}
+        # The same keys sorted, for prefix completion
+        self.keys: List[str] = []
+        # What multipass printed, as saved
+        self._data: Dict[str, Any] = {}
+        self._loaded = False
+        self._refresh: Optional[asyncio.Task] = None
+
+    @property
+    def path(self) -> str:
+        return self._path or os.path.join(cache_dir(), CATALOG_FILE)
+
+    def _index(self, data: Dict[str, Any], fetched_at: float) -> None:
+        self._data = data
+        images = self.images = parse_catalog(data)
+        self.fetched_at = fetched_at
+        self.by_name = {}
+        for image in images:
+            for name in [image.name, *image.aliases]:
+                keys = [name, f'{image.remote}:{name}'] if image.remote and ':' not in name else [name]
+                for key in keys:
+                    self.by_name.setdefault(key.lower(), image)
+        self.keys = sorted(self.by_name)
+
+    def load(self) -> bool:
+        """ Read the catalog saved by an earlier run. Returns whether there was one. """
+        self._loaded = True
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            self._index(saved['catalog'], float(saved['fetched_at']))
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return False
+        return True
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'fetched_at': self.fetched_at, 'catalog': self._data}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Error saving the image catalog: {e}")
+
+    def is_stale(self) -> bool:
+        return time.time() - self.fetched_at > self.ttl
+
+    def age(self) -> Optional[float]:
+        """ Seconds since the catalog was fetched, None if it never was """
+        return time.time() - self.fetched_at if self.fetched_at else None
+
+    async def _fetch(self) -> bool:
+        output = await run_multipass_command_async(['multipass', 'find', '--format', 'json'])
+        if output is None:
+            return False
+        try:
+            data = json.loads(output)
+        except ValueError as e:
+            print(f"An error occurred reading the image catalog: {e}")
+            return False
+        self._index(data, time.time())
+        self._save()
+        return True
+
+    async def refresh_async(self) -> bool:
+        """ Fetch the catalog now, joining a fetch already underway. Returns whether it worked. """
+        task = self._refresh
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = self._refresh = asyncio.get_running_loop().create_task(self._fetch())
+        return await asyncio.shield(task)
+
+    def refresh_in_background(self) -> None:
+        """ Start a fetch if one isn't underway. Needs a running event loop. """
+        task = self._refresh
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            self._refresh = asyncio.get_running_loop().create_task(self._fetch())
+
+    async def wait_for_refresh(self) -> None:
+        """ Let a background fetch finish, e.g. before a short lived process exits """
+        task = self._refresh
+        if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+            await task
+
+    async def get_async(self, refresh: bool = False) -> List[CatalogImage]:
+        """
+        The catalog, straight away if there is one, fetching it in the
+        background if it's stale
+
+        Args:
+            refresh (bool): Fetch it now and wait, e.g. asked for by the user.
+
+        Returns:
+            list: The images, empty if there is no catalog and it can't be fetched
+        """
+        if not self._loaded:
+            self.load()
+        if refresh or not self.images:
+            await self.refresh_async()
+        elif self.is_stale():
+            self.refresh_in_background()
+        return self.images
+
+    def invalidate(self) -> None:
+        """ Mark the catalog stale, here and on disk, so the next get fetches it again """
+        if not self._loaded:
+            self.load()
+        self.fetched_at = 0.0
+        if self.images:
+            self._save()
+
+    def forget(self) -> None:
+        """ Drop what is in memory, it's read from disk again on next use """
+        self._index({}, 0.0)
+        self._loaded = False
+        self._refresh = None
+
+    def lookup(self, name: str) -> Optional[CatalogImage]:
+        """ The image a name, alias or remote:name refers to, None if it isn't in the catalog """
+        return self.by_name.get(name.strip().lower())
+
+    def complete(self, prefix: str) -> Optional[str]:
+        """ The first name or alias (alphabetically) starting with prefix """
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return None
+        index = bisect.bisect_left(self.keys, prefix)
+        if index < len(self.keys) and self.keys[index].startswith(prefix):
+            return self.keys[index]
+        return None
+
+
+# Shared by everything in the process
+image_catalog = ImageCatalog()
+
+
+def get_image_catalog(refresh: bool = False) -> List[CatalogImage]:
+    """
+    Blocking version of image_catalog.get_async. A stale catalog is returned
+    as it is, but the fetch to replace it is finished before this returns.
+    """
+    async def get() -> List[CatalogImage]:
+        images = await image_catalog.get_async(refresh)
+        await image_catalog.wait_for_refresh()
+        return images
+
+    return asyncio.run(get())
@@ -0,0 +1,460 @@
+# Libraries
+import argparse
+import asyncio
+import contextlib
+import fnmatch
+import json
+import shlex
+import sys
+import time
+from dataclasses import asdict
+from typing import Dict, Any, List, Optional, Sequence
+# Python Files
+from multipass_utils import (Instance, instance_cache, execute_multipass_command_async,
+                             set_max_concurrent_commands, set_max_concurrent_streams,
+                             get_hosts, group_by_host, instance_key, split_instance_key, MAX_CONCURRENT_COMMANDS)
+from multipass_exec import (ExecResult, exec_on_instances_async, format_exec_summary,
+                            EXEC_OUTPUT_LIMIT, EXEC_PARALLEL)
+from multipass_catalog import image_catalog
+from multipass_snapshots import (SnapshotResult, clone_instances_async, format_snapshot_summary,
+                                 restore_instances_async, snapshot_instances_async, SNAPSHOT_PARALLEL)
+from multipass_sync import (SyncResult, forget_manifests, format_sync_summary, sync_to_instances_async,
+                            SYNC_PARALLEL)
+
+# Exit codes, 2 is left for argparse usage errors
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_PARTIAL = 3
+
+# Commands that act on instances, everything else here is read only
+ACTION_COMMANDS = ['start', 'stop', 'suspend', 'delete', 'recover']
+# Commands that stop instances while they work on them (see multipass_snapshots.py)
+SNAPSHOT_COMMANDS = ['snapshot', 'restore', 'clone']
+CLI_COMMANDS = ['status'] + ACTION_COMMANDS + ['exec'] + SNAPSHOT_COMMANDS + ['sync']
+# Commands that take a fleet spec (see multipass_fleet.py) instead of names
+FLEET_COMMANDS = ['plan', 'apply']
+# Commands about the images that can be launched
+CATALOG_COMMANDS = ['images']
+
+
+def add_cli_arguments(parser: argparse.ArgumentParser) -> None:
+    """ Add the headless commands to the main argument parser """
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND',
+                                       help='Run without the UI: ' + ', '.join(CLI_COMMANDS + FLEET_COMMANDS
+                                                                              + CATALOG_COMMANDS))
+    for command in CLI_COMMANDS:
+        sub = subparsers.add_parser(command, help={'exec': 'Run a command in instances',
+                                                   'sync': 'Copy a local directory to instances'}.get(
+                                                       command, f'{command.capitalize()} instances'))
+        default_parallel = {'exec': EXEC_PARALLEL, 'sync': SYNC_PARALLEL,
+                            **{snapshot_command: SNAPSHOT_PARALLEL for snapshot_command in SNAPSHOT_COMMANDS}}
+        sub.add_argument('names', nargs='*', metavar='NAME',
+                         help='Instance names (default: every instance that matches the filters)'
+                         if command == 'status' else 'Instance names')
+        sub.add_argument('--state', action='append', default=[],
+                         help='Only instances in this state, e.g. Stopped (repeatable)')
+        sub.add_argument('--match', action='append', default=[],
+                         help="Only instances whose name matches this glob, e.g. 'ci-*' (repeatable)")
+        if command != 'status':
+            sub.add_argument('--all', action='store_true',
+                             help='Every instance (that matches the filters), needed when no NAME, '
+                                  '--state or --match is given')
+        sub.add_argument('--parallel', type=int,
+                         default=default_parallel.get(command, MAX_CONCURRENT_COMMANDS),
+                         help='How many multipass commands to run at once')
+        sub.add_argument('--json', action='store_true', help='Print machine readable results')
+        if command == 'exec':
+            sub.add_argument('-c', '--run', required=True, metavar='COMMAND',
+                             help="The command to run, e.g. 'apt-get update'")
+            sub.add_argument('--workdir', help='Where to run it in the instance')
+            sub.add_argument('--limit', type=int, default=EXEC_OUTPUT_LIMIT,
+                             help='Lines of output shown per instance, the rest are counted')
+        if command in ('snapshot', 'restore'):
+            sub.add_argument('--snapshot', required=command == 'restore', metavar='SNAPSHOT',
+                             help='The snapshot to restore' if command == 'restore'
+                             else "What to call the snapshots (default: multipass's snapshotN)")
+        if command == 'snapshot':
+            sub.add_argument('--comment', help='Stored with the snapshots')
+        if command == 'restore':
+            sub.add_argument('--destructive', action='store_true',
+                             help="Throw away the instances' current state (required, multipass "
+                                  "can't ask whether to snapshot it first)")
+        if command in SNAPSHOT_COMMANDS:
+            sub.add_argument('--no-restart', dest='restart', action='store_false',
+                             help='Leave running instances stopped afterwards')
+        if command == 'sync':
+            sub.add_argument('--from', dest='source', required=True, metavar='DIR',
+                             help='The local directory to copy')
+            sub.add_argument('--to', dest='destination', required=True, metavar='PATH',
+                             help='Where it goes in the instances, e.g. /home/ubuntu/app')
+            sub.add_argument('--full', action='store_true',
+                             help='Send every file, not just the ones changed since the last sync')
+        if command in ACTION_COMMANDS:
+            sub.add_argument('--batch', action='store_true',
+                             help='One multipass call for all instances (no per instance results)')
+    for command, description in (('plan', 'Show what apply would change'),
+                                 ('apply', 'Launch, start, stop and delete instances to match a fleet spec')):
+        sub = subparsers.add_parser(command, help=description)
+        sub.add_argument('spec', metavar='SPEC', help='Fleet spec (YAML)')
+        sub.add_argument('--parallel', type=int, default=None,
+                         help="How many instances to work on at once (default: the spec's parallel)")
+        sub.add_argument('--json', action='store_true', help='Print machine readable results')
+    sub = subparsers.add_parser('images', help='List the images and blueprints that can be launched')
+    sub.add_argument('--refresh', action='store_true',
+                     help='Ask multipass again instead of using the cached catalog')
+    sub.add_argument('--json', action='store_true', help='Print machine readable results')
+
+
+def select_instances(instances: Sequence[Instance], names: Sequence[str], states: Sequence[str],
+                     patterns: Sequence[str]) -> List[Instance]:
+    """
+    Pick instances by name, state and name glob
+
+    Args:
+        instances (list): Instance records, e.g. from get_instance_records.
+        names (list): Exact names (name@host for other hosts), empty for all.
+        states (list): States to keep (case insensitive), empty for all.
+        patterns (list): fnmatch globs, an instance has to match one, empty for all.
+
+    Returns:
+        list: The matching instances, in list order
+    """
+    wanted_states = {state.lower() for state in states}
+    selected = []
+    for record in instances:
+        if names and record.key not in names:
+            continue
+        if wanted_states and record.state.lower() not in wanted_states:
+            continue
+        if patterns and not any(fnmatch.fnmatchcase(record.key, pattern) for pattern in patterns):
+            continue
+        selected.append(record)
+    return selected
+
+
+async def _run_one(command: str, key: str) -> Dict[str, Any]:
+    started = time.monotonic()
+    name, host = split_instance_key(key)
+    returncode, _, stderr = await execute_multipass_command_async(['multipass', command, name], host)
+    return {'name': key, 'ok': returncode == 0, 'seconds': round(time.monotonic() - started, 3),
+            'returncode': returncode, 'error': stderr.strip() or None}
+
+
+async def run_action(command: str, names: List[str], batch: bool = False) -> List[Dict[str, Any]]:
+    """
+    Run an action on instances, in parallel, timing each one
+
+    Args:
+        command (str): One of ACTION_COMMANDS.
+        names (list): The instance names, name@host for other hosts.
+        batch (bool): Pass every name to a single multipass call (per host) instead.
+
+    Returns:
+        list: One result dict per instance
+    """
+    results: List[Dict[str, Any]] = []
+    try:
+        if batch:
+            async def run_batch(host: str, host_names: List[str]) -> List[Dict[str, Any]]:
+                started = time.monotonic()
+                returncode, _, stderr = await execute_multipass_command_async(
+                    ['multipass', command, *host_names], host)
+                seconds = round(time.monotonic() - started, 3)
+                return [{'name': instance_key(name, host), 'ok': returncode == 0, 'seconds': seconds,
+                         'returncode': returncode, 'error': stderr.strip() or None} for name in host_names]
+            batches = await asyncio.gather(*[run_batch(host, host_names)
+                                             for host, host_names in group_by_host(names).items()])
+            results = [result for batch_results in batches for result in batch_results]
+        else:
+            results = list(await asyncio.gather(*[_run_one(command, name) for name in names]))
+        return results
+    finally:
+        instance_cache.invalidate()
+        if command == 'delete':
+            # A new instance under the same name hasn't got what was synced to this one
+            for result in results:
+                if result['ok']:
+                    forget_manifests(result['name'])
+
+
+async def run_exec(args: argparse.Namespace, names: List[str], out=None) -> List[Dict[str, Any]]:
+    """
+    Run args.run on instances, printing their output as `name | line` unless --json
+
+    Returns:
+        list: One result dict per instance
+    """
+    def on_line(name: str, stream_name: str, line: str) -> None:
+        print(f"{name} | {line}", file=(out or sys.stdout) if stream_name == 'stdout' else sys.stderr)
+
+    results = await exec_on_instances_async(names, shlex.split(args.run),
+                                            on_line=None if args.json else on_line,
+                                            parallel=args.parallel, output_limit=args.limit,
+                                            working_directory=args.workdir)
+    return [{**asdict(result), 'ok': result.ok,
+             'error': None if result.ok or not result.tail else result.tail[-1]} for result in results]
+
+
+async def run_snapshots(args: argparse.Namespace, names: List[str]) -> List[Dict[str, Any]]:
+    """
+    Snapshot, restore or clone instances, printing each step to stderr unless --json
+
+    Returns:
+        list: One result dict per instance
+    """
+    def on_progress(name: str, stage: str) -> None:
+        print(f"{stage:<10} {name}", file=sys.stderr)
+
+    options = {'on_progress': None if args.json else on_progress, 'parallel': args.parallel,
+               'restart': args.restart}
+    if args.command == 'snapshot':
+        results = await snapshot_instances_async(names, args.snapshot, args.comment, **options)
+    elif args.command == 'restore':
+        results = await restore_instances_async(names, args.snapshot, args.destructive, **options)
+    else:
+        results = await clone_instances_async(names, **options)
+    return [{**asdict(result), 'returncode': None,
+             'error': None if result.ok else f'failed at {result.failed_at}'} for result in results]
+
+
+async def run_sync(args: argparse.Namespace, names: List[str]) -> List[Dict[str, Any]]:
+    """
+    Sync a local directory to instances, printing each one's progress to stderr unless --json
+
+    Returns:
+        list: One result dict per instance
+    """
+    def on_progress(name: str, sent: int, total: int) -> None:
+        print(f"{sent:>6}/{total:<6} {name}", file=sys.stderr)
+
+    results = await sync_to_instances_async(args.source, args.destination, names,
+                                            on_progress=None if args.json else on_progress,
+                                            parallel=args.parallel, full=args.full)
+    return [{**asdict(result), 'returncode': None} for result in results]
+
+
+def missing_selector(args: argparse.Namespace) -> Optional[str]:
+    """ Why a command that changes instances can't run as given, None if it can """
+    if args.command in ('restore', 'clone'):
+        # Filters alone are too easy to get wrong for these
+        if not (args.names or args.all):
+            return f"{args.command} needs instance names or --all (with --state/--match to narrow it)"
+        if args.command == 'restore' and not args.destructive:
+            return "restore throws away the instances' current state, pass --destructive to do that"
+        return None
+    if args.command == 'status' or args.names or args.state or args.match or args.all:
+        return None
+    return f"{args.command} needs instance names, --state, --match or --all"
+
+
+async def run_cli_async(args: argparse.Namespace, out=None) -> Dict[str, Any]:
+    """ Run a headless command, returning the report to print """
+    started = time.monotonic()
+    # A bare `multipasser delete` shouldn't mean every instance
+    error = missing_selector(args)
+    if error is not None:
+        return {'command': args.command, 'ok': False, 'error': error, 'results': [], 'seconds': 0.0}
+    instances = await instance_cache.get_records_async()
+    if instances is None:
+        return {'command': args.command, 'ok': False, 'error': "Couldn't list the instances",
+                'results': [], 'seconds': round(time.monotonic() - started, 3)}
+    selected = select_instances(instances, args.names, args.state, args.match)
+    missing = sorted(set(args.names) - {record.key for record in instances})
+    report: Dict[str, Any] = {'command': args.command}
+    if args.command == 'status':
+        report['instances'] = [record.to_json() for record in selected]
+        results = []
+    elif args.command == 'exec':
+        results = await run_exec(args, [record.key for record in selected], out)
+    elif args.command in SNAPSHOT_COMMANDS:
+        results = await run_snapshots(args, [record.key for record in selected])
+    elif args.command == 'sync':
+        results = await run_sync(args, [record.key for record in selected])
+    else:
+        results = await run_action(args.command, [record.key for record in selected],
+                                   batch=args.batch)
+    results += [{'name': name, 'ok': False, 'seconds': 0.0, 'returncode': None,
+                 'error': f'instance "{name}" does not exist'} for name in missing]
+    report['results'] = results
+    report['failed'] = sum(1 for result in results if not result['ok'])
+    report['ok'] = report['failed'] == 0
+    report['seconds'] = round(time.monotonic() - started, 3)
+    return report
+
+
+def exit_code_for(report: Dict[str, Any]) -> int:
+    """ EXIT_OK if everything worked, EXIT_PARTIAL if only some of it did """
+    if 'error' in report:
+        return EXIT_FAILED
+    if report['failed'] == 0:
+        return EXIT_OK
+    if report['failed'] == len(report['results']):
+        return EXIT_FAILED
+    return EXIT_PARTIAL
+
+
+def print_report(report: Dict[str, Any], out=sys.stdout) -> None:
+    """ Human readable version of the report """
+    if 'error' in report:
+        print(f"Error: {report['error']}", file=out)
+        return
+    if report['command'] == 'exec':
+        for line in format_exec_summary([
+                ExecResult(name=result['name'], returncode=result['returncode'], seconds=result['seconds'],
+                           lines=result.get('lines', 0), dropped=result.get('dropped', 0),
+                           tail=result.get('tail') or [error for error in [result['error']] if error]) for result in report['results']]):
+            print(line, file=out)
+        return
+    if report['command'] in SNAPSHOT_COMMANDS:
+        for line in format_snapshot_summary(report['command'].capitalize(), [
+                SnapshotResult(name=result['name'], ok=result['ok'], made=result.get('made'),
+                               seconds=result['seconds'], failed_at=result.get('failed_at'))
+                for result in report['results']]):
+            print(line, file=out)
+        return
+    if report['command'] == 'sync':
+        for line in format_sync_summary([
+                SyncResult(name=result['name'], ok=result['ok'], sent=result.get('sent', 0),
+                           skipped=result.get('skipped', 0), bytes=result.get('bytes', 0),
+                           seconds=result['seconds'], error=result['error'])
+                for result in report['results']], report['seconds']):
+            print(line, file=out)
+        return
+    for item in report.get('instances', []):
+        name = instance_key(item['name'], item.get('host', ''))
+        print(f"{name:<30}{item['state']:<12}{', '.join(item['ipv4']) or '--':<18}"
+              f"{item['release']}", file=out)
+    for result in report['results']:
+        status = 'ok' if result['ok'] else f"FAILED: {result['error']}"
+        print(f"{report['command']:<8} {result['name']:<30} {result['seconds']:>7.2f}s  {status}",
+              file=out)
+    if report['command'] != 'status':
+        print(f"{len(report['results']) - report['failed']}/{len(report['results'])} succeeded "
+              f"in {report['seconds']:.2f}s", file=out)
+
+
+async def run_fleet_async(args: argparse.Namespace) -> Dict[str, Any]:
+    """ Plan or apply a fleet spec, returning the report to print """
+    # Fleet specs (and hosts) are YAML, only load it for the commands that read it
+    from multipass_fleet import FleetSpecError, load_fleet_spec, plan_fleet_async, apply_fleet_async
+    started = time.monotonic()
+    report: Dict[str, Any] = {'command': args.command, 'spec': args.spec}
+    try:
+        spec = load_fleet_spec(args.spec)
+        plan = await plan_fleet_async(spec)
+    except (FleetSpecError, RuntimeError) as e:
+        report.update(ok=False, error=str(e), results=[], seconds=round(time.monotonic() - started, 3))
+        return report
+    report['plan'] = [{'name': action.name, 'group': action.group, 'current': action.current,
+                       'desired': action.desired, 'steps': action.steps} for action in plan]
+    results = []
+    if args.command == 'apply':
+        parallel = args.parallel or spec.parallel
+        # Launches are streamed, so they have their own limit to lift
+        set_max_concurrent_streams(max(1, parallel))
+
+        def on_result(result):
+            if not args.json:
+                status = 'ok' if result.ok else f"FAILED: {result.error}"
+                print(f"{' -> '.join(result.steps):<18} {result.name:<30} {result.seconds:>7.2f}s  "
+                      f"{status}", file=sys.stderr)
+
+        results = [asdict(result) for result in
+                   await apply_fleet_async(spec, plan, parallel=parallel, on_result=on_result)]
+    report['results'] = results
+    report['failed'] = sum(1 for result in results if not result['ok'])
+    report['ok'] = report['failed'] == 0
+    report['seconds'] = round(time.monotonic() - started, 3)
+    return report
+
+
+def print_fleet_report(report: Dict[str, Any], out=sys.stdout) -> None:
+    """ Human readable version of a plan or apply report """
+    if 'error' in report:
+        print(f"Error: {report['error']}", file=out)
+        return
+    if report['command'] == 'plan':
+        from multipass_fleet import format_plan, PlannedAction
+        for line in format_plan([PlannedAction(**action) for action in report['plan']]):
+            print(line, file=out)
+        changes = sum(1 for action in report['plan'] if action['steps'])
+        print(f"{changes} of {len(report['plan'])} instances to change", file=out)
+        return
+    print(f"{len(report['results']) - report['failed']}/{len(report['results'])} succeeded "
+          f"in {report['seconds']:.2f}s", file=out)
+
+
+async def run_images_async(args: argparse.Namespace, out=None) -> Dict[str, Any]:
+    """ List the image catalog, printing it as soon as it's there, returning the report """
+    started = time.monotonic()
+    images = await image_catalog.get_async(refresh=args.refresh)
+    age = image_catalog.age()
+    report: Dict[str, Any] = {'command': 'images', 'images': [asdict(image) for image in images],
+                              'age': None if age is None else round(age), 'results': [], 'failed': 0,
+                              'ok': bool(images), 'seconds': round(time.monotonic() - started, 3)}
+    if not images:
+        report['error'] = "Couldn't get the image catalog (multipass find)"
+    if args.json:
+        print(json.dumps(report, indent=2), file=out or sys.stdout)
+    else:
+        print_images(report, out or sys.stdout)
+    # A stale catalog was printed as it was, let its refresh finish so the next run is fresh
+    await image_catalog.wait_for_refresh()
+    return report
+
+
+def print_images(report: Dict[str, Any], out=sys.stdout) -> None:
+    """ Human readable version of the image catalog """
+    if 'error' in report:
+        print(f"Error: {report['error']}", file=out)
+        return
+    for image in report['images']:
+        kind = 'blueprint' if image['blueprint'] else f"{image['os']} {image['release']}".strip()
+        print(f"{image['name']:<28}{','.join(image['aliases']):<18}{image['version']:<12}{kind}", file=out)
+    if report['age'] is not None:
+        print(f"(catalog from {report['age'] // 60} minutes ago, --refresh to ask again)", file=out)
+
+
+def run_cli(args: argparse.Namespace) -> int:
+    """
+    Run one of the headless commands
+
+    Returns:
+        int: The exit code
+    """
+    try:
+        return _run_command(args)
+    finally:
+        # Don't leave ssh connections to other hosts open after a one-off command
+        if get_hosts():
+            from multipass_hosts import close_hosts_async
+            with contextlib.redirect_stdout(sys.stderr):
+                asyncio.run(close_hosts_async())
+
+
+def _run_command(args: argparse.Namespace) -> int:
+    if args.command in CATALOG_COMMANDS:
+        out = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            report = asyncio.run(run_images_async(args, out))
+        return exit_code_for(report)
+    if args.command in FLEET_COMMANDS:
+        if args.parallel is not None:
+            set_max_concurrent_commands(max(1, args.parallel))
+        with contextlib.redirect_stdout(sys.stderr):
+            report = asyncio.run(run_fleet_async(args))
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_fleet_report(report)
+        return exit_code_for(report)
+    set_max_concurrent_commands(max(1, args.parallel))
+    # Library errors are printed, keep them off stdout so --json stays parseable
+    out = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        report = asyncio.run(run_cli_async(args, out))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return exit_code_for(report)
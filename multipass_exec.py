@@ -0,0 +1,165 @@
+# Libraries
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, List, Optional, Sequence, Tuple
+# Python Files
+from multipass_utils import execute_multipass_stream_async, split_instance_key
+
+# How many instances a command runs on at once unless the caller says otherwise
+EXEC_PARALLEL = 8
+
+# Lines of output passed on per instance. Past this they are only counted,
+# so a chatty command can't fill memory (or the log).
+EXEC_OUTPUT_LIMIT = 500
+
+# How many lines can be waiting for on_line before the commands are held up
+EXEC_QUEUE_SIZE = 256
+
+# The last lines of each instance's output kept for the summary
+EXEC_TAIL_LINES = 3
+
+# Called with (instance name, 'stdout' or 'stderr', line)
+LineCallback = Callable[[str, str, str], None]
+
+
+@dataclass
+class ExecResult:
+    """ How a command went on one instance """
+    name: str
+    # None if it never got to run
+    returncode: Optional[int] = None
+    seconds: float = 0.0
+    # Lines passed on, and lines over EXEC_OUTPUT_LIMIT that weren't
+    lines: int = 0
+    dropped: int = 0
+    tail: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+
+def build_exec_argv(name: str, command: Sequence[str],
+                    working_directory: Optional[str] = None) -> List[str]:
+    """ The `multipass exec` argv for one instance """
+    argv = ['multipass', 'exec', name]
+    if working_directory:
+        argv += ['--working-directory', working_directory]
+    return argv + ['--', *command]
+
+
+async def exec_on_instances_async(names: Sequence[str], command: Sequence[str],
+                                  on_line: Optional[LineCallback] = None,
+                                  on_result: Optional[Callable[[ExecResult], None]] = None,
+                                  parallel: int = EXEC_PARALLEL,
+                                  output_limit: int = EXEC_OUTPUT_LIMIT,
+                                  working_directory: Optional[str] = None) -> List[ExecResult]:
+    """
+    Run the same command on several instances at once, streaming the output
+
+    Output goes through a queue of EXEC_QUEUE_SIZE lines to on_line. If
+    on_line can't keep up the queue fills and the commands' output stops
+    being read, which holds the commands up rather than buffering. If
+    on_line raises, the commands are cancelled and its exception is raised.
+
+    Args:
+        names (list): The instance names, name@host for other hosts.
+        command (list): The command and its arguments, e.g. ['apt-get', 'update'].
+        on_line (callable): Gets (name, 'stdout' or 'stderr', line) as output arrives.
+        on_result (callable): Gets each ExecResult as its instance finishes.
+        parallel (int): How many instances at once.
+        output_limit (int): Lines passed on per instance, the rest are counted.
+        working_directory (str): Where to run it in the instance.
+
+    Returns:
+        list: An ExecResult per instance, in the order given
+    """
+    semaphore = asyncio.Semaphore(max(1, parallel))
+    queue: 'asyncio.Queue[Optional[Tuple[str, str, str]]]' = asyncio.Queue(EXEC_QUEUE_SIZE)
+
+    async def drain() -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            try:
+                on_line(*item)
+            except BaseException:
+                # Nothing reads the queue after this, so stop the runs rather
+                # than leave them waiting for room in it
+                for task in runs:
+                    task.cancel()
+                while not queue.empty():
+                    queue.get_nowait()
+                raise
+
+    async def run_one(key: str) -> ExecResult:
+        result = ExecResult(name=key)
+        tail: Deque[str] = deque(maxlen=EXEC_TAIL_LINES)
+
+        def on_output(stream_name: str, line: str):
+            tail.append(line)
+            if result.lines >= output_limit:
+                result.dropped += 1
+                return None
+            result.lines += 1
+            if on_line is not None:
+                return queue.put((key, stream_name, line))
+            return None
+
+        name, host = split_instance_key(key)
+        started = time.monotonic()
+        returncode, _, stderr = await execute_multipass_stream_async(
+            build_exec_argv(name, command, working_directory), on_output, host, semaphore)
+        result.seconds = round(time.monotonic() - started, 3)
+        result.returncode = returncode
+        if not tail and stderr.strip():
+            # It never ran (e.g. the host couldn't be reached), so nothing was streamed
+            tail.append(stderr.strip().splitlines()[-1])
+        result.tail = list(tail)
+        if result.dropped and on_line is not None:
+            await queue.put((key, 'stderr', f'... {result.dropped} more lines not shown'))
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    loop = asyncio.get_running_loop()
+    runs = [loop.create_task(run_one(key)) for key in dict.fromkeys(names)]
+    drainer = loop.create_task(drain()) if on_line is not None else None
+    try:
+        if runs:
+            await asyncio.wait(runs, return_when=asyncio.FIRST_EXCEPTION)
+        if drainer is not None:
+            if not drainer.done():
+                await queue.put(None)
+            # Raises what on_line raised, if it did
+            await drainer
+        return [task.result() for task in runs]
+    finally:
+        # Cancelled, or something failed: stop the runs still going, and
+        # wait for them to stop their commands
+        pending = [task for task in runs if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        if drainer is not None:
+            drainer.cancel()
+
+
+def format_exec_summary(results: Sequence[ExecResult]) -> List[str]:
+    """ A line per instance with its exit code and time, then the totals """
+    lines = []
+    for result in sorted(results, key=lambda result: (result.ok, -result.seconds)):
+        code = '--' if result.returncode is None else str(result.returncode)
+        output = f"{result.lines} line{'' if result.lines == 1 else 's'}"
+        if result.dropped:
+            output += f" (+{result.dropped} not shown)"
+        last = f"  {result.tail[-1]}" if result.tail and not result.ok else ""
+        lines.append(f"{result.name:<30} exit {code:>3} {result.seconds:>7.2f}s  {output}{last}")
+    succeeded = sum(1 for result in results if result.ok)
+    slowest = max((result.seconds for result in results), default=0.0)
+    lines.append(f"{succeeded}/{len(results)} succeeded, slowest {slowest:.2f}s")
+    return lines
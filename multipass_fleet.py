@@ -0,0 +1,383 @@
+# Libraries
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Any, List, Optional, Sequence
+import yaml
+# Python Files
+from multipass_utils import (Instance, instance_cache, instance_info_cache,
+                             execute_multipass_command_async, launch_instance_async, LaunchProgress)
+
+# How many instances are worked on at once unless the spec or caller says otherwise
+FLEET_PARALLEL = 4
+
+# What an instance in the spec can be asked to be
+DESIRED_STATES = ('running', 'stopped', 'suspended', 'absent')
+
+# Settings an instance picks up from `defaults:` unless it sets them itself
+INSTANCE_SETTINGS = ('image', 'cpus', 'memory', 'disk', 'cloud_init', 'state')
+
+# multipass states that are on their way to one we plan with
+_SETTLED_STATES = {
+    'Starting': 'Running',
+    'Restarting': 'Running',
+    'Delayed Shutdown': 'Running',
+    'Suspending': 'Suspended',
+}
+
+# The commands that get an instance from its current state to the desired one.
+# A missing instance is launched first, which leaves it Running.
+_TRANSITIONS = {
+    ('Running', 'stopped'): ['stop'],
+    ('Running', 'suspended'): ['suspend'],
+    ('Stopped', 'running'): ['start'],
+    # multipass can only suspend a running instance
+    ('Stopped', 'suspended'): ['start', 'suspend'],
+    ('Suspended', 'running'): ['start'],
+    ('Suspended', 'stopped'): ['stop'],
+}
+
+# A spec looks like this, see examples/fleet.yaml:
+#
+#     parallel: 8
+#     prune: false
+#     defaults:
+#       image: 24.04
+#       memory: 2G
+#     instances:
+#       db:
+#         disk: 20G
+#       app:
+#         count: 3                # app-1, app-2, app-3
+#         name: app-{index}
+#         depends_on: [db]
+#         cloud_init: app.yaml    # relative to the spec file
+
+
+class FleetSpecError(ValueError):
+    """ The fleet spec is malformed """
+
+
+@dataclass
+class InstanceSpec:
+    """ One instance the fleet should have """
+    name: str
+    group: str
+    image: Optional[str] = None
+    cpus: Optional[int] = None
+    memory: Optional[str] = None
+    disk: Optional[str] = None
+    cloud_init: Optional[str] = None
+    state: str = 'running'
+
+
+@dataclass
+class FleetSpec:
+    """ A parsed fleet spec """
+    instances: List[InstanceSpec]
+    # Group -> the groups that have to be done first
+    depends_on: Dict[str, List[str]] = field(default_factory=dict)
+    parallel: int = FLEET_PARALLEL
+    # Delete instances that aren't in the spec
+    prune: bool = False
+
+    @property
+    def groups(self) -> List[str]:
+        return list(dict.fromkeys([*self.depends_on,
+                                   *(instance.group for instance in self.instances)]))
+
+
+@dataclass
+class PlannedAction:
+    """ What has to happen to one instance """
+    name: str
+    # The group it belongs to, None for instances being pruned
+    group: Optional[str]
+    # The multipass commands to run in order, empty if it's already right
+    steps: List[str]
+    current: Optional[str]
+    desired: str
+    spec: Optional[InstanceSpec] = None
+
+    @property
+    def changes(self) -> bool:
+        return bool(self.steps)
+
+
+@dataclass
+class ActionResult:
+    """ How applying one PlannedAction went """
+    name: str
+    group: Optional[str]
+    steps: List[str]
+    ok: bool
+    seconds: float = 0.0
+    error: Optional[str] = None
+    # Not tried because a group it depends on failed
+    skipped: bool = False
+
+
+def _expand_names(group: str, settings: Dict[str, Any]) -> List[str]:
+    """ The instance names a group stands for """
+    if 'names' in settings:
+        names = settings['names']
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            raise FleetSpecError(f"{group}: names must be a list of strings")
+        return names
+    count = settings.get('count')
+    pattern = str(settings.get('name', f'{group}-{{index}}' if count is not None else group))
+    if count is None:
+        return [pattern]
+    if not isinstance(count, int) or count < 0:
+        raise FleetSpecError(f"{group}: count must be a whole number")
+    if '{index' not in pattern:
+        raise FleetSpecError(f"{group}: name needs an {{index}} when count is set")
+    try:
+        return [pattern.format(index=index) for index in range(1, count + 1)]
+    except (KeyError, IndexError, ValueError) as e:
+        raise FleetSpecError(f"{group}: bad name pattern {pattern!r}: {e}") from e
+
+
+def parse_fleet_spec(data: Any, base_dir: str = '.') -> FleetSpec:
+    """
+    Turn a loaded YAML document into a FleetSpec
+
+    Args:
+        data (dict): The document.
+        base_dir (str): What relative cloud_init paths are relative to.
+
+    Returns:
+        FleetSpec: The spec, with defaults applied and names expanded
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('instances'), dict):
+        raise FleetSpecError("the spec needs an 'instances' mapping")
+    defaults = data.get('defaults') or {}
+    instances = []
+    depends_on = {}
+    seen = {}
+    for group, settings in data['instances'].items():
+        group = str(group)
+        settings = settings or {}
+        if not isinstance(settings, dict):
+            raise FleetSpecError(f"{group}: expected a mapping of settings")
+        merged = {key: settings.get(key, defaults.get(key)) for key in INSTANCE_SETTINGS}
+        state = str(merged['state'] or 'running').lower()
+        if state not in DESIRED_STATES:
+            raise FleetSpecError(f"{group}: state must be one of {', '.join(DESIRED_STATES)}")
+        cloud_init = merged['cloud_init']
+        if cloud_init and not os.path.isabs(cloud_init):
+            cloud_init = os.path.join(base_dir, cloud_init)
+        needs = settings.get('depends_on') or []
+        depends_on[group] = [str(need) for need in ([needs] if isinstance(needs, str) else needs)]
+        for name in _expand_names(group, settings):
+            if name in seen:
+                raise FleetSpecError(f"{name} is in both {seen[name]} and {group}")
+            seen[name] = group
+            instances.append(InstanceSpec(
+                name=name, group=group, image=None if merged['image'] is None else str(merged['image']),
+                cpus=merged['cpus'], memory=merged['memory'], disk=merged['disk'],
+                cloud_init=cloud_init, state=state))
+    for group, needs in depends_on.items():
+        for need in needs:
+            if need not in depends_on:
+                raise FleetSpecError(f"{group} depends on {need}, which isn't in the spec")
+    spec = FleetSpec(instances=instances, depends_on=depends_on,
+                     parallel=int(data.get('parallel', FLEET_PARALLEL)),
+                     prune=bool(data.get('prune', False)))
+    # Fail on cycles now rather than hanging in apply
+    group_order(spec)
+    return spec
+
+
+def load_fleet_spec(path: str) -> FleetSpec:
+    """ Read and parse a fleet spec file """
+    try:
+        with open(path) as f:
+            data = yaml.safe_load(f)
+    except (OSError, yaml.YAMLError) as e:
+        raise FleetSpecError(f"couldn't read {path}: {e}") from e
+    return parse_fleet_spec(data, os.path.dirname(os.path.abspath(path)))
+
+
+def group_order(spec: FleetSpec) -> List[str]:
+    """
+    The groups in an order that puts every group after the ones it depends on
+
+    Groups with nothing between them keep the order they are written in.
+    """
+    order = []
+    remaining = {group: set(spec.depends_on.get(group, ())) for group in spec.groups}
+    while remaining:
+        ready = [group for group, needs in remaining.items() if not needs]
+        if not ready:
+            raise FleetSpecError(f"dependency cycle between {', '.join(sorted(remaining))}")
+        for group in ready:
+            del remaining[group]
+            for needs in remaining.values():
+                needs.discard(group)
+        order += ready
+    return order
+
+
+def plan_instance(spec: InstanceSpec, current: Optional[str]) -> List[str]:
+    """ The steps that take one instance from its current state to the spec """
+    current = _SETTLED_STATES.get(current, current)
+    if spec.state == 'absent':
+        return [] if current is None else ['delete']
+    steps = []
+    if current is None:
+        steps.append('launch')
+        current = 'Running'
+    elif current == 'Deleted':
+        steps.append('recover')
+        current = 'Stopped'
+    return steps + _TRANSITIONS.get((current, spec.state), [])
+
+
+def plan_fleet(spec: FleetSpec, instances: Sequence[Instance]) -> List[PlannedAction]:
+    """
+    Diff a spec against what multipass has
+
+    Specs are for this machine, instances on other hosts are left alone.
+
+    Args:
+        spec (FleetSpec): What we want.
+        instances (list): Instance records, e.g. from get_instance_records.
+
+    Returns:
+        list: A PlannedAction per instance in the spec (and per instance to
+        prune), in dependency order
+    """
+    current = {record.name: record.state for record in instances if not record.host}
+    order = {group: index for index, group in enumerate(group_order(spec))}
+    plan = [PlannedAction(name=instance.name, group=instance.group, current=current.get(instance.name),
+                          desired=instance.state, spec=instance,
+                          steps=plan_instance(instance, current.get(instance.name)))
+            for instance in sorted(spec.instances, key=lambda instance: order[instance.group])]
+    if spec.prune:
+        wanted = {instance.name for instance in spec.instances}
+        plan += [PlannedAction(name=name, group=None, current=state, desired='absent', steps=['delete'])
+                 for name, state in current.items() if name not in wanted]
+    return plan
+
+
+async def _run_step(step: str, action: PlannedAction,
+                    on_progress: Optional[Callable[[str, LaunchProgress], None]]) -> Optional[str]:
+    """ Run one step, returning an error message if it failed """
+    if step == 'launch':
+        spec = action.spec
+        launched = await launch_instance_async(
+            spec.name, spec.image, spec.cpus, spec.memory, spec.disk, spec.cloud_init,
+            on_progress=None if on_progress is None else
+            (lambda progress: on_progress(action.name, progress)))
+        return None if launched else 'launch failed'
+    argv = ['multipass', step, action.name]
+    if step == 'delete':
+        # Purge too, or a later launch of the same name would fail
+        argv.insert(2, '--purge')
+    returncode, _, stderr = await execute_multipass_command_async(argv)
+    if returncode != 0:
+        return stderr.strip() or f'{step} exited with {returncode}'
+    return None
+
+
+async def apply_fleet_async(spec: FleetSpec, plan: Optional[List[PlannedAction]] = None,
+                            parallel: Optional[int] = None,
+                            on_result: Optional[Callable[[ActionResult], None]] = None,
+                            on_progress: Optional[Callable[[str, LaunchProgress], None]] = None
+                            ) -> List[ActionResult]:
+    """
+    Converge multipass on a spec
+
+    Each group starts as soon as the groups it depends on are done, so
+    independent groups run side by side. Instances are worked on in parallel,
+    at most `parallel` at once, and each instance's steps run in order. If
+    anything in a group fails, the groups that depend on it are skipped.
+
+    Args:
+        spec (FleetSpec): What we want.
+        plan (list): From plan_fleet, fetched fresh if not given.
+        parallel (int): How many instances at once, the spec's value if not given.
+        on_result (callable): Called with each ActionResult as it finishes.
+        on_progress (callable): Called with (name, LaunchProgress) during launches.
+
+    Returns:
+        list: An ActionResult for every instance that needed changing
+    """
+    if plan is None:
+        instances = await instance_cache.get_records_async(force=True)
+        if instances is None:
+            raise RuntimeError("Couldn't list the instances")
+        plan = plan_fleet(spec, instances)
+    limit = asyncio.Semaphore(max(1, parallel or spec.parallel))
+    results: List[ActionResult] = []
+
+    def finish(result: ActionResult) -> ActionResult:
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    async def apply_action(action: PlannedAction) -> ActionResult:
+        async with limit:
+            started = time.monotonic()
+            error = None
+            for step in action.steps:
+                error = await _run_step(step, action, on_progress)
+                if error:
+                    break
+            return finish(ActionResult(name=action.name, group=action.group, steps=action.steps,
+                                       ok=error is None, error=error,
+                                       seconds=round(time.monotonic() - started, 3)))
+
+    async def apply_group(group: Optional[str], actions: List[PlannedAction]) -> bool:
+        needs = spec.depends_on.get(group, []) if group is not None else []
+        if needs:
+            done = await asyncio.gather(*[group_tasks[need] for need in needs])
+            if not all(done):
+                failed = [need for need, ok in zip(needs, done) if not ok]
+                for action in actions:
+                    finish(ActionResult(name=action.name, group=group, steps=action.steps, ok=False,
+                                        skipped=True, error=f"skipped, {', '.join(failed)} failed"))
+                return False
+        outcomes = await asyncio.gather(*[apply_action(action) for action in actions])
+        return all(outcome.ok for outcome in outcomes)
+
+    by_group: Dict[Optional[str], List[PlannedAction]] = {group: [] for group in spec.groups}
+    for action in plan:
+        if action.changes:
+            by_group.setdefault(action.group, []).append(action)
+    try:
+        group_tasks = {group: asyncio.ensure_future(apply_group(group, actions))
+                       for group, actions in by_group.items()}
+        await asyncio.gather(*group_tasks.values())
+    finally:
+        instance_cache.invalidate()
+        instance_info_cache.invalidate()
+    return results
+
+
+def apply_fleet(spec: FleetSpec, parallel: Optional[int] = None) -> List[ActionResult]:
+    """ Converge multipass on a spec """
+    return asyncio.run(apply_fleet_async(spec, parallel=parallel))
+
+
+async def plan_fleet_async(spec: FleetSpec) -> List[PlannedAction]:
+    """ Diff a spec against a fresh `multipass list` """
+    instances = await instance_cache.get_records_async(force=True)
+    if instances is None:
+        raise RuntimeError("Couldn't list the instances")
+    return plan_fleet(spec, instances)
+
+
+def format_plan(plan: Sequence[PlannedAction]) -> List[str]:
+    """ One line per instance: what it is, what it will be and how """
+    lines = []
+    for action in plan:
+        current = action.current or 'missing'
+        how = ' -> '.join(action.steps) if action.steps else 'no change'
+        group = f"[{action.group}]" if action.group else '[prune]'
+        lines.append(f"{'*' if action.changes else ' '} {action.name:<30}{group:<14}"
+                     f"{current:<11}-> {action.desired:<10} {how}")
+    return lines
@@ -0,0 +1,114 @@
+# Libraries
+import asyncio
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+import yaml
+# Python Files
+from multipass_transport import SshTransport
+from multipass_utils import HOST_SEPARATOR, add_host, get_host_transport, get_hosts, remove_hosts
+
+# An inventory looks like this, see examples/hosts.yaml. This machine is
+# always included, as "local", and doesn't need listing.
+#
+#     control_dir: ~/.ssh/multipasser    # optional, where the pooled connections live
+#     hosts:
+#       build1: build1.example.com       # just the address
+#       build2:
+#         address: 10.0.0.12
+#         user: ci
+#         port: 2222
+
+
+class HostInventoryError(ValueError):
+    """ The host inventory is malformed """
+
+
+@dataclass
+class Host:
+    """ Another machine running multipass, reached over ssh """
+    name: str
+    address: str
+    user: Optional[str] = None
+    port: Optional[int] = None
+
+
+def parse_inventory(data: Any) -> List[Host]:
+    """
+    Check a loaded inventory and turn it into Hosts
+
+    Args:
+        data (dict): The YAML document.
+
+    Returns:
+        list: The hosts, in the order they are written
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('hosts'), dict):
+        raise HostInventoryError("an inventory needs a hosts: mapping")
+    hosts = []
+    for name, settings in data['hosts'].items():
+        name = str(name)
+        if not name or HOST_SEPARATOR in name or name == 'local':
+            raise HostInventoryError(f"{name!r} can't be used as a host name")
+        if isinstance(settings, str):
+            settings = {'address': settings}
+        elif settings is None:
+            settings = {}
+        elif not isinstance(settings, dict):
+            raise HostInventoryError(f"{name}: expected an address or a mapping")
+        unknown = set(settings) - {'address', 'user', 'port'}
+        if unknown:
+            raise HostInventoryError(f"{name}: unknown settings {', '.join(sorted(unknown))}")
+        port = settings.get('port')
+        if port is not None and (not isinstance(port, int) or not 0 < port < 65536):
+            raise HostInventoryError(f"{name}: port must be a number from 1 to 65535")
+        hosts.append(Host(name=name, address=str(settings.get('address') or name),
+                          user=settings.get('user'), port=port))
+    return hosts
+
+
+def load_inventory(path: str) -> Dict[str, Any]:
+    """
+    Read an inventory file
+
+    Returns:
+        dict: {'hosts': list of Host, 'control_dir': str or None}
+    """
+    try:
+        with open(path) as f:
+            data = yaml.safe_load(f)
+    except (OSError, yaml.YAMLError) as e:
+        raise HostInventoryError(f"couldn't read {path}: {e}") from e
+    hosts = parse_inventory(data)
+    control_dir = data.get('control_dir')
+    return {'hosts': hosts, 'control_dir': os.path.expanduser(str(control_dir)) if control_dir else None}
+
+
+def use_hosts(hosts: List[Host], control_dir: Optional[str] = None, ssh: str = 'ssh') -> None:
+    """
+    Make multipass_utils include these hosts from now on, replacing any before
+
+    Args:
+        hosts (list): The Hosts.
+        control_dir (str): Where ssh keeps the pooled connections, which has
+            to be the user's own with mode 0700. A new temporary directory
+            per host by default, removed by close_hosts_async.
+        ssh (str): The ssh client to run.
+    """
+    remove_hosts()
+    for host in hosts:
+        add_host(host.name, SshTransport(host.address, user=host.user, port=host.port,
+                                         control_dir=control_dir, ssh=ssh))
+
+
+def use_inventory(path: str, ssh: str = 'ssh') -> List[Host]:
+    """ load_inventory and use_hosts in one. Returns the hosts. """
+    inventory = load_inventory(path)
+    use_hosts(inventory['hosts'], inventory['control_dir'], ssh)
+    return inventory['hosts']
+
+
+async def close_hosts_async() -> None:
+    """ Shut the pooled connections, e.g. on exit """
+    await asyncio.gather(*[get_host_transport(host).close() for host in get_hosts()],
+                         return_exceptions=True)
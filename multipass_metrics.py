@@ -0,0 +1,229 @@
+# Libraries
+import bisect
+import json
+import time
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Deque, Dict, IO, List, Optional, Sequence, Tuple
+
+# How many of the latest commands are kept whole (for the stats panel and export)
+METRICS_HISTORY = 1000
+
+# Only the start of stderr is kept, multipass errors are one or two lines
+STDERR_LIMIT = 500
+
+# Latency buckets: 0.5ms to ~16 minutes, each 10% wider than the last.
+# Percentiles are read from these, so they are accurate to within 10%.
+_BUCKET_GROWTH = 1.1
+_BUCKET_BOUNDS: List[float] = []
+_bound = 0.0005
+while _bound < 1000:
+    _BUCKET_BOUNDS.append(_bound)
+    _bound *= _BUCKET_GROWTH
+del _bound
+
+# Options that take a value, so the value isn't mistaken for an instance name
+_VALUE_OPTIONS = {'--format', '--name', '-n', '--cpus', '-c', '--memory', '-m', '--disk', '-d',
+                  '--cloud-init', '--network', '--mount', '--timeout', '--working-directory',
+                  '--snapshot', '--comment'}
+
+
+@dataclass(slots=True)
+class CommandRecord:
+    """ One multipass command, as it was run """
+    # Wall clock time it was asked for
+    started: float
+    subcommand: str
+    # The instance name(s) it was for, space separated, '' for none
+    instance: str
+    # Seconds multipass took, and seconds it waited for a free slot before that
+    duration: float
+    waited: float
+    returncode: int
+    stderr: str = ''
+    # Which host it ran on, '' for this machine
+    host: str = ''
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+
+def describe_command(argv: Sequence[str]) -> Tuple[str, str]:
+    """
+    Pick the subcommand and instance names out of a multipass argv
+
+    Returns:
+        tuple: (subcommand, instance names space separated)
+    """
+    if len(argv) < 2:
+        return ('--version' if argv else '', '')
+    subcommand = argv[1]
+    names = []
+    args = iter(argv[2:])
+    for arg in args:
+        if arg in _VALUE_OPTIONS:
+            value = next(args, '')
+            if subcommand == 'launch' and arg in ('--name', '-n'):
+                names.append(value)
+        elif subcommand == 'exec' and arg == '--':
+            break
+        elif not arg.startswith('-') and subcommand != 'launch':
+            names.append(arg)
+    return subcommand, ' '.join(names)
+
+
+class LatencyHistogram:
+    """ Counts of durations in fixed log spaced buckets, so memory doesn't grow """
+
+    __slots__ = ('buckets', 'count', 'errors', 'total', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * (len(_BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration: float, ok: bool = True) -> None:
+        self.buckets[bisect.bisect_left(_BUCKET_BOUNDS, duration)] += 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        if not ok:
+            self.errors += 1
+
+    def percentile(self, p: float) -> float:
+        """ The duration p percent of commands finished within (the bucket's upper bound) """
+        if not self.count:
+            return 0.0
+        rank = max(1, round(p / 100 * self.count))
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= rank:
+                return min(_BUCKET_BOUNDS[index] if index < len(_BUCKET_BOUNDS) else self.max, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'p50_ms': self.percentile(50) * 1000,
+            'p95_ms': self.percentile(95) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+
+class CommandMetrics:
+    """
+    Timings of every multipass command run through multipass_utils
+
+    Keeps a latency histogram per subcommand, one for the time spent waiting
+    for a free command slot, and the latest METRICS_HISTORY commands whole.
+    If a sink is set every command is also appended to it as a JSON line.
+    """
+
+    def __init__(self, history: int = METRICS_HISTORY):
+        self.enabled = True
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.waits = LatencyHistogram()
+        # Host -> every command run there, to spot the slow one
+        self.hosts: Dict[str, LatencyHistogram] = {}
+        self.recent: Deque[CommandRecord] = deque(maxlen=history)
+        self.sink: Optional[IO[str]] = None
+
+    def record(self, argv: Sequence[str], started: float, waited: float, duration: float,
+               returncode: int, stderr: str = '', host: str = '') -> Optional[CommandRecord]:
+        """ Note down a finished command """
+        if not self.enabled:
+            return None
+        subcommand, instance = describe_command(argv)
+        record = CommandRecord(started=started, subcommand=subcommand, instance=instance,
+                               duration=duration, waited=waited, returncode=returncode,
+                               stderr=stderr.strip()[:STDERR_LIMIT] if returncode else '', host=host)
+        histogram = self.histograms.get(subcommand)
+        if histogram is None:
+            histogram = self.histograms[subcommand] = LatencyHistogram()
+        histogram.add(duration, record.ok)
+        host_histogram = self.hosts.get(host)
+        if host_histogram is None:
+            host_histogram = self.hosts[host] = LatencyHistogram()
+        host_histogram.add(duration, record.ok)
+        self.waits.add(waited)
+        self.recent.append(record)
+        if self.sink is not None:
+            try:
+                self.sink.write(json.dumps(asdict(record)) + '\n')
+            except (OSError, ValueError) as e:
+                print(f"Error writing metrics, stopped recording to file: {e}")
+                self.sink = None
+        return record
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """ Subcommand -> count, errors and latency percentiles (ms) """
+        return {subcommand: histogram.summary()
+                for subcommand, histogram in sorted(self.histograms.items())}
+
+    def failures(self, limit: int = 10) -> List[CommandRecord]:
+        """ The latest failed commands, newest first """
+        failed = []
+        for record in reversed(self.recent):
+            if not record.ok:
+                failed.append(record)
+                if len(failed) >= limit:
+                    break
+        return failed
+
+    def export_jsonl(self, path: str) -> int:
+        """ Write the kept commands to a file, one JSON object per line. Returns how many. """
+        with open(path, 'w') as f:
+            for record in self.recent:
+                f.write(json.dumps(asdict(record)) + '\n')
+        return len(self.recent)
+
+    def open_sink(self, path: str) -> None:
+        """ Append every command from now on to path as a JSON line """
+        self.close_sink()
+        self.sink = open(path, 'a', buffering=1)
+
+    def close_sink(self) -> None:
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+
+    def reset(self) -> None:
+        self.histograms.clear()
+        self.hosts.clear()
+        self.waits = LatencyHistogram()
+        self.recent.clear()
+
+
+def format_metrics(metrics: CommandMetrics, failures: int = 5) -> str:
+    """ The stats panel text """
+    lines = [f"{'command':<10}{'count':>6}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"]
+    for subcommand, figures in metrics.summary().items():
+        lines.append(f"{subcommand:<10}{figures['count']:>6}{figures['errors']:>5}"
+                     f"{figures['p50_ms']:>7.0f}ms{figures['p95_ms']:>7.0f}ms"
+                     f"{figures['p99_ms']:>7.0f}ms{figures['max_ms']:>7.0f}ms")
+    waits = metrics.waits.summary()
+    lines.append(f"{'(queued)':<10}{waits['count']:>6}{'':>5}{waits['p50_ms']:>7.0f}ms"
+                 f"{waits['p95_ms']:>7.0f}ms{waits['p99_ms']:>7.0f}ms{waits['max_ms']:>7.0f}ms")
+    if len(metrics.hosts) > 1:
+        for host, histogram in sorted(metrics.hosts.items()):
+            figures = histogram.summary()
+            lines.append(f"{'@' + (host or 'local'):<10}{figures['count']:>6}{figures['errors']:>5}"
+                         f"{figures['p50_ms']:>7.0f}ms{figures['p95_ms']:>7.0f}ms"
+                         f"{figures['p99_ms']:>7.0f}ms{figures['max_ms']:>7.0f}ms")
+    for record in metrics.failures(failures):
+        when = time.strftime('%H:%M:%S', time.localtime(record.started))
+        where = f"@{record.host}" if record.host else ""
+        lines.append(f"{when} {record.subcommand} {record.instance}{where}: "
+                     f"[{record.returncode}] {record.stderr or 'no output'}")
+    return "\n".join(lines)
+
+
+# Shared by everything in the process, multipass_utils records into it
+command_metrics = CommandMetrics()
@@ -0,0 +1,141 @@
+# Libraries
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+# Python Files
+from multipass_utils import run_bulk_instance_command_async
+
+# What the State column shows while an operation is queued or running
+OPERATION_LABELS = {
+    'start': 'Starting…',
+    'stop': 'Stopping…',
+    'suspend': 'Suspending…',
+    'delete': 'Deleting…',
+    'recover': 'Recovering…',
+}
+
+# Operations that only change the power state, so a later one makes an
+# earlier queued one pointless (start, stop, start is just start)
+POWER_OPERATIONS = {'start', 'stop', 'suspend'}
+
+# Called with (operation, instance names, results). results is None when the
+# operations are queued and name -> succeeded once they have run.
+OperationCallback = Callable[[str, List[str], Optional[Dict[str, bool]]], None]
+
+
+class OperationQueue:
+    """
+    Queues start/stop/suspend/delete/recover per instance
+
+    Each instance's operations run in the order they were asked for, while
+    different instances run at the same time. Instances whose next operation
+    is the same are sent in one `multipass <op> a b c` call. While queued,
+    operations are collapsed: a power operation replaces a queued power
+    operation before it, and asking for what is already going to happen
+    (a second delete, start while starting) does nothing.
+    """
+
+    def __init__(self, runner: Callable[[str, Sequence[str]], Awaitable[Dict[str, bool]]]
+                 = run_bulk_instance_command_async):
+        self.runner = runner
+        # Instance name -> operations not started yet, oldest first
+        self.pending: Dict[str, List[str]] = {}
+        # Instance name -> the operation multipass is doing now
+        self.running: Dict[str, str] = {}
+        self.subscribers: List[OperationCallback] = []
+        # How many operations were dropped by coalescing, for the curious
+        self.coalesced = 0
+        self._tasks = set()
+        self._idle: Optional[asyncio.Event] = None
+
+    def subscribe(self, callback: OperationCallback) -> None:
+        """ Call callback when operations are queued and when they finish """
+        self.subscribers.append(callback)
+
+    def _notify(self, operation: str, names: List[str], results: Optional[Dict[str, bool]]) -> None:
+        for callback in list(self.subscribers):
+            callback(operation, names, results)
+
+    def queued(self, name: str) -> List[str]:
+        """ Everything still to happen to an instance, the running operation first """
+        running = self.running.get(name)
+        return ([running] if running else []) + self.pending.get(name, [])
+
+    def is_busy(self, name: str) -> bool:
+        return name in self.running or bool(self.pending.get(name))
+
+    def label(self, name: str) -> Optional[str]:
+        """ The optimistic state to show for an instance, None if nothing is queued """
+        queued = self.queued(name)
+        return OPERATION_LABELS.get(queued[-1], f'{queued[-1]}…') if queued else None
+
+    def _coalesce(self, name: str, operation: str) -> bool:
+        """ Add an operation to an instance's queue, returning False if it was dropped """
+        pending = self.pending.setdefault(name, [])
+        if pending and pending[-1] in POWER_OPERATIONS and operation in POWER_OPERATIONS:
+            pending.pop()
+            self.coalesced += 1
+        queued = self.queued(name)
+        if queued and queued[-1] == operation:
+            self.coalesced += 1
+            if not pending:
+                del self.pending[name]
+            return False
+        pending.append(operation)
+        return True
+
+    def submit(self, names: Sequence[str], operation: str) -> List[str]:
+        """
+        Queue an operation for some instances. Needs a running event loop.
+
+        Args:
+            names (list): The instance names.
+            operation (str): One of OPERATION_LABELS.
+
+        Returns:
+            list: The names it was queued for, the rest were collapsed away
+        """
+        queued = [name for name in dict.fromkeys(names) if self._coalesce(name, operation)]
+        # Even if nothing new was queued, the labels may have changed
+        self._notify(operation, list(dict.fromkeys(names)), None)
+        self._dispatch()
+        return queued
+
+    def _dispatch(self) -> None:
+        """ Start the next operation of every instance that isn't busy, batched by operation """
+        batches: Dict[str, List[str]] = {}
+        for name in list(self.pending):
+            if name in self.running:
+                continue
+            operation = self.pending[name].pop(0)
+            if not self.pending[name]:
+                del self.pending[name]
+            self.running[name] = operation
+            batches.setdefault(operation, []).append(name)
+        for operation, names in batches.items():
+            task = asyncio.get_running_loop().create_task(self._run(operation, names))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if self._idle is not None:
+            if self.running or self.pending:
+                self._idle.clear()
+            else:
+                self._idle.set()
+
+    async def _run(self, operation: str, names: List[str]) -> None:
+        try:
+            results = await self.runner(operation, names)
+        except Exception as e:
+            print(f"An error occurred running {operation}: {e}")
+            results = {}
+        for name in names:
+            self.running.pop(name, None)
+        self._notify(operation, names, {name: results.get(name, False) for name in names})
+        self._dispatch()
+
+    async def wait_idle(self) -> None:
+        """ Wait until nothing is queued or running """
+        if self._idle is None:
+            self._idle = asyncio.Event()
+        if not self.running and not self.pending:
+            self._idle.set()
+        await self._idle.wait()
@@ -0,0 +1,230 @@
+# Libraries
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+# Python Files
+from multipass_metrics import LatencyHistogram
+from multipass_utils import (cache_dir, clone_instance_async, get_instance_records_async,
+                             launch_instance_async, start_instances_async, stop_instances_async)
+
+# New pool members are called warm-1, warm-2, ... (skipping names in use) and
+# Quick Create's copies quick-1, quick-2, ...
+WARM_POOL_PREFIX = 'warm-'
+QUICK_CREATE_PREFIX = 'quick-'
+
+# The instances the pool launched, kept in cache_dir(). Only these are ever
+# stopped or counted, whatever other instances are called.
+WARM_POOL_FILE = 'warm-pool.json'
+
+# How often (seconds) the pool is checked when nothing pokes it
+WARM_POOL_CHECK_INTERVAL = 60.0
+
+
+def next_free_name(prefix: str, taken: Set[str]) -> str:
+    """ The lowest <prefix><n> not in taken """
+    number = 1
+    while f'{prefix}{number}' in taken:
+        number += 1
+    return f'{prefix}{number}'
+
+
+class WarmPool:
+    """
+    Instances launched ahead of time, so Quick Create doesn't wait for a launch
+
+    Members are kept Stopped, as `multipass clone` only copies stopped
+    instances. Handing one out clones it under a new name and starts the
+    copy, which takes seconds instead of the minute a launch takes (image,
+    boot, cloud-init), and the member stays in the pool for next time. The
+    maintainer (run) launches members until there are `size` of them and
+    stops any that were started, e.g. by Start ALL.
+
+    Only instances the pool launched itself are members, as recorded in
+    WARM_POOL_FILE, so a user's own instance called warm-1 is left alone.
+    Only this machine's instances are pooled.
+    """
+
+    def __init__(self, size: int, image: Optional[str] = None, cpus: Optional[int] = None,
+                 memory: Optional[str] = None, disk: Optional[str] = None,
+                 cloud_init: Optional[str] = None, prefix: str = WARM_POOL_PREFIX,
+                 interval: float = WARM_POOL_CHECK_INTERVAL, path: Optional[str] = None):
+        self.size = max(0, size)
+        # What members are launched with, and Quick Create launches with on a miss
+        self.launch_options: Dict[str, Any] = {'image': image, 'cpus': cpus, 'memory': memory,
+                                               'disk': disk, 'cloud_init': cloud_init}
+        self.prefix = prefix
+        self.interval = interval
+        # None to follow MULTIPASSER_CACHE, which tests point elsewhere
+        self._path = path
+        # Every instance the pool launched that may still be there, None until loaded
+        self._members: Optional[Set[str]] = None
+        # Stopped members nothing is using, oldest first
+        self.ready: List[str] = []
+        # Members being launched, which `multipass list` may not show yet
+        self.launching: Set[str] = set()
+        # Members being stopped or copied
+        self.busy: Set[str] = set()
+        # Names handed out that `multipass list` doesn't show yet
+        self.given: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        # Seconds to launch and stop a member, and to clone and start a copy
+        self.refills = LatencyHistogram()
+        self.handouts = LatencyHistogram()
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @property
+    def path(self) -> str:
+        return self._path or os.path.join(cache_dir(), WARM_POOL_FILE)
+
+    @property
+    def members(self) -> Set[str]:
+        if self._members is None:
+            try:
+                with open(self.path) as f:
+                    self._members = set(json.load(f)['members'])
+            except (OSError, ValueError, KeyError, TypeError):
+                self._members = set()
+        return self._members
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'members': sorted(self.members)}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Error saving the warm pool: {e}")
+
+    def is_member(self, key: str) -> bool:
+        return key in self.members
+
+    def poke(self) -> None:
+        """ Check the pool now, e.g. a member was deleted """
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _launch_member(self, name: str) -> bool:
+        # Recorded first, so a member whose launch outlives the UI is still known
+        self.members.add(name)
+        self._save()
+        self.launching.add(name)
+        started = time.monotonic()
+        try:
+            launched = await launch_instance_async(name=name, **self.launch_options)
+            stopped = launched is not None and (await stop_instances_async([name])).get(name, False)
+        finally:
+            self.launching.discard(name)
+        if not stopped:
+            self.failures += 1
+            return False
+        self.refills.add(time.monotonic() - started)
+        self.ready.append(name)
+        return True
+
+    async def refill_async(self) -> int:
+        """
+        Bring the pool up to size: stop started members and launch missing ones
+
+        Returns:
+            int: How many members were launched
+        """
+        records = await get_instance_records_async(force=True)
+        if records is None or not self.size:
+            return 0
+        listed = {record.key for record in records}
+        # Gone, e.g. deleted by hand, or a launch that never got anywhere
+        gone = self.members - listed - self.launching
+        if gone:
+            self.members.difference_update(gone)
+            self._save()
+        self.given -= listed
+        taken = listed | self.launching | self.given
+        members = {record.name: record.state for record in records
+                   if self.is_member(record.key) and record.state != 'Deleted'}
+        idle = [name for name in sorted(members) if name not in self.busy]
+        self.ready = [name for name in idle if members[name] == 'Stopped']
+        started = [name for name in idle if members[name] in ('Running', 'Suspended')]
+        if started:
+            self.busy.update(started)
+            try:
+                stopped = await stop_instances_async(started)
+            finally:
+                self.busy.difference_update(started)
+            self.ready += [name for name in started if stopped.get(name)]
+        new_names = []
+        for _ in range(self.size - len(set(members) | self.launching)):
+            new_names.append(next_free_name(self.prefix, taken))
+            taken.add(new_names[-1])
+        launched = await asyncio.gather(*[self._launch_member(name) for name in new_names])
+        return sum(launched)
+
+    async def take_async(self, name: Optional[str] = None) -> Optional[str]:
+        """
+        Hand out a copy of a ready member, started
+
+        Args:
+            name (str): What to call it, quick-N if None.
+
+        Returns:
+            str: The new instance's name, None if no member was ready (a miss)
+        """
+        if not self.ready:
+            self.misses += 1
+            self.poke()
+            return None
+        member = self.ready.pop(0)
+        self.busy.add(member)
+        started = time.monotonic()
+        try:
+            if name is None:
+                records = await get_instance_records_async() or []
+                name = next_free_name(QUICK_CREATE_PREFIX, {record.key for record in records} | self.given)
+            self.given.add(name)
+            clone = await clone_instance_async(member, name)
+            if clone is not None:
+                await start_instances_async([clone])
+        finally:
+            self.busy.discard(member)
+        if clone is None:
+            self.given.discard(name)
+            # Leave the member out until the next check has a look at it
+            self.failures += 1
+            self.misses += 1
+            self.poke()
+            return None
+        self.ready.append(member)
+        self.hits += 1
+        self.handouts.add(time.monotonic() - started)
+        return clone
+
+    async def run(self) -> None:
+        """ Keep the pool full. Cancel the task to stop. """
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            await self.refill_async()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+def format_pool_stats(pool: WarmPool) -> str:
+    """ A line for the stats panel """
+    asked = pool.hits + pool.misses
+    rate = f"{pool.hits / asked:.0%}" if asked else "--"
+    line = (f"warm pool {len(pool.ready)}/{pool.size} ready"
+            f"{f', {len(pool.launching)} launching' if pool.launching else ''}"
+            f"  hits {pool.hits} misses {pool.misses} ({rate})")
+    if pool.handouts.count:
+        line += f"  hand out p50 {pool.handouts.percentile(50):.1f}s"
+    if pool.refills.count:
+        line += f"  refill p50 {pool.refills.percentile(50):.0f}s max {pool.refills.max:.0f}s"
+    if pool.failures:
+        line += f"  failures {pool.failures}"
+    return line
@@ -0,0 +1,166 @@
+# Libraries
+import asyncio
+import math
+import time
+from array import array
+from typing import Callable, Dict, Any, Iterator, List, Sequence
+# Python Files
+from multipass_utils import instance_cache, instance_info_cache, fetch_instance_info_async
+
+# How often (seconds) running instances are sampled, and how many samples
+# are kept per instance. Memory use is fixed at retention * metrics floats.
+RESOURCE_SAMPLE_INTERVAL = 10.0
+RESOURCE_RETENTION = 60
+
+# What gets recorded for each instance, all as 0.0 - 1.0 (or more for load)
+METRICS = ('load', 'memory', 'disk')
+
+SPARK_BLOCKS = '▁▂▃▄▅▆▇█'
+
+
+class RingBuffer:
+    """ A fixed number of floats, oldest overwritten first """
+
+    __slots__ = ('values', 'head', 'count')
+
+    def __init__(self, size: int):
+        self.values = array('f', [math.nan]) * size
+        self.head = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, value: float) -> None:
+        self.values[self.head] = value
+        self.head = (self.head + 1) % len(self.values)
+        self.count = min(self.count + 1, len(self.values))
+
+    def __iter__(self) -> Iterator[float]:
+        """ Oldest to newest """
+        size = len(self.values)
+        start = (self.head - self.count) % size
+        for i in range(self.count):
+            yield self.values[(start + i) % size]
+
+    def last(self, n: int) -> List[float]:
+        """ The newest n values, oldest first """
+        return list(self)[-n:]
+
+
+def _fraction(used: Any, total: Any) -> float:
+    try:
+        return float(used) / float(total)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return math.nan
+
+
+def sample_from_info(info: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Pull the metrics out of one instance's `multipass info`
+
+    Returns:
+        Dict: load (1 minute load / CPUs), memory and disk (used / total)
+    """
+    load = info.get('load') or []
+    try:
+        cpus = float(info.get('cpu_count') or 1)
+    except ValueError:
+        cpus = 1.0
+    disks = info.get('disks') or {}
+    disk_used = sum(float(disk.get('used') or 0) for disk in disks.values())
+    disk_total = sum(float(disk.get('total') or 0) for disk in disks.values())
+    memory = info.get('memory') or {}
+    return {
+        'load': float(load[0]) / cpus if load else math.nan,
+        'memory': _fraction(memory.get('used'), memory.get('total')),
+        'disk': _fraction(disk_used, disk_total),
+    }
+
+
+def sparkline(values: Sequence[float], width: int, high: float = 1.0) -> str:
+    """
+    Draw values as block characters, scaled 0 - high, padded on the left
+
+    Args:
+        values (list): Oldest first, NaN for gaps.
+        width (int): How many characters to draw.
+        high (float): The value that draws a full block.
+    """
+    values = list(values)[-width:]
+    chars = []
+    for value in values:
+        if math.isnan(value):
+            chars.append(' ')
+        else:
+            level = min(max(value / high, 0.0), 1.0)
+            chars.append(SPARK_BLOCKS[round(level * (len(SPARK_BLOCKS) - 1))])
+    return ''.join(chars).rjust(width)
+
+
+class ResourceHistory:
+    """ A ring buffer per metric per instance """
+
+    def __init__(self, retention: int = RESOURCE_RETENTION):
+        self.retention = retention
+        self.instances: Dict[str, Dict[str, RingBuffer]] = {}
+
+    def record(self, name: str, sample: Dict[str, float]) -> None:
+        rings = self.instances.get(name)
+        if rings is None:
+            rings = self.instances[name] = {metric: RingBuffer(self.retention) for metric in METRICS}
+        for metric in METRICS:
+            rings[metric].append(sample.get(metric, math.nan))
+
+    def series(self, name: str, metric: str) -> List[float]:
+        rings = self.instances.get(name)
+        return list(rings[metric]) if rings else []
+
+    def forget(self, keep: Sequence[str]) -> None:
+        """ Drop instances that no longer exist """
+        keep = set(keep)
+        for name in [name for name in self.instances if name not in keep]:
+            del self.instances[name]
+
+
+class ResourceSampler:
+    """
+    Samples every running instance with one `multipass info a b c ...` per interval
+
+    The info fetched is also put in instance_info_cache, so the detail pane
+    gets it for free.
+    """
+
+    def __init__(self, interval: float = RESOURCE_SAMPLE_INTERVAL,
+                 retention: int = RESOURCE_RETENTION):
+        self.interval = interval
+        self.history = ResourceHistory(retention)
+        self.subscribers: List[Callable[[List[str]], None]] = []
+        self.last_duration = 0.0
+
+    def subscribe(self, callback: Callable[[List[str]], None]) -> None:
+        """ Call callback with the sampled instance names after every sample """
+        self.subscribers.append(callback)
+
+    async def sample_once(self) -> List[str]:
+        """ Sample the running instances once, returning their names """
+        started = time.monotonic()
+        records = await instance_cache.get_records_async()
+        if records is None:
+            return []
+        self.history.forget([record.key for record in records])
+        names = [record.key for record in records if record.state == 'Running']
+        infos = await fetch_instance_info_async(names)
+        for name, info in infos.items():
+            self.history.record(name, sample_from_info(info))
+            instance_info_cache.store(name, info)
+        self.last_duration = time.monotonic() - started
+        return list(infos)
+
+    async def run(self) -> None:
+        """ Sample forever. Cancel the task to stop. """
+        while True:
+            names = await self.sample_once()
+            for callback in list(self.subscribers):
+                callback(names)
+            await asyncio.sleep(self.interval)
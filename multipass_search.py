@@ -0,0 +1,182 @@
+# Libraries
+import ipaddress
+import re
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+# Python Files
+from multipass_utils import Instance
+
+# What a filter term can be limited to with field:value, e.g. state:running
+SEARCH_FIELDS = {'name': 'name', 'state': 'state', 'release': 'release', 'ip': 'ipv4', 'ipv4': 'ipv4',
+                 'host': 'host'}
+
+# How many filter results are kept, so backspacing is as quick as typing
+SEARCH_CACHE_SIZE = 32
+
+# A filter term: (attribute or None for any, lower case text)
+Term = Tuple[Optional[str], str]
+
+# What the table can be sorted on, Instance attributes
+SORT_ATTRIBUTES = ('key', 'name', 'state', 'ipv4', 'release', 'host')
+
+_DIGITS = re.compile(r'(\d+)')
+
+
+def parse_query(query: str) -> List[Term]:
+    """
+    Split a filter into terms, all of which have to match
+
+    'web state:run' -> [(None, 'web'), ('state', 'run')]
+    """
+    terms = []
+    for word in query.lower().split():
+        field, _, value = word.partition(':')
+        if value and field in SEARCH_FIELDS:
+            terms.append((SEARCH_FIELDS[field], value))
+        else:
+            terms.append((None, word))
+    return terms
+
+
+def is_narrower(query: List[Term], than: List[Term]) -> bool:
+    """ True if everything query matches is also matched by `than` """
+    return all(any(field == other_field and other in value for field, value in query)
+               for other_field, other in than)
+
+
+def sort_key(attribute: str, value: Any) -> Any:
+    """ How a column sorts: names naturally (vm2 before vm10), IPs by number """
+    if attribute == 'ipv4':
+        try:
+            return (0, int(ipaddress.ip_address(value[0]))) if value else (1, 0)
+        except ValueError:
+            return (1, 0)
+    if attribute in ('name', 'key'):
+        return tuple(int(part) if part.isdigit() else part.lower() for part in _DIGITS.split(value))
+    return str(value).lower()
+
+
+class InstanceIndex:
+    """
+    Filter and sort instances without going over the whole fleet each time
+
+    Instances are known by their key (name, or name@host for other hosts).
+    Every instance's searchable text is worked out once, when it changes. A
+    filter result is kept for each recent query, and a query that only adds
+    to an earlier one (typing another letter) searches that query's results
+    rather than everything. When instances change, the kept results and the
+    sort orders are patched for just those instances.
+    """
+
+    def __init__(self, cache_size: int = SEARCH_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.records: Dict[str, Instance] = {}
+        # Key -> attribute -> lower case text to search, '' holds them all joined
+        self.text: Dict[str, Dict[str, str]] = {}
+        # Key -> attribute -> what it sorts by
+        self.sort_keys: Dict[str, Dict[str, Any]] = {}
+        # Query -> (its terms, the names that match), most recently used last
+        self.results: 'OrderedDict[str, Tuple[List[Term], Set[str]]]' = OrderedDict()
+        # (attribute, reverse) -> every key in that order
+        self.orders: Dict[Tuple[str, bool], List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @staticmethod
+    def _text(record: Instance) -> Dict[str, str]:
+        text = {'name': record.key.lower(), 'state': record.state.lower(),
+                'release': record.release.lower(), 'ipv4': ' '.join(record.ipv4),
+                'host': record.host.lower() or 'local'}
+        # A term can't contain a newline, so it can't match across two fields
+        text[''] = '\n'.join(text.values())
+        return text
+
+    def _matches(self, name: str, terms: List[Term]) -> bool:
+        text = self.text[name]
+        return all(value in text[field or ''] for field, value in terms)
+
+    def update(self, records: Iterable[Instance]) -> List[str]:
+        """
+        Bring the index up to date with a new instance list
+
+        Returns:
+            list: The keys that were added, changed or removed
+        """
+        records = {record.key: record for record in records}
+        changed = [name for name, record in records.items() if self.records.get(name) != record]
+        removed = [name for name in self.records if name not in records]
+        if not changed and not removed:
+            return []
+        old, self.records = self.records, records
+        for name in removed:
+            del self.text[name]
+            del self.sort_keys[name]
+        for name in changed:
+            record = records[name]
+            self.text[name] = self._text(record)
+            self.sort_keys[name] = {attribute: sort_key(attribute, getattr(record, attribute))
+                                    for attribute in SORT_ATTRIBUTES}
+        for terms, found in self.results.values():
+            found.difference_update(removed)
+            for name in changed:
+                if self._matches(name, terms):
+                    found.add(name)
+                else:
+                    found.discard(name)
+        # A sort is only redone if a value it sorts on moved
+        for attribute, reverse in list(self.orders):
+            if removed or any(name not in old or getattr(old[name], attribute) != getattr(records[name], attribute)
+                              for name in changed):
+                del self.orders[(attribute, reverse)]
+        return changed + removed
+
+    def search(self, query: str) -> Set[str]:
+        """ The keys of the instances that match a filter """
+        query = ' '.join(query.lower().split())
+        if not query:
+            return set(self.records)
+        cached = self.results.get(query)
+        if cached is not None:
+            self.results.move_to_end(query)
+            return cached[1]
+        terms = parse_query(query)
+        candidates: Iterable[str] = self.records
+        narrowest = None
+        for other_terms, found in self.results.values():
+            if is_narrower(terms, other_terms) and (narrowest is None or len(found) < len(narrowest)):
+                narrowest = found
+        if narrowest is not None:
+            candidates = narrowest
+        text = self.text
+        if len(terms) == 1:
+            field, value = terms[0]
+            field = field or ''
+            found = {name for name in candidates if value in text[name][field]}
+        else:
+            found = {name for name in candidates if self._matches(name, terms)}
+        self.results[query] = (terms, found)
+        if len(self.results) > self.cache_size:
+            self.results.popitem(last=False)
+        return found
+
+    def ordered(self, attribute: str = 'key', reverse: bool = False) -> List[str]:
+        """ Every key, sorted on an Instance attribute. Ties keep key order. """
+        order = self.orders.get((attribute, reverse))
+        if order is None:
+            keys = self.sort_keys
+            by_name = sorted(self.records, key=lambda name: keys[name]['key'])
+            if attribute == 'key':
+                order = by_name[::-1] if reverse else by_name
+            else:
+                order = sorted(by_name, key=lambda name: keys[name][attribute], reverse=reverse)
+            self.orders[(attribute, reverse)] = order
+        return order
+
+    def view(self, query: str = '', attribute: str = 'key', reverse: bool = False) -> List[str]:
+        """ The keys to show for a filter, in sorted order """
+        order = self.ordered(attribute, reverse)
+        if not query.strip():
+            return order
+        found = self.search(query)
+        return [name for name in order if name in found]
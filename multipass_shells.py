@@ -0,0 +1,123 @@
+# Libraries
+from collections import OrderedDict
+from typing import Callable, Generic, List, Optional, Tuple, TypeVar
+
+# How many shell sessions are kept open, the least recently used one is
+# closed when another is needed
+SHELL_POOL_SIZE = 4
+
+# How long (seconds) the cursor has to rest on a running instance before a
+# shell is opened for it in the background, when pre-warming is on
+SHELL_PREWARM_DELAY = 1.5
+
+Session = TypeVar('Session')
+
+
+class ShellPool(Generic[Session]):
+    """
+    Open shell sessions per instance, reused until they are pushed out
+
+    Opening `multipass shell` takes seconds (it has to ssh into the
+    instance), so sessions are kept after they are left and going back to
+    an instance reattaches to its session straight away. At most `size` are
+    kept, closing the least recently used, but never the one being shown.
+
+    The pool doesn't care what a session is: `open_session` makes one for
+    an instance, `close_session` gets rid of one, and `is_alive` says if one
+    can still be used (the shell may have been exited).
+    """
+
+    def __init__(self, open_session: Callable[[str], Session],
+                 close_session: Callable[[str, Session], None],
+                 is_alive: Callable[[Session], bool] = lambda session: True,
+                 size: int = SHELL_POOL_SIZE):
+        self.open_session = open_session
+        self.close_session = close_session
+        self.is_alive = is_alive
+        self.size = max(1, size)
+        # Instance name -> session, least recently used first
+        self.sessions: 'OrderedDict[str, Session]' = OrderedDict()
+        # The instance whose session is on screen
+        self.active: Optional[str] = None
+        # How many sessions were reattached rather than opened, for the curious
+        self.reused = 0
+
+    def __contains__(self, name: str) -> bool:
+        session = self.sessions.get(name)
+        return session is not None and self.is_alive(session)
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def _get(self, name: str) -> Tuple[Session, bool]:
+        session = self.sessions.get(name)
+        if session is not None and not self.is_alive(session):
+            self.discard(name)
+            session = None
+        if session is not None:
+            self.sessions.move_to_end(name)
+            return session, True
+        session = self.sessions[name] = self.open_session(name)
+        self._evict(keep=name)
+        return session, False
+
+    def _evict(self, keep: str) -> None:
+        """ Close the least recently used sessions past the size, but not keep's or the shown one """
+        for name in list(self.sessions):
+            if len(self.sessions) <= self.size:
+                break
+            if name != keep and name != self.active:
+                self.close_session(name, self.sessions.pop(name))
+
+    def attach(self, name: str) -> Tuple[Session, bool]:
+        """
+        Get the session to show for an instance, opening one if needed
+
+        Returns:
+            tuple: (session, True if it was already open)
+        """
+        # First, so the session going off screen is the one that can be closed
+        shown, self.active = self.active, name
+        try:
+            session, reused = self._get(name)
+        except BaseException:
+            self.active = shown
+            raise
+        if reused:
+            self.reused += 1
+        return session, reused
+
+    def detach(self) -> None:
+        """ Nothing is on screen, the session stays open in the pool """
+        self.active = None
+
+    def prewarm(self, name: str) -> Optional[Session]:
+        """
+        Open a session for an instance in the background, if it hasn't one
+
+        The session on screen is never pushed out for a pre-warm, so with a
+        pool of one nothing is pre-warmed while a shell is shown.
+
+        Returns:
+            Session: The new session, None if there was one already or no room
+        """
+        if name in self or (self.active is not None and self.active != name and self.size < 2):
+            return None
+        session, _ = self._get(name)
+        return session
+
+    def discard(self, name: str) -> None:
+        """ Close an instance's session, e.g. it was stopped or deleted """
+        session = self.sessions.pop(name, None)
+        if session is not None:
+            self.close_session(name, session)
+        if self.active == name:
+            self.active = None
+
+    def clear(self) -> None:
+        for name in list(self.sessions):
+            self.discard(name)
+
+    def names(self) -> List[str]:
+        """ The instances with a session, least recently used first """
+        return list(self.sessions)
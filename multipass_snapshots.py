@@ -0,0 +1,163 @@
+# Libraries
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional, Sequence
+# Python Files
+from multipass_sync import forget_manifests
+from multipass_utils import (clone_instance_async, get_instance_records_async, restore_snapshot_async,
+                             start_instances_async, stop_instances_async, take_snapshot_async)
+
+# How many instances are snapshotted/restored/cloned at once unless the
+# caller says otherwise. The per host command limit applies on top.
+SNAPSHOT_PARALLEL = 4
+
+# What each step is called in progress reports
+SNAPSHOT_STAGES = {
+    'stopping': 'Stopping…',
+    'snapshot': 'Snapshotting…',
+    'restore': 'Restoring…',
+    'clone': 'Cloning…',
+    'starting': 'Starting…',
+}
+
+# Called with (instance name, stage), a key of SNAPSHOT_STAGES, or
+# 'done'/'failed' when the instance is finished with
+ProgressCallback = Callable[[str, str], None]
+
+
+@dataclass
+class SnapshotResult:
+    """ How a snapshot, restore or clone went on one instance """
+    name: str
+    ok: bool = False
+    # The snapshot taken or restored, or the clone made
+    made: Optional[str] = None
+    seconds: float = 0.0
+    # What it was doing when it failed
+    failed_at: Optional[str] = None
+
+
+async def _while_stopped(names: Sequence[str], stage: str,
+                         step: Callable[[str], Awaitable[Optional[str]]],
+                         on_progress: Optional[ProgressCallback], parallel: int,
+                         restart: bool) -> List[SnapshotResult]:
+    """
+    Run step on each instance with it stopped, as multipass requires for
+    snapshots, restores and clones, then start the ones that were running
+    """
+    semaphore = asyncio.Semaphore(max(1, parallel))
+    states = {record.key: record.state for record in await get_instance_records_async() or []}
+
+    def progress(name: str, current: str) -> None:
+        if on_progress is not None:
+            on_progress(name, current)
+
+    async def run_one(name: str) -> SnapshotResult:
+        result = SnapshotResult(name=name)
+        async with semaphore:
+            started = time.monotonic()
+            was_running = states.get(name) in ('Running', 'Suspended')
+            current = 'stopping'
+            try:
+                if was_running:
+                    progress(name, current)
+                    if not (await stop_instances_async([name])).get(name):
+                        return result
+                current = stage
+                progress(name, current)
+                result.made = await step(name)
+                if result.made is None:
+                    if was_running and restart:
+                        # Don't leave it down because of a typo in a snapshot name
+                        await start_instances_async([name])
+                    return result
+                if was_running and restart:
+                    current = 'starting'
+                    progress(name, current)
+                    if not (await start_instances_async([name])).get(name):
+                        return result
+                result.ok = True
+            finally:
+                result.seconds = round(time.monotonic() - started, 3)
+                if not result.ok:
+                    result.failed_at = current
+                progress(name, 'done' if result.ok else 'failed')
+        return result
+
+    return list(await asyncio.gather(*[run_one(name) for name in dict.fromkeys(names)]))
+
+
+async def snapshot_instances_async(names: Sequence[str], snapshot: Optional[str] = None,
+                                   comment: Optional[str] = None,
+                                   on_progress: Optional[ProgressCallback] = None,
+                                   parallel: int = SNAPSHOT_PARALLEL,
+                                   restart: bool = True) -> List[SnapshotResult]:
+    """
+    Snapshot several instances at once, stopping them first
+
+    Args:
+        names (list): The instance names, name@host for other hosts.
+        snapshot (str): What to call the snapshots, multipass picks if None.
+        comment (str): Stored with them.
+        on_progress (callable): Gets (name, stage) as each instance moves on.
+        parallel (int): How many instances at once.
+        restart (bool): Start the instances that were running again afterwards.
+
+    Returns:
+        list: A SnapshotResult per instance, made is the snapshot's name
+    """
+    return await _while_stopped(names, 'snapshot',
+                                lambda name: take_snapshot_async(name, snapshot, comment),
+                                on_progress, parallel, restart)
+
+
+async def restore_instances_async(names: Sequence[str], snapshot: str, destructive: bool = False,
+                                  on_progress: Optional[ProgressCallback] = None,
+                                  parallel: int = SNAPSHOT_PARALLEL,
+                                  restart: bool = True) -> List[SnapshotResult]:
+    """
+    Put several instances back to the snapshot of the same name at once,
+    e.g. resetting test machines to a golden state
+
+    destructive has to be True to throw away the instances' current state,
+    multipass won't restore without it when it can't ask. Otherwise Args
+    and Returns as for snapshot_instances_async
+    """
+
+    async def restore(name: str) -> Optional[str]:
+        if not await restore_snapshot_async(name, snapshot, destructive):
+            return None
+        # What was synced to it is gone (or older)
+        forget_manifests(name)
+        return snapshot
+
+    return await _while_stopped(names, 'restore', restore, on_progress, parallel, restart)
+
+
+async def clone_instances_async(names: Sequence[str],
+                                on_progress: Optional[ProgressCallback] = None,
+                                parallel: int = SNAPSHOT_PARALLEL,
+                                restart: bool = True) -> List[SnapshotResult]:
+    """
+    Clone several instances at once, under multipass's <name>-cloneN names.
+    The clones are left stopped.
+
+    Args and Returns as for snapshot_instances_async, made is the clone's name
+    """
+    return await _while_stopped(names, 'clone', clone_instance_async, on_progress, parallel, restart)
+
+
+def format_snapshot_summary(action: str, results: Sequence[SnapshotResult]) -> List[str]:
+    """ A line per instance with what it made and how long it took, then the totals """
+    lines = []
+    for result in sorted(results, key=lambda result: (result.ok, -result.seconds)):
+        if result.ok:
+            outcome = result.made
+        else:
+            outcome = f"failed at {result.failed_at}" if result.failed_at else "failed"
+        lines.append(f"{result.name:<30} {result.seconds:>7.2f}s  {outcome}")
+    succeeded = sum(1 for result in results if result.ok)
+    slowest = max((result.seconds for result in results), default=0.0)
+    lines.append(f"{action}: {succeeded}/{len(results)} succeeded, slowest {slowest:.2f}s")
+    return lines
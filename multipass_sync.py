@@ -0,0 +1,327 @@
+# Libraries
+import asyncio
+import hashlib
+import json
+import glob
+import os
+import posixpath
+import secrets
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+# Python Files
+from multipass_utils import cache_dir, execute_multipass_stream_async, split_instance_key
+
+# How many instances are synced at once unless the caller says otherwise
+SYNC_PARALLEL = 4
+
+# Files passed to one `multipass transfer`, so the argv stays a sane length
+SYNC_FILES_PER_CALL = 100
+
+# Threads hashing files, hashlib lets go of the GIL for big reads
+SYNC_HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+_HASH_CHUNK = 1 << 20
+
+# Left in the destination on the instance, holding a token that changes with
+# every sync. A manifest is only trusted if the instance still has its token,
+# so a relaunched, restored or hand edited instance gets everything again.
+SYNC_MARKER = '.multipasser-sync'
+
+# Relative path (always with /) -> (sha256, size)
+Tree = Dict[str, Tuple[str, int]]
+
+# Called with (instance name, files sent so far, files to send)
+SyncProgressCallback = Callable[[str, int, int], None]
+
+
+def hash_file(path: str) -> str:
+    """ The sha256 of a file's content """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _digest(*parts: str) -> str:
+    return hashlib.sha1('\0'.join(parts).encode()).hexdigest()[:16]
+
+
+def _cache_file(kind: str, *parts: str) -> str:
+    """ A file under cache_dir()/sync named after parts, which may be any text """
+    return os.path.join(cache_dir(), 'sync', f'{kind}-{"-".join(_digest(part) for part in parts)}.json')
+
+
+def _load_json(path: str) -> dict:
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_json(path: str, data: dict) -> None:
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Error saving {path}: {e}")
+
+
+def scan_tree(source: str) -> Tree:
+    """
+    Hash every file under a directory
+
+    Hashes are remembered with each file's size and mtime, so on the next
+    scan only files that were touched are read again.
+
+    Args:
+        source (str): The local directory.
+
+    Returns:
+        dict: Relative path -> (sha256, size)
+    """
+    source = os.path.abspath(source)
+    cache_path = _cache_file('local', source)
+    # Relative path -> [sha256, size, mtime_ns]
+    known = _load_json(cache_path)
+    stats: Dict[str, os.stat_result] = {}
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for file_name in sorted(files):
+            if file_name == SYNC_MARKER and root == source:
+                continue
+            path = os.path.join(root, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            relative = os.path.relpath(path, source).replace(os.sep, '/')
+            stats[relative] = stat
+    tree: Tree = {}
+    to_hash = []
+    for relative, stat in stats.items():
+        cached = known.get(relative)
+        if cached and cached[1:] == [stat.st_size, stat.st_mtime_ns]:
+            tree[relative] = (cached[0], stat.st_size)
+        else:
+            to_hash.append(relative)
+    with ThreadPoolExecutor(SYNC_HASH_WORKERS) as pool:
+        digests = pool.map(lambda relative: hash_file(os.path.join(source, relative)), to_hash)
+        for relative, digest in zip(to_hash, digests):
+            tree[relative] = (digest, stats[relative].st_size)
+    if to_hash or len(known) != len(tree):
+        _save_json(cache_path, {relative: [digest, size, stats[relative].st_mtime_ns]
+                                for relative, (digest, size) in tree.items()})
+    return tree
+
+
+def manifest_path(name: str, destination: str) -> str:
+    """ Where what was last synced to destination on an instance is remembered """
+    return _cache_file('manifest', name, destination)
+
+
+def load_manifest(name: str, destination: str) -> Tuple[Optional[str], Dict[str, str]]:
+    """
+    What the last sync left on the instance, as far as this machine knows
+
+    Returns:
+        tuple: (the token it left in SYNC_MARKER, relative path -> sha256)
+    """
+    manifest = _load_json(manifest_path(name, destination))
+    files = manifest.get('files')
+    if not isinstance(files, dict):
+        return None, {}
+    return manifest.get('token'), files
+
+
+def forget_manifests(name: str) -> None:
+    """ Drop what is remembered about an instance, e.g. it was deleted or restored """
+    for path in glob.glob(os.path.join(cache_dir(), 'sync', f'manifest-{_digest(name)}-*.json')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def changed_files(tree: Tree, manifest: Dict[str, str]) -> List[str]:
+    """ The files whose content the instance doesn't have, going by the manifest """
+    return [relative for relative, (digest, _) in tree.items() if manifest.get(relative) != digest]
+
+
+def transfer_batches(files: Sequence[str]) -> List[Tuple[str, List[str]]]:
+    """
+    Group files into `multipass transfer` calls: all files of a call go to
+    the same directory, and there are at most SYNC_FILES_PER_CALL of them
+
+    Returns:
+        list: (relative directory, relative paths) per call
+    """
+    by_directory: Dict[str, List[str]] = {}
+    for relative in files:
+        by_directory.setdefault(posixpath.dirname(relative), []).append(relative)
+    return [(directory, paths[start:start + SYNC_FILES_PER_CALL])
+            for directory, paths in sorted(by_directory.items())
+            for start in range(0, len(paths), SYNC_FILES_PER_CALL)]
+
+
+@dataclass
+class SyncResult:
+    """ How a sync went on one instance """
+    name: str
+    ok: bool = False
+    sent: int = 0
+    skipped: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+async def sync_to_instances_async(source: str, destination: str, names: Sequence[str],
+                                  on_progress: Optional[SyncProgressCallback] = None,
+                                  parallel: int = SYNC_PARALLEL,
+                                  full: bool = False) -> List[SyncResult]:
+    """
+    Copy a local directory to a path on several instances at once, sending
+    only the files that changed since the last sync to each one
+
+    The tree is hashed once (see scan_tree) and compared with each
+    instance's manifest, which is updated as transfers succeed. The manifest
+    is only trusted if the instance still has the token it was saved with
+    (SYNC_MARKER), checked with one `sha256sum` in the instance. Files
+    deleted locally are left on the instances.
+
+    Args:
+        source (str): The local directory.
+        destination (str): The directory in the instances, e.g. /home/ubuntu/app.
+        names (list): The instance names. Only this machine's instances can
+            be synced, the files have to be where multipass runs.
+        on_progress (callable): Gets (name, files sent, files to send).
+        parallel (int): How many instances at once.
+        full (bool): Ignore the manifests and send everything, e.g. the
+            synced files were edited on the instance.
+
+    Returns:
+        list: A SyncResult per instance, in the order given
+    """
+    source = os.path.abspath(source)
+    destination = destination.rstrip('/') or '/'
+    tree = await asyncio.get_running_loop().run_in_executor(None, scan_tree, source)
+    semaphore = asyncio.Semaphore(max(1, parallel))
+
+    async def sync_one(key: str) -> SyncResult:
+        result = SyncResult(name=key)
+        name, host = split_instance_key(key)
+        if host:
+            result.error = 'only instances on this machine can be synced'
+            return result
+        started = time.monotonic()
+        marker = posixpath.join(destination, SYNC_MARKER)
+        token, manifest = (None, {}) if full else load_manifest(key, destination)
+        if manifest and not await _has_token(name, host, marker, token, semaphore):
+            # Not the instance the manifest is about any more
+            manifest = {}
+        files = changed_files(tree, manifest)
+        result.skipped = len(tree) - len(files)
+        # Everything that is there now, whatever happens below
+        synced = {relative: digest for relative, digest in manifest.items() if relative in tree}
+        new_token = secrets.token_hex(16)
+        try:
+            if files:
+                # Before anything else changes, so a snapshot from before this
+                # sync never has the token the manifest is saved with
+                result.error = await _put_token(name, host, marker, new_token, semaphore)
+                if result.error is not None:
+                    return result
+                token = new_token
+            for directory, paths in transfer_batches(files):
+                if on_progress is not None:
+                    on_progress(key, result.sent, len(files))
+                target = posixpath.join(destination, directory) if directory else destination
+                argv = ['multipass', 'transfer', '--parents',
+                        *[os.path.join(source, *relative.split('/')) for relative in paths],
+                        f'{name}:{target}/']
+                returncode, _, stderr = await execute_multipass_stream_async(
+                    argv, lambda stream_name, line: None, host, semaphore)
+                if returncode != 0:
+                    result.error = _last_line(returncode, stderr)
+                    return result
+                for relative in paths:
+                    synced[relative] = tree[relative][0]
+                    result.bytes += tree[relative][1]
+                result.sent += len(paths)
+            result.ok = True
+        finally:
+            result.seconds = round(time.monotonic() - started, 3)
+            if token == new_token:
+                _save_json(manifest_path(key, destination), {'token': token, 'files': synced})
+            if on_progress is not None:
+                on_progress(key, result.sent, len(files))
+        return result
+
+    return list(await asyncio.gather(*[sync_one(key) for key in dict.fromkeys(names)]))
+
+
+def _last_line(returncode: int, stderr: str) -> str:
+    return stderr.strip().splitlines()[-1] if stderr.strip() else f'exit {returncode}'
+
+
+async def _has_token(name: str, host: str, marker: str, token: Optional[str],
+                     semaphore: asyncio.Semaphore) -> bool:
+    """ Whether the instance's marker holds token, one `sha256sum` in it """
+    if not token:
+        return False
+    returncode, stdout, _ = await execute_multipass_stream_async(
+        ['multipass', 'exec', name, '--', 'sha256sum', marker], lambda stream_name, line: None,
+        host, semaphore)
+    return returncode == 0 and stdout.split()[:1] == [hashlib.sha256(token.encode()).hexdigest()]
+
+
+async def _put_token(name: str, host: str, marker: str, token: str,
+                     semaphore: asyncio.Semaphore) -> Optional[str]:
+    """ Write token to the instance's marker. Returns the error, None if it worked. """
+    handle, path = tempfile.mkstemp(prefix='multipasser-sync-')
+    try:
+        with os.fdopen(handle, 'w') as f:
+            f.write(token)
+        returncode, _, stderr = await execute_multipass_stream_async(
+            ['multipass', 'transfer', '--parents', path, f'{name}:{marker}'],
+            lambda stream_name, line: None, host, semaphore)
+    finally:
+        os.remove(path)
+    return None if returncode == 0 else _last_line(returncode, stderr)
+
+
+def format_bytes_rate(size: float, seconds: float) -> str:
+    """ 3145728, 2 -> '3.0MiB in 2.00s (1.5MiB/s)' """
+    def human(value: float) -> str:
+        for unit in ('B', 'KiB', 'MiB', 'GiB'):
+            if value < 1024:
+                return f"{value:.1f}{unit}"
+            value /= 1024
+        return f"{value:.1f}TiB"
+    rate = f" ({human(size / seconds)}/s)" if seconds > 0 and size else ""
+    return f"{human(size)} in {seconds:.2f}s{rate}"
+
+
+def format_sync_summary(results: Sequence[SyncResult], seconds: float) -> List[str]:
+    """ A line per instance, then the totals and throughput over the whole sync """
+    lines = []
+    for result in sorted(results, key=lambda result: (result.ok, -result.seconds)):
+        outcome = (f"{result.sent} sent, {result.skipped} unchanged, "
+                   f"{format_bytes_rate(result.bytes, result.seconds)}")
+        if not result.ok:
+            outcome += f"  FAILED: {result.error}"
+        lines.append(f"{result.name:<30} {outcome}")
+    succeeded = sum(1 for result in results if result.ok)
+    total = sum(result.bytes for result in results)
+    lines.append(f"{succeeded}/{len(results)} synced, {sum(result.sent for result in results)} files, "
+                 f"{format_bytes_rate(total, seconds)}")
+    return lines
@@ -0,0 +1,488 @@
+# Libraries
+import asyncio
+import codecs
+import inspect
+import itertools
+import json
+import os
+import re
+import shlex
+import shutil
+import stat
+import tempfile
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# If this is set, commands go over a persistent connection to this unix socket
+# before falling back to forking the CLI.
+SOCKET_ENV = 'MULTIPASSER_SOCKET'
+
+# The socket speaks MultiPasser's own JSON lines protocol, which only
+# fake_multipass serves, not multipassd (that's gRPC). A connection starts
+# with a hello naming it, and anything that doesn't answer in kind within
+# SOCKET_HANDSHAKE_TIMEOUT seconds is given up on for the CLI.
+SOCKET_PROTOCOL = 'multipasser/1'
+SOCKET_HANDSHAKE_TIMEOUT = 2.0
+
+# ssh exits with this when it couldn't connect, rather than passing on the remote exit code
+SSH_FAILED = 255
+
+# How long (seconds) an idle pooled ssh connection is kept open
+SSH_CONTROL_PERSIST = 600
+
+# What every transport returns: (returncode, stdout, stderr)
+CommandResult = Tuple[int, str, str]
+
+# Called with ('stdout' or 'stderr', line) as output arrives. If it returns
+# an awaitable, no more output is read until it is done.
+OutputCallback = Callable[[str, str], Any]
+
+# Longest reply line read off the socket. `list` and `info` for a big fleet
+# run to megabytes, far over asyncio's default 64KiB.
+SOCKET_READ_LIMIT = 64 << 20
+
+# How much of each of stdout and stderr a stream keeps to return at the end,
+# the rest is only passed to on_output
+STREAM_OUTPUT_LIMIT = 1 << 20
+
+# multipass redraws progress with carriage returns, so they end a line too
+_LINE_END = re.compile(r'[\r\n]')
+
+# A line longer than this is passed on in pieces, so one without an end can't grow forever
+_LINE_LIMIT = 1 << 16
+
+
+class TransportError(Exception):
+    """ The transport couldn't run the command at all (as opposed to the command failing) """
+
+
+class NotSentError(TransportError):
+    """ The command never got to the daemon, so it's safe to send it another way """
+
+
+class MultipassTransport:
+    """ How multipass commands get to the daemon """
+
+    name = 'base'
+
+    async def run(self, argv: Sequence[str]) -> CommandResult:
+        """
+        Run a multipass command
+
+        Args:
+            argv (list): e.g. ['multipass', 'list', '--format', 'json']
+
+        Returns:
+            tuple: (returncode, stdout, stderr)
+        """
+        raise NotImplementedError
+
+    async def stream(self, argv: Sequence[str], on_output: OutputCallback) -> CommandResult:
+        """
+        Run a multipass command, passing each line of output on as it arrives
+
+        Transports that can't stream hand all the lines over at the end.
+
+        Args:
+            argv (list): e.g. ['multipass', 'launch']
+            on_output (callable): Called with ('stdout' or 'stderr', line)
+
+        Returns:
+            tuple: (returncode, stdout, stderr)
+        """
+        result = await self.run(argv)
+        for stream_name, text in (('stdout', result[1]), ('stderr', result[2])):
+            for line in _LINE_END.split(text):
+                if line.strip():
+                    await _output(on_output, stream_name, line.strip())
+        return result
+
+    def interactive_argv(self, argv: Sequence[str]) -> List[str]:
+        """ What to exec, on a terminal, to run an interactive command like `multipass shell` """
+        return list(argv)
+
+    async def close(self) -> None:
+        """ Drop any connections """
+
+
+class CliTransport(MultipassTransport):
+    """ Fork the multipass CLI for every command """
+
+    name = 'cli'
+
+    async def run(self, argv: Sequence[str]) -> CommandResult:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *argv,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+            stdout, stderr = await process.communicate()
+        except OSError as e:
+            raise TransportError(str(e)) from e
+        return (process.returncode,
+                stdout.decode(errors='replace'),
+                stderr.decode(errors='replace'))
+
+    async def stream(self, argv: Sequence[str], on_output: OutputCallback) -> CommandResult:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *argv,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+        except OSError as e:
+            raise TransportError(str(e)) from e
+        try:
+            stdout, stderr = await asyncio.gather(
+                _read_lines(process.stdout, 'stdout', on_output),
+                _read_lines(process.stderr, 'stderr', on_output))
+            await process.wait()
+        except BaseException:
+            # Cancelled, or on_output raised: don't leave the command running,
+            # and read what's left so its pipes are closed too
+            if process.returncode is None:
+                process.kill()
+            await process.communicate()
+            raise
+        return process.returncode, stdout, stderr
+
+
+async def _output(on_output: OutputCallback, stream_name: str, line: str) -> None:
+    result = on_output(stream_name, line)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def _read_lines(pipe: asyncio.StreamReader, stream_name: str,
+                      on_output: OutputCallback) -> str:
+    """
+    Read a pipe until it closes, calling on_output for every complete line
+
+    Returns:
+        str: The output, up to STREAM_OUTPUT_LIMIT characters of it
+    """
+    seen = []
+    kept = 0
+    partial = ''
+    # A character can be split between two reads
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    while True:
+        chunk = await pipe.read(4096)
+        text = decoder.decode(chunk, final=not chunk)
+        if kept < STREAM_OUTPUT_LIMIT:
+            seen.append(text[:STREAM_OUTPUT_LIMIT - kept])
+            kept += len(seen[-1])
+        *lines, partial = _LINE_END.split(partial + text)
+        if len(partial) >= _LINE_LIMIT:
+            lines.append(partial)
+            partial = ''
+        for line in lines:
+            if line.strip():
+                await _output(on_output, stream_name, line.strip())
+        if not chunk:
+            break
+    if partial.strip():
+        await _output(on_output, stream_name, partial.strip())
+    return ''.join(seen)
+
+
+class _Connection:
+    """ One open socket, with replies matched to requests by id """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.ids = itertools.count(1)
+        self.reader_task = asyncio.get_running_loop().create_task(self._read_replies())
+
+    @property
+    def closed(self) -> bool:
+        return self.reader_task.done()
+
+    async def _read_replies(self) -> None:
+        error: Exception = TransportError('connection closed')
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                reply = json.loads(line)
+                future = self.pending.pop(reply['id'], None)
+                if future is not None and not future.done():
+                    future.set_result((reply['returncode'], reply['stdout'], reply['stderr']))
+        except (OSError, ValueError, KeyError) as e:
+            error = TransportError(str(e))
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.pending.clear()
+            self.writer.close()
+
+    async def request(self, argv: List[str]) -> CommandResult:
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            self.writer.write(json.dumps({'id': request_id, 'argv': argv}).encode() + b'\n')
+            await self.writer.drain()
+        except OSError as e:
+            self.pending.pop(request_id, None)
+            raise TransportError(str(e)) from e
+        return await future
+
+    async def close(self) -> None:
+        self.reader_task.cancel()
+        try:
+            await self.reader_task
+        except asyncio.CancelledError:
+            pass
+
+
+class SocketTransport(MultipassTransport):
+    """
+    Keep one connection open to a local socket and send every command over it.
+
+    This is MultiPasser's own protocol (SOCKET_PROTOCOL), not multipassd's.
+    A connection opens with {"hello": SOCKET_PROTOCOL} both ways, then
+    requests and replies are JSON lines, {"id", "argv"} one way and
+    {"id", "returncode", "stdout", "stderr"} back, so any number of commands
+    can be in flight on the same connection. If the socket can't be reached
+    or doesn't answer the hello, the command goes to the fallback transport
+    (normally the CLI) instead, but never once it has been sent. A socket
+    that answered the hello wrong isn't tried again.
+    """
+
+    name = 'socket'
+
+    def __init__(self, path: str, fallback: Optional[MultipassTransport] = None):
+        self.path = path
+        self.fallback = fallback
+        # Streams belong to an event loop, so there's one connection per loop
+        self._connections = weakref.WeakKeyDictionary()
+        self._connecting = weakref.WeakKeyDictionary()
+        # Why the socket was given up on, None while it's still worth trying
+        self.refused: Optional[str] = None
+
+    async def _open(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """ Connect and check the other end speaks SOCKET_PROTOCOL """
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.path, limit=SOCKET_READ_LIMIT)
+        except OSError as e:
+            raise NotSentError(str(e)) from e
+        try:
+            writer.write(json.dumps({'hello': SOCKET_PROTOCOL}).encode() + b'\n')
+            await writer.drain()
+            line = await asyncio.wait_for(reader.readline(), SOCKET_HANDSHAKE_TIMEOUT)
+            hello = json.loads(line)
+            if not isinstance(hello, dict) or hello.get('hello') != SOCKET_PROTOCOL:
+                raise ValueError(f'answered {line[:40]!r}')
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            writer.close()
+            self.refused = f"{self.path} doesn't speak {SOCKET_PROTOCOL} ({str(e) or 'no answer'})"
+            print(f"Error: {self.refused}, using the multipass CLI")
+            raise NotSentError(self.refused) from e
+        return reader, writer
+
+    async def _get_connection(self) -> _Connection:
+        loop = asyncio.get_running_loop()
+        connection = self._connections.get(loop)
+        if connection is not None and not connection.closed:
+            return connection
+        # Several commands may ask at once, only open one socket
+        connecting = self._connecting.get(loop)
+        if connecting is None:
+            connecting = loop.create_task(self._open())
+            self._connecting[loop] = connecting
+        try:
+            reader, writer = await asyncio.shield(connecting)
+        finally:
+            if self._connecting.get(loop) is connecting:
+                del self._connecting[loop]
+        connection = self._connections.get(loop)
+        if connection is None or connection.closed:
+            connection = _Connection(reader, writer)
+            self._connections[loop] = connection
+        return connection
+
+    async def run(self, argv: Sequence[str]) -> CommandResult:
+        argv = list(argv)
+        if not argv or os.path.basename(argv[0]) != 'multipass':
+            # Not a multipass command, only the CLI can run it
+            if self.fallback is None:
+                raise TransportError(f'{argv[0] if argv else "nothing"} is not a multipass command')
+            return await self.fallback.run(argv)
+        try:
+            if self.refused is not None:
+                raise NotSentError(self.refused)
+            connection = await self._get_connection()
+        except NotSentError:
+            if self.fallback is None:
+                raise
+            return await self.fallback.run(argv)
+        # Once the request is written it may have run, sending it again could
+        # e.g. delete twice, so a lost connection is an error from here on
+        return await connection.request(argv[1:])
+
+    async def stream(self, argv: Sequence[str], on_output: OutputCallback) -> CommandResult:
+        # Replies only come back whole, so stream through the CLI if we can
+        if self.fallback is not None:
+            return await self.fallback.stream(argv, on_output)
+        return await super().stream(argv, on_output)
+
+    async def close(self) -> None:
+        loop = asyncio.get_running_loop()
+        connection = self._connections.pop(loop, None)
+        if connection is not None:
+            await connection.close()
+
+
+class SshTransport(CliTransport):
+    """
+    Run multipass on another machine over ssh, sharing one connection.
+
+    ssh's connection multiplexing (ControlMaster) keeps a master connection
+    open per host, and every command after the first goes over it instead of
+    doing its own TCP and key exchange. The first command on a host is sent
+    on its own so that commands fired off together don't each start a master.
+    Authentication has to work without prompting (keys or an agent).
+
+    Anyone who can get into the directory the master's socket is in can use
+    the connection, so it's a fresh temporary directory (removed by close())
+    unless one is given, and a given one is refused if it isn't the user's
+    own with mode 0700.
+    """
+
+    name = 'ssh'
+
+    def __init__(self, address: str, user: Optional[str] = None, port: Optional[int] = None,
+                 control_dir: Optional[str] = None, persist: int = SSH_CONTROL_PERSIST,
+                 ssh: str = 'ssh'):
+        self.address = address
+        self.user = user
+        self.port = port
+        # None until first used, then the checked or made directory
+        self._control_dir = control_dir
+        self._control_dir_checked = False
+        self._own_control_dir = False
+        self.persist = persist
+        self.ssh = ssh
+        self.connected = False
+        self._connecting = weakref.WeakKeyDictionary()
+
+    @property
+    def control_dir(self) -> str:
+        """ Where the master's socket is, made (or checked) on first use """
+        if self._control_dir is None:
+            self._control_dir = tempfile.mkdtemp(prefix='multipasser-ssh-')
+            self._own_control_dir = True
+        elif not self._control_dir_checked:
+            try:
+                os.makedirs(self._control_dir, mode=0o700, exist_ok=True)
+                info = os.lstat(self._control_dir)
+            except OSError as e:
+                raise TransportError(f"can't use {self._control_dir} for ssh connections: {e}") from e
+            owner = os.getuid() if hasattr(os, 'getuid') else info.st_uid
+            if not stat.S_ISDIR(info.st_mode) or info.st_uid != owner or stat.S_IMODE(info.st_mode) != 0o700:
+                raise TransportError(f"won't keep ssh connections in {self._control_dir}, "
+                                     f"it has to be a directory of yours with mode 0700")
+        self._control_dir_checked = True
+        return self._control_dir
+
+    def ssh_argv(self, *options: str) -> List[str]:
+        """ ssh and its options, up to and including the address """
+        argv = [self.ssh,
+                '-o', 'ControlMaster=auto',
+                '-o', f'ControlPath={os.path.join(self.control_dir, "%C")}',
+                '-o', f'ControlPersist={self.persist}',
+                '-o', 'BatchMode=yes',
+                *options]
+        if self.port:
+            argv += ['-p', str(self.port)]
+        if self.user:
+            argv += ['-l', self.user]
+        return argv + [self.address]
+
+    def remote_argv(self, argv: Sequence[str]) -> List[str]:
+        """ What to exec locally to run argv on the host """
+        return self.ssh_argv() + ['--', shlex.join(argv)]
+
+    def interactive_argv(self, argv: Sequence[str]) -> List[str]:
+        # -t, as the remote command needs a terminal too
+        return self.ssh_argv('-t') + ['--', shlex.join(argv)]
+
+    async def _connect(self) -> Optional[asyncio.Lock]:
+        """
+        Hold back every command but the first until the shared connection is up
+
+        Returns:
+            Lock: Held if this command is the one making the connection, to be
+            released with _connected(), otherwise None
+        """
+        if self.connected:
+            return None
+        loop = asyncio.get_running_loop()
+        lock = self._connecting.get(loop)
+        if lock is None:
+            lock = self._connecting[loop] = asyncio.Lock()
+        await lock.acquire()
+        if self.connected:
+            lock.release()
+            return None
+        return lock
+
+    def _connected(self, result: CommandResult, lock: Optional[asyncio.Lock]) -> CommandResult:
+        if lock is not None:
+            self.connected = result[0] != SSH_FAILED
+            lock.release()
+        if result[0] == SSH_FAILED:
+            raise TransportError(f'ssh to {self.address} failed: {result[2].strip()}')
+        return result
+
+    async def run(self, argv: Sequence[str]) -> CommandResult:
+        lock = await self._connect()
+        try:
+            result = await super().run(self.remote_argv(argv))
+        except TransportError as e:
+            result = (SSH_FAILED, '', str(e))
+        except BaseException:
+            if lock is not None:
+                lock.release()
+            raise
+        return self._connected(result, lock)
+
+    async def stream(self, argv: Sequence[str], on_output: OutputCallback) -> CommandResult:
+        lock = await self._connect()
+        try:
+            result = await super().stream(self.remote_argv(argv), on_output)
+        except TransportError as e:
+            result = (SSH_FAILED, '', str(e))
+        except BaseException:
+            if lock is not None:
+                lock.release()
+            raise
+        return self._connected(result, lock)
+
+    async def close(self) -> None:
+        """ Shut the shared connection, and remove the directory if it was made for it """
+        if self.connected:
+            self.connected = False
+            try:
+                await super().run(self.ssh_argv('-O', 'exit'))
+            except TransportError:
+                pass
+        if self._own_control_dir:
+            shutil.rmtree(self._control_dir, ignore_errors=True)
+            self._control_dir = None
+            self._own_control_dir = False
+            self._control_dir_checked = False
+
+
+def default_transport() -> MultipassTransport:
+    """ The socket transport if MULTIPASSER_SOCKET is set, otherwise the CLI """
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return SocketTransport(path, fallback=CliTransport())
+    return CliTransport()
@@ -1,79 +1,976 @@
 # I dont like importing libraries here and in main.py, but hey ho.
 # Libraries
-import subprocess
+import asyncio
 import re
 import json
-from typing import Dict, Any, List, Optional
+import os
+import shlex
+import subprocess
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Any, List, Optional, Sequence, Tuple, Union
+# Python Files
+from multipass_metrics import command_metrics
+from multipass_transport import (MultipassTransport, CliTransport, SocketTransport,
+                                 TransportError, default_transport, STREAM_OUTPUT_LIMIT)
+
+# How many multipass processes we allow to run at the same time. multipassd
+# serialises a lot of work internally, so flooding it just queues up there.
+MAX_CONCURRENT_COMMANDS = 4
+
+# Long running commands that stream their output (launch) have their own
+# limit, so a few slow launches don't starve the quick queries.
+MAX_CONCURRENT_STREAMS = 4
+
+# Semaphores per event loop, as asyncio primitives are bound to the loop
+# they are first used on and the sync wrappers below create a loop per call.
+# Each host has its own command and stream limits, so a slow host doesn't
+# hold up the rest.
+_command_semaphores = weakref.WeakKeyDictionary()
+_stream_semaphores = weakref.WeakKeyDictionary()
+
+# How commands reach multipassd, see multipass_transport.py. Picked on first
+# use so MULTIPASSER_SOCKET can be set after import.
+_transport: Optional[MultipassTransport] = None
+
+# Other machines running multipass: host name -> transport (see multipass_hosts.py).
+# Their instances are called name@host, instances on this machine just name.
+_host_transports: Dict[str, MultipassTransport] = {}
+HOST_SEPARATOR = '@'
+
+# Where things kept between runs go (the image catalog, sync manifests),
+# ~/.cache/multipasser by default
+CACHE_DIR_ENV = 'MULTIPASSER_CACHE'
+
+# How long (seconds) a `multipass list` result is reused by the query helpers
+# before it is fetched again. Mutating helpers invalidate it straight away.
+INSTANCE_CACHE_TTL = 2.0
+
+
+def set_max_concurrent_commands(limit: int) -> None:
+    """ Change how many multipass commands can run at once """
+    global MAX_CONCURRENT_COMMANDS
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    MAX_CONCURRENT_COMMANDS = limit
+    _command_semaphores.clear()
+
+
+def set_max_concurrent_streams(limit: int) -> None:
+    """ Change how many streaming commands (launches) can run at once """
+    global MAX_CONCURRENT_STREAMS
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    MAX_CONCURRENT_STREAMS = limit
+    _stream_semaphores.clear()
+
+
+def _get_command_semaphore(host: str = '') -> asyncio.Semaphore:
+    """ Get the concurrency limiter of a host for the running event loop """
+    loop = asyncio.get_running_loop()
+    semaphores = _command_semaphores.get(loop)
+    if semaphores is None:
+        semaphores = _command_semaphores[loop] = {}
+    semaphore = semaphores.get(host)
+    if semaphore is None:
+        semaphore = semaphores[host] = asyncio.Semaphore(MAX_CONCURRENT_COMMANDS)
+    return semaphore
+
+
+def _get_stream_semaphore(host: str = '') -> asyncio.Semaphore:
+    """ Get the streaming command limiter of a host for the running event loop """
+    loop = asyncio.get_running_loop()
+    semaphores = _stream_semaphores.get(loop)
+    if semaphores is None:
+        semaphores = _stream_semaphores[loop] = {}
+    semaphore = semaphores.get(host)
+    if semaphore is None:
+        semaphore = semaphores[host] = asyncio.Semaphore(MAX_CONCURRENT_STREAMS)
+    return semaphore
+
+
+def cache_dir() -> str:
+    """ MULTIPASSER_CACHE, or multipasser under XDG_CACHE_HOME (~/.cache) """
+    if os.environ.get(CACHE_DIR_ENV):
+        return os.environ[CACHE_DIR_ENV]
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'multipasser')
+
+
+def get_transport() -> MultipassTransport:
+    """ The transport commands are currently sent over """
+    global _transport
+    if _transport is None:
+        _transport = default_transport()
+    return _transport
+
+
+def set_transport(transport: Optional[MultipassTransport]) -> None:
+    """ Send commands over a different transport, None goes back to the default """
+    global _transport
+    _transport = transport
+
+
+def add_host(host: str, transport: MultipassTransport) -> None:
+    """ Include another machine's multipass, reached over transport """
+    if not host or HOST_SEPARATOR in host:
+        raise ValueError(f"bad host name {host!r}")
+    _host_transports[host] = transport
+    instance_cache.invalidate()
+
+
+def remove_hosts() -> None:
+    """ Back to only this machine's multipass """
+    _host_transports.clear()
+    instance_cache.invalidate()
+
+
+def get_hosts() -> List[str]:
+    """ The other hosts, '' (this machine) not included """
+    return list(_host_transports)
+
 
+def get_host_transport(host: str = '') -> MultipassTransport:
+    """ The transport for a host, '' is this machine """
+    if not host:
+        return get_transport()
+    try:
+        return _host_transports[host]
+    except KeyError:
+        raise TransportError(f'unknown host "{host}"') from None
+
+
+def instance_key(name: str, host: str = '') -> str:
+    """ What an instance is called across hosts: name, or name@host if it's elsewhere """
+    return f'{name}{HOST_SEPARATOR}{host}' if host else name
+
+
+def split_instance_key(key: str) -> Tuple[str, str]:
+    """ 'web@build1' -> ('web', 'build1'), 'web' -> ('web', '') """
+    name, _, host = key.partition(HOST_SEPARATOR)
+    return name, host
+
+
+def group_by_host(keys: Sequence[str]) -> Dict[str, List[str]]:
+    """ Instance keys -> host -> instance names on it """
+    hosts: Dict[str, List[str]] = {}
+    for key in dict.fromkeys(keys):
+        name, host = split_instance_key(key)
+        hosts.setdefault(host, []).append(name)
+    return hosts
+
+
+def build_multipass_argv(command: Union[str, Sequence[str]]) -> List[str]:
+    """
+    Turn a command into an argv list we can exec without a shell.
+
+    Args:
+        command (str | list): Either 'multipass list --format json' or
+            ['multipass', 'list', '--format', 'json'].
+
+    Returns:
+        list: The argv list.
+    """
+    if isinstance(command, str):
+        return shlex.split(command)
+    return [str(arg) for arg in command]
 
-def run_multipass_command(command):
+
+async def execute_multipass_command_async(command: Union[str, Sequence[str]],
+                                          host: str = '') -> Tuple[int, str, str]:
+    """
+    Run a multipass command and return everything about how it went.
+
+    The command goes over the host's transport, for this machine by default
+    it is exec'd directly (no /bin/sh in between). At most
+    MAX_CONCURRENT_COMMANDS of them run at the same time on each host. How
+    long it waited and ran is recorded in multipass_metrics.command_metrics.
+
+    Args:
+        command (str | list): The command to run.
+        host (str): Which host to run it on, '' for this machine.
+
+    Returns:
+        tuple: (returncode, stdout, stderr), returncode is 127 if it couldn't be run at all
+    """
+    argv = build_multipass_argv(command)
+    started = time.time()
+    queued = time.perf_counter()
+    running = None
+    try:
+        transport = get_host_transport(host)
+        async with _get_command_semaphore(host):
+            running = time.perf_counter()
+            result = await transport.run(argv)
+    except TransportError as e:
+        result = (127, '', str(e))
+    finished = time.perf_counter()
+    running = running or finished
+    command_metrics.record(argv, started, running - queued, finished - running, result[0], result[2],
+                           host=host)
+    return result
+
+
+async def run_multipass_command_async(command: Union[str, Sequence[str]],
+                                      host: str = '') -> Optional[str]:
+    """
+    Run a multipass command without blocking the event loop.
+
+    Args:
+        command (str | list): The command to run.
+        host (str): Which host to run it on, '' for this machine.
+
+    Returns:
+        str: The output of the command, or None if it failed.
+    """
+    argv = build_multipass_argv(command)
+    returncode, stdout, stderr = await execute_multipass_command_async(argv, host)
+    if returncode == 127 and not stdout:
+        print(f"Error: {stderr}")
+        return None
+    if returncode != 0:
+        print(f"Error: Command '{shlex.join(argv)}' returned non-zero exit "
+              f"status {returncode}. {stderr.strip()}")
+        return None
+    return stdout.strip()
+
+
+def run_multipass_command(command: Union[str, Sequence[str]]) -> Optional[str]:
     """
     Run a multipass command and capture its output.
 
+    Blocking wrapper around run_multipass_command_async for scripts and tests,
+    don't call it from inside a running event loop (i.e. the TUI).
+
     Args:
-        command (str): The command to run.
+        command (str | list): The command to run.
 
     Returns:
         str: The output of the command.
     """
+    return asyncio.run(run_multipass_command_async(command))
+
+
+async def execute_multipass_stream_async(command: Union[str, Sequence[str]],
+                                        on_output: Callable[[str, str], Any], host: str = '',
+                                        semaphore: Optional[asyncio.Semaphore] = None
+                                        ) -> Tuple[int, str, str]:
+    """
+    Run a multipass command, passing its output on line by line as it arrives,
+    and return everything about how it went.
+
+    If on_output returns an awaitable it is awaited before more output is
+    read, so a slow consumer holds the command up rather than output piling
+    up in memory. Only the first STREAM_OUTPUT_LIMIT characters of each of
+    stdout and stderr are kept for the return value.
+
+    Args:
+        command (str | list): The command to run.
+        on_output (callable): Called with ('stdout' or 'stderr', line).
+        host (str): Which host to run it on, '' for this machine.
+        semaphore (Semaphore): What limits how many run at once, the shared
+            host's MAX_CONCURRENT_STREAMS limit by default.
+
+    Returns:
+        tuple: (returncode, stdout, stderr), returncode is 127 if it couldn't be run at all
+    """
+    argv = build_multipass_argv(command)
+    started = time.time()
+    queued = time.perf_counter()
+    running = None
     try:
-        # Run the command and capture its output
-        result = subprocess.run(command, shell=True, check=True,
-                                capture_output=True, text=True)
-        output = result.stdout.strip()
-        return output
-    except subprocess.CalledProcessError as e:
-        print(f"Error: {e}")
+        transport = get_host_transport(host)
+        async with semaphore or _get_stream_semaphore(host):
+            running = time.perf_counter()
+            result = await transport.stream(argv, on_output)
+    except TransportError as e:
+        result = (127, '', str(e))
+    finished = time.perf_counter()
+    running = running or finished
+    command_metrics.record(argv, started, running - queued, finished - running, result[0], result[2],
+                           host=host)
+    return result
+
+
+async def stream_multipass_command_async(command: Union[str, Sequence[str]],
+                                        on_output: Callable[[str, str], Any],
+                                        host: str = '') -> Optional[str]:
+    """
+    Run a multipass command, passing its output on line by line as it arrives.
+
+    Args:
+        command (str | list): The command to run.
+        on_output (callable): Called with ('stdout' or 'stderr', line).
+        host (str): Which host to run it on, '' for this machine.
+
+    Returns:
+        str: All of the output of the command, or None if it failed.
+    """
+    argv = build_multipass_argv(command)
+    returncode, stdout, stderr = await execute_multipass_stream_async(argv, on_output, host)
+    if returncode == 127 and not stdout:
+        print(f"Error: {stderr}")
+        return None
+    if returncode != 0:
+        print(f"Error: Command '{shlex.join(argv)}' returned non-zero exit "
+              f"status {returncode}. {stderr.strip()}")
         return None
+    return stdout.strip()
 
 
-def get_multipass_version() -> str:
+async def get_multipass_version_async() -> Optional[str]:
     """
     Check we can see multipass and get its version
 
     Returns:
-        str: The multipass version number we are running
+        str: The multipass version number we are running, None if multipass
+            can't be run or its version can't be read
 
     """
-    try:
-        output = run_multipass_command('multipass --version')
-        lines = output.splitlines()
-        pattern = r'\b\d+\.\d+\.\d+'
-        match = re.search(pattern, lines[0])
-        if match:
-            version = match.group()
-        else:
-            version = None
-        output = version
-        return output
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing multipass command: {e}")
-        exit(1)
+    output = await run_multipass_command_async(['multipass', '--version'])
+    if output is None:
+        print("Error executing multipass command: multipass --version")
+        return None
+    lines = output.splitlines()
+    pattern = r'\b\d+\.\d+\.\d+'
+    match = re.search(pattern, lines[0])
+    if match:
+        version = match.group()
+    else:
+        version = None
+    return version
 
 
-def get_multipass_instances() -> Dict[str, Any]:
+def get_multipass_version() -> Optional[str]:
+    """ Blocking version of get_multipass_version_async, None if there's no version to be had """
+    return asyncio.run(get_multipass_version_async())
+
+
+async def fetch_host_instances_async(host: str = '') -> Dict[str, Any]:
     """
-    Get a json object of all instances
+    Get a json object of one host's instances straight from multipass (no cache)
+
+    Args:
+        host (str): Which host, '' for this machine. Other hosts' instances
+            are tagged with a 'host' key.
 
         Returns:
         Dict: An object that has the multipass instances in JSON/DICT format
 
     """
     try:
-        output = run_multipass_command('multipass list --format json')
+        output = await run_multipass_command_async(['multipass', 'list', '--format', 'json'], host)
         instances = json.loads(output)
         # Check if the "list" key contains any items
         if len(instances["list"]) >= 0:
+            if host:
+                for item in instances["list"]:
+                    item["host"] = host
             return instances
         else:
             return None
     except Exception as e:
         # Handle any exceptions gracefully
-        print(f"An error occurred getting the instances: {e}")
+        print(f"An error occurred getting the instances{f' on {host}' if host else ''}: {e}")
         return None
 
 
-def change_multipass_instance_power_state(instance_name: str, desired_state: str):
+async def fetch_multipass_instances_async() -> Dict[str, Any]:
+    """
+    Get a json object of all instances straight from multipass (no cache)
+
+    With other hosts added, every host is asked at the same time and the
+    lists are merged, so this takes as long as the slowest host. Hosts that
+    fail are left out, and listed under 'unreachable'.
+
+        Returns:
+        Dict: An object that has the multipass instances in JSON/DICT format
+
+    """
+    hosts = [''] + get_hosts()
+    if len(hosts) == 1:
+        return await fetch_host_instances_async()
+    results = await asyncio.gather(*[fetch_host_instances_async(host) for host in hosts])
+    if all(result is None for result in results):
+        return None
+    merged: Dict[str, Any] = {'list': [], 'unreachable': []}
+    for host, result in zip(hosts, results):
+        if result is None:
+            merged['unreachable'].append(host or 'local')
+        else:
+            merged['list'] += result['list']
+    return merged
+
+
+# The DataTable columns and the Instance attribute each one shows. Host is
+# only shown when other hosts have been added.
+INSTANCE_TABLE_COLUMNS = {'Name': 'key', 'State': 'state', 'IPv4': 'ipv4', 'Release': 'release',
+                          'Host': 'host'}
+
+
+class Instance:
+    """
+    One instance from `multipass list --format json`
+
+    Parsed once when the list is fetched and shared by the table, the state
+    filters and everything else. Reading it like the JSON dict it came from
+    (instance['name']) still works.
+    """
+
+    __slots__ = ('name', 'state', 'ipv4', 'release', 'host')
+
+    def __init__(self, name: str, state: str, ipv4: Sequence[str] = (), release: str = '',
+                 host: str = ''):
+        self.name = name
+        self.state = state
+        self.ipv4 = tuple(ipv4)
+        self.release = release
+        # '' for this machine
+        self.host = host
+
+    @property
+    def key(self) -> str:
+        """ The name, or name@host for instances on other hosts """
+        return instance_key(self.name, self.host)
+
+    @classmethod
+    def from_json(cls, item: Dict[str, Any]) -> 'Instance':
+        return cls(item['name'], item['state'], item.get('ipv4') or (), item.get('release') or '',
+                   item.get('host') or '')
+
+    def to_json(self) -> Dict[str, Any]:
+        """ The `multipass list --format json` entry for this instance """
+        item = {'ipv4': list(self.ipv4), 'name': self.name, 'release': self.release,
+                'state': self.state}
+        if self.host:
+            item['host'] = self.host
+        return item
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            value = getattr(self, key) if key in self.__slots__ else None
+        except AttributeError:
+            value = None
+        if value is None:
+            raise KeyError(key)
+        return list(value) if key == 'ipv4' else value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def cell(self, attribute: str) -> str:
+        """ One attribute formatted for the table """
+        if attribute == 'ipv4':
+            return ', '.join(self.ipv4) or '--'
+        if attribute == 'host':
+            return self.host or 'local'
+        return str(getattr(self, attribute))
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Instance):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __hash__(self) -> int:
+        # Defining __eq__ drops the inherited one, and the frozen events hash their fields
+        return hash(tuple(getattr(self, slot) for slot in self.__slots__))
+
+    def __repr__(self) -> str:
+        host = f", host={self.host!r}" if self.host else ""
+        return f"Instance({self.name!r}, {self.state!r}, {self.ipv4!r}, {self.release!r}{host})"
+
+
+def parse_instances(instances: Dict[str, Any]) -> List[Instance]:
+    """ Turn a `multipass list --format json` result into Instance records """
+    return [Instance.from_json(item) for item in instances['list']]
+
+
+def instance_table_columns() -> List[str]:
+    """ The table columns, with Host only if there are other hosts """
+    return [column for column in INSTANCE_TABLE_COLUMNS if column != 'Host' or get_hosts()]
+
+
+def instance_table_rows(records: Sequence[Instance],
+                        columns: Optional[Sequence[str]] = None) -> List[List[str]]:
+    """ Project records onto the table columns, one row of strings per instance """
+    if columns is None:
+        columns = instance_table_columns()
+    attributes = [INSTANCE_TABLE_COLUMNS[column] for column in columns]
+    return [[record.cell(attribute) for attribute in attributes] for record in records]
+
+
+class InstanceCache:
+    """
+    One `multipass list --format json` shared by every query helper.
+
+    The result is parsed into Instance records and indexed by state and by
+    name in a single pass, then reused
+    for `ttl` seconds, or until invalidate() is called after something that
+    changes an instance. Concurrent callers on the same event loop share one
+    in-flight fetch.
+    """
+
+    def __init__(self, ttl: float = INSTANCE_CACHE_TTL):
+        self.ttl = ttl
+        self.instances: Optional[Dict[str, Any]] = None
+        self.records: List[Instance] = []
+        self.by_state: Dict[str, List[Instance]] = {}
+        self.by_name: Dict[str, Instance] = {}
+        self.fetched_at: Optional[float] = None
+        self.generation = 0
+        self._inflight = None
+
+    def is_fresh(self) -> bool:
+        """ Can we answer from what we already have """
+        return (self.fetched_at is not None
+                and time.monotonic() - self.fetched_at < self.ttl)
+
+    def invalidate(self) -> None:
+        """ Throw the current result away, the next query fetches again """
+        self.generation += 1
+        self.fetched_at = None
+        self._inflight = None
+
+    def load(self, instances: Dict[str, Any]) -> None:
+        """ Store a `multipass list` result and index it """
+        records = parse_instances(instances)
+        by_state: Dict[str, List[Instance]] = {}
+        by_name: Dict[str, Instance] = {}
+        for record in records:
+            by_state.setdefault(record.state, []).append(record)
+            by_name[record.key] = record
+        self.instances = instances
+        self.records = records
+        self.by_state = by_state
+        self.by_name = by_name
+        self.fetched_at = time.monotonic()
+
+    async def _fetch(self, generation: int) -> Optional[Dict[str, Any]]:
+        instances = await fetch_multipass_instances_async()
+        # Only keep it if nothing was changed while we were asking
+        if instances is not None and generation == self.generation:
+            self.load(instances)
+        return instances
+
+    async def get_async(self, force: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Get all instances, fetching them only if the cache is stale
+
+        Args:
+            force (bool): Fetch even if the cache is still fresh.
+
+        Returns:
+            Dict: The multipass instances in JSON/DICT format
+        """
+        if not force and self.is_fresh():
+            return self.instances
+        loop = asyncio.get_running_loop()
+        inflight = self._inflight
+        if (force or inflight is None or inflight[0] is not loop
+                or inflight[1] != self.generation or inflight[2].done()):
+            task = loop.create_task(self._fetch(self.generation))
+            inflight = self._inflight = (loop, self.generation, task)
+        return await asyncio.shield(inflight[2])
+
+    async def get_records_async(self, force: bool = False) -> Optional[List[Instance]]:
+        """ Get all instances as Instance records """
+        instances = await self.get_async(force=force)
+        if instances is None:
+            return None
+        if instances is not self.instances:
+            # Something changed while this was being fetched, so it wasn't kept
+            return parse_instances(instances)
+        return self.records
+
+    async def get_by_state_async(self, state: str) -> List[Instance]:
+        """ Get the instances in a given state, e.g. 'Running' """
+        if await self.get_async() is None:
+            return []
+        return list(self.by_state.get(state, []))
+
+    async def get_by_name_async(self, name: str) -> Optional[Instance]:
+        """ Get a single instance by its name """
+        if await self.get_async() is None:
+            return None
+        return self.by_name.get(name)
+
+
+# Shared by the helpers below and the TUI
+instance_cache = InstanceCache()
+
+
+def set_instance_cache_ttl(ttl: float) -> None:
+    """ Change how long (seconds) instance lists are reused, 0 disables caching """
+    global INSTANCE_CACHE_TTL
+    INSTANCE_CACHE_TTL = ttl
+    instance_cache.ttl = ttl
+
+
+def invalidate_instance_cache() -> None:
+    """ Force the next instance query to ask multipass again """
+    instance_cache.invalidate()
+
+
+# `multipass info` results kept per instance. Short, as load and memory move.
+INFO_CACHE_TTL = 5.0
+INFO_CACHE_SIZE = 64
+
+
+async def fetch_instance_info_async(names: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Get `multipass info` for several instances with one call (per host)
+
+    multipass fails the whole call if any one name is gone (deleted since it
+    was listed, say), so if the call fails each instance is asked on its own
+    and only the ones that fail are left out.
+
+    Args:
+        names (list): The instance names, name@host for other hosts.
+
+    Returns:
+        Dict: Instance name -> its info, missing names are left out
+    """
+    by_host = group_by_host(names)
+    if len(by_host) > 1:
+        # One call per host, all at once
+        results = await asyncio.gather(*[fetch_instance_info_async(
+            [instance_key(name, host) for name in host_names]) for host, host_names in by_host.items()])
+        return {key: info for result in results for key, info in result.items()}
+    if not by_host:
+        return {}
+    (host, names), = by_host.items()
+    infos = await _fetch_host_info_async(names, host)
+    if infos is None and len(names) > 1:
+        results = await asyncio.gather(*[_fetch_host_info_async([name], host) for name in names])
+        infos = {name: info for result in results if result for name, info in result.items()}
+    return {instance_key(name, host): info for name, info in (infos or {}).items()}
+
+
+async def _fetch_host_info_async(names: Sequence[str], host: str) -> Optional[Dict[str, Dict[str, Any]]]:
+    """ One `multipass info` call on a host, None if it failed """
+    try:
+        output = await run_multipass_command_async(['multipass', 'info', *names, '--format', 'json'], host)
+        if output is None:
+            return None
+        return json.loads(output)['info']
+    except Exception as e:
+        # Handle any exceptions gracefully
+        print(f"An error occurred getting the instance info: {e}")
+        return None
+
+
+def fetch_instance_info(names: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+    """ Get `multipass info` for several instances with one call """
+    return asyncio.run(fetch_instance_info_async(names))
+
+
+class InstanceInfoCache:
+    """
+    LRU cache of `multipass info` per instance.
+
+    Entries live for `ttl` seconds, at most `size` are kept, and an entry is
+    dropped if the instance is asked for in a different state than it had
+    when it was fetched. Concurrent callers for the same name share a fetch.
+    """
+
+    def __init__(self, ttl: float = INFO_CACHE_TTL, size: int = INFO_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.entries: 'OrderedDict[str, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self._inflight: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Task]] = {}
+
+    def peek(self, name: str, state: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """ The cached info if it's still good, without fetching """
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        fetched_at, info = entry
+        if time.monotonic() - fetched_at >= self.ttl or (state is not None and info.get('state') != state):
+            del self.entries[name]
+            return None
+        self.entries.move_to_end(name)
+        return info
+
+    def store(self, name: str, info: Dict[str, Any]) -> None:
+        self.entries[name] = (time.monotonic(), info)
+        self.entries.move_to_end(name)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """ Forget one instance, or everything """
+        if name is None:
+            self.entries.clear()
+            self._inflight.clear()
+        else:
+            self.entries.pop(name, None)
+            self._inflight.pop(name, None)
+
+    async def _fetch(self, name: str) -> Optional[Dict[str, Any]]:
+        info = (await fetch_instance_info_async([name])).get(name)
+        if info is not None and name in self._inflight:
+            self.store(name, info)
+        self._inflight.pop(name, None)
+        return info
+
+    async def get_async(self, name: str, state: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get info for one instance, fetching only if there's nothing good cached
+
+        Args:
+            name (str): The instance name.
+            state (str): The state the caller thinks it is in, if known.
+
+        Returns:
+            Dict: The instance info, None if it couldn't be fetched
+        """
+        info = self.peek(name, state)
+        if info is not None:
+            return info
+        loop = asyncio.get_running_loop()
+        inflight = self._inflight.get(name)
+        if inflight is None or inflight[0] is not loop or inflight[1].done():
+            inflight = self._inflight[name] = (loop, loop.create_task(self._fetch(name)))
+        return await asyncio.shield(inflight[1])
+
+
+instance_info_cache = InstanceInfoCache()
+
+
+async def get_instance_info_async(name: str, state: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """ Return `multipass info` for an instance, from the cache if it's fresh """
+    return await instance_info_cache.get_async(name, state)
+
+
+def get_instance_info(name: str) -> Optional[Dict[str, Any]]:
+    """ Return `multipass info` for an instance, from the cache if it's fresh """
+    return asyncio.run(get_instance_info_async(name))
+
+
+async def get_multipass_instances_async(force: bool = False) -> Dict[str, Any]:
+    """
+    Get a json object of all instances
+
+    Args:
+        force (bool): Skip the cache and ask multipass.
+
+        Returns:
+        Dict: An object that has the multipass instances in JSON/DICT format
+
+    """
+    return await instance_cache.get_async(force=force)
+
+
+def get_multipass_instances(force: bool = False) -> Dict[str, Any]:
+    """ Blocking version of get_multipass_instances_async """
+    return asyncio.run(get_multipass_instances_async(force=force))
+
+
+async def get_instance_records_async(force: bool = False) -> Optional[List[Instance]]:
+    """
+    Get all instances as Instance records
+
+    Args:
+        force (bool): Skip the cache and ask multipass.
+
+    Returns:
+        list: The instances, or None if multipass couldn't be asked
+    """
+    return await instance_cache.get_records_async(force=force)
+
+
+def get_instance_records(force: bool = False) -> Optional[List[Instance]]:
+    """ Blocking version of get_instance_records_async """
+    return asyncio.run(get_instance_records_async(force=force))
+
+
+async def get_instance_async(name: str) -> Optional[Instance]:
+    """ Return a single instance by name, or None """
+    return await instance_cache.get_by_name_async(name)
+
+
+def get_instance(name: str) -> Optional[Instance]:
+    """ Return a single instance by name, or None """
+    return asyncio.run(get_instance_async(name))
+
+
+async def get_multipass_instances_by_state_async(state: str) -> List[Instance]:
+    """ Return instances in the given state """
+    return await instance_cache.get_by_state_async(state)
+
+
+def get_multipass_instances_by_state(state: str) -> List[Instance]:
+    """ Return instances in the given state """
+    return asyncio.run(get_multipass_instances_by_state_async(state))
+
+
+async def get_multipass_instances_by_states_async() -> Dict[str, List[Instance]]:
+    """ Return every state partition from a single fetch """
+    if await instance_cache.get_async() is None:
+        return {}
+    return {state: list(items) for state, items in instance_cache.by_state.items()}
+
+
+def get_multipass_instances_by_states() -> Dict[str, List[Instance]]:
+    """ Return every state partition from a single fetch """
+    return asyncio.run(get_multipass_instances_by_states_async())
+
+
+# States an instance only passes through, while any instance is in one of
+# these the watcher polls quickly. Deleted instances are waiting on a purge.
+TRANSITIONAL_STATES = {'Starting', 'Restarting', 'Suspending', 'Delayed Shutdown', 'Deleted'}
+
+# Watcher poll intervals in seconds
+WATCH_FAST_INTERVAL = 1.0
+WATCH_SLOW_INTERVAL = 10.0
+WATCH_MAX_INTERVAL = 60.0
+# Never poll more often than this many times the last `multipass list` took
+WATCH_SLOW_DAEMON_FACTOR = 5
+
+
+@dataclass(frozen=True)
+class InstanceEvent:
+    """ Something changed about an instance """
+    name: str
+
+
+@dataclass(frozen=True)
+class InstanceAdded(InstanceEvent):
+    instance: Union[Instance, Dict[str, Any]] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class InstanceRemoved(InstanceEvent):
+    instance: Union[Instance, Dict[str, Any]] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class InstanceStateChanged(InstanceEvent):
+    old_state: str = ''
+    new_state: str = ''
+
+
+@dataclass(frozen=True)
+class InstanceIpChanged(InstanceEvent):
+    old_ipv4: Tuple[str, ...] = ()
+    new_ipv4: Tuple[str, ...] = ()
+
+
+def diff_instances(old: Dict[str, Dict[str, Any]],
+                   new: Dict[str, Dict[str, Any]]) -> List[InstanceEvent]:
+    """
+    Compare two name -> instance mappings and describe the changes
+
+    Args:
+        old (dict): The instances as they were, keyed by name.
+        new (dict): The instances as they are now, keyed by name.
+
+    Returns:
+        list: The InstanceEvents, in name order.
+    """
+    events: List[InstanceEvent] = []
+    for name in sorted(old.keys() | new.keys()):
+        before = old.get(name)
+        after = new.get(name)
+        if before is None:
+            events.append(InstanceAdded(name, after))
+        elif after is None:
+            events.append(InstanceRemoved(name, before))
+        else:
+            if before['state'] != after['state']:
+                events.append(InstanceStateChanged(name, before['state'], after['state']))
+            old_ipv4 = tuple(before.get('ipv4', []))
+            new_ipv4 = tuple(after.get('ipv4', []))
+            if old_ipv4 != new_ipv4:
+                events.append(InstanceIpChanged(name, old_ipv4, new_ipv4))
+    return events
+
+
+class InstanceWatcher:
+    """
+    Polls `multipass list` in the background and reports what changed.
+
+    Polls every fast_interval while an instance is in a TRANSITIONAL_STATES
+    state and every slow_interval otherwise. If the daemon is slow to answer,
+    or fails, the interval backs off up to max_interval. Polls never overlap,
+    the next one is only scheduled once the previous one has returned.
+    """
+
+    def __init__(self, fast_interval: float = WATCH_FAST_INTERVAL,
+                 slow_interval: float = WATCH_SLOW_INTERVAL,
+                 max_interval: float = WATCH_MAX_INTERVAL,
+                 cache: Optional[InstanceCache] = None):
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.max_interval = max_interval
+        self.cache = cache if cache is not None else instance_cache
+        self.interval = fast_interval
+        self.known: Optional[Dict[str, Instance]] = None
+        self.subscribers: List[Callable[[List[InstanceEvent]], None]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def subscribe(self, callback: Callable[[List[InstanceEvent]], None]) -> None:
+        """ Call callback with the list of events after every poll that found changes """
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[List[InstanceEvent]], None]) -> None:
+        """ Stop calling callback """
+        self.subscribers.remove(callback)
+
+    def poke(self) -> None:
+        """ Poll now, e.g. straight after we asked multipass to change something """
+        self.interval = self.fast_interval
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def next_interval(self, instances: Optional[Dict[str, Any]], took: float) -> float:
+        """ How long to wait before polling again """
+        if instances is None:
+            # Failed, back off
+            return min(self.max_interval, max(self.interval, self.fast_interval) * 2)
+        if any(item['state'] in TRANSITIONAL_STATES for item in instances['list']):
+            interval = self.fast_interval
+        else:
+            interval = self.slow_interval
+        interval = max(interval, took * WATCH_SLOW_DAEMON_FACTOR)
+        return min(self.max_interval, interval)
+
+    async def poll_once(self) -> List[InstanceEvent]:
+        """ Fetch the instances once and return what changed since the last poll """
+        started = time.monotonic()
+        instances = await self.cache.get_async(force=True)
+        self.interval = self.next_interval(instances, time.monotonic() - started)
+        if instances is None:
+            return []
+        if instances is self.cache.instances:
+            current = dict(self.cache.by_name)
+        else:
+            current = {record.key: record for record in parse_instances(instances)}
+        events = diff_instances(self.known or {}, current)
+        self.known = current
+        return events
+
+    async def run(self) -> None:
+        """ Poll forever, telling subscribers about changes. Cancel the task to stop. """
+        self._wakeup = asyncio.Event()
+        while True:
+            events = await self.poll_once()
+            if events:
+                for callback in list(self.subscribers):
+                    callback(events)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def change_multipass_instance_power_state_async(instance_name: str, desired_state: str):
     """
     Start, stop, or suspend a multipass instance
 
@@ -85,7 +982,10 @@ def change_multipass_instance_power_state(instance_name: str, desired_state: str
     allowed_states = ['start', 'stop', 'suspend']
     if desired_state in allowed_states:
         try:
-            run_multipass_command(f'multipass {desired_state} {instance_name}')
+            name, host = split_instance_key(instance_name)
+            await run_multipass_command_async(['multipass', desired_state, name], host)
+            instance_cache.invalidate()
+            instance_info_cache.invalidate(instance_name)
         except Exception as e:
             # Handle any exceptions gracefully
             print(f"An error occurred getting the instances: {e}")
@@ -94,176 +994,648 @@ def change_multipass_instance_power_state(instance_name: str, desired_state: str
         print(f"Can only {allowed_states} instances")
 
 
+def change_multipass_instance_power_state(instance_name: str, desired_state: str):
+    """ Blocking version of change_multipass_instance_power_state_async """
+    return asyncio.run(change_multipass_instance_power_state_async(instance_name, desired_state))
+
+
 # def get_running_multipass_instance_names() -> List[str]:
 def get_running_multipass_instance_names() -> list[str, Any]:
     """ Return names of running instances """
 
-    instances = get_multipass_instances()
-    running_instance_names = [item['name'] for item in instances['list']
-                              if item['state'] == 'Running']
+    instances = get_multipass_instances_by_state('Running')
+    running_instance_names = [item.key for item in instances]
     return running_instance_names
 
 
 def get_stopped_multipass_instance_names() -> list[str, Any]:
     """ Return names of stopped instances """
 
-    instances = get_multipass_instances()
-    stopped_instance_names = [item['name'] for item in instances['list']
-                              if item['state'] == 'Stopped']
+    instances = get_multipass_instances_by_state('Stopped')
+    stopped_instance_names = [item.key for item in instances]
     return stopped_instance_names
 
 
 def get_suspended_multipass_instance_names() -> list[str, Any]:
     """ Return names of suspended instances """
 
-    instances = get_multipass_instances()
-    suspended_instance_names = [item['name'] for item in instances['list']
-                              if item['state'] == 'Suspended']
+    instances = get_multipass_instances_by_state('Suspended')
+    suspended_instance_names = [item.key for item in instances]
     return suspended_instance_names
 
 
 def get_stopped_multipass_instances() -> Dict[str, Any]:
     """ Return stopped instances """
 
-    instances = get_multipass_instances()
-    stopped_instances = [item for item in instances['list']
-                         if item['state'] == 'Stopped']
-    return stopped_instances
+    return get_multipass_instances_by_state('Stopped')
 
 
 def get_suspended_multipass_instances() -> Dict[str, Any]:
     """ Return suspended instances """
 
-    instances = get_multipass_instances()
-    suspended_instances = [item for item in instances['list']
-                         if item['state'] == 'Suspended']
-    return suspended_instances
+    return get_multipass_instances_by_state('Suspended')
 
 
 def get_running_multipass_instances() -> Dict[str, Any]:
     """ Return running instances """
 
-    instances = get_multipass_instances()
-    running_instances = [item for item in instances['list']
-                         if item['state'] == 'Running']
-    return running_instances
+    return get_multipass_instances_by_state('Running')
+
+
+async def stop_all_instances_async() -> None:
+    """ Stop all instances, on every host """
+    try:
+        await asyncio.gather(*[run_multipass_command_async(['multipass', 'stop', '--all'], host)
+                               for host in [''] + get_hosts()])
+        instance_cache.invalidate()
+        instance_info_cache.invalidate()
+    except Exception as e:
+        # Handle any exceptions gracefully
+        print(f"An error occurred stopping the instances: {e}")
+        return None
 
 
 def stop_all_instances() -> None:
     """ Stop all instances """
+    return asyncio.run(stop_all_instances_async())
+
+
+async def start_all_instances_async() -> None:
+    """ Start all instances, on every host """
     try:
-        run_multipass_command('multipass stop --all')
+        await asyncio.gather(*[run_multipass_command_async(['multipass', 'start', '--all'], host)
+                               for host in [''] + get_hosts()])
+        instance_cache.invalidate()
+        instance_info_cache.invalidate()
     except Exception as e:
         # Handle any exceptions gracefully
-        print(f"An error occurred stopping the instances: {e}")
+        print(f"An error occurred starting the instances: {e}")
         return None
 
 
 def start_all_instances() -> None:
     """ Start all instances """
+    return asyncio.run(start_all_instances_async())
+
+
+async def start_instance_async(name: str) -> None:
+    """ Start an instance """
     try:
-        run_multipass_command('multipass start --all')
+        instance, host = split_instance_key(name)
+        await run_multipass_command_async(['multipass', 'start', instance], host)
+        instance_cache.invalidate()
+        instance_info_cache.invalidate(name)
     except Exception as e:
         # Handle any exceptions gracefully
-        print(f"An error occurred starting the instances: {e}")
+        print(f"An error occurred starting the instance: {e}")
         return None
 
 
 def start_instance(name: str) -> None:
     """ Start an instance """
+    return asyncio.run(start_instance_async(name))
+
+
+async def stop_instance_async(name: str) -> None:
+    """ Stop an instance """
     try:
-        run_multipass_command(f'multipass start {name}')
+        instance, host = split_instance_key(name)
+        await run_multipass_command_async(['multipass', 'stop', instance], host)
+        instance_cache.invalidate()
+        instance_info_cache.invalidate(name)
     except Exception as e:
         # Handle any exceptions gracefully
-        print(f"An error occurred starting the instance: {e}")
+        print(f"An error occurred stopping the instance: {e}")
         return None
 
+
 def stop_instance(name: str) -> None:
     """ Stop an instance """
+    return asyncio.run(stop_instance_async(name))
+
+
+async def suspend_instance_async(name: str) -> None:
+    """ Suspend an instance """
     try:
-        run_multipass_command(f'multipass stop {name}')
+        instance, host = split_instance_key(name)
+        await run_multipass_command_async(['multipass', 'suspend', instance], host)
+        instance_cache.invalidate()
+        instance_info_cache.invalidate(name)
     except Exception as e:
         # Handle any exceptions gracefully
-        print(f"An error occurred stopping the instance: {e}")
+        print(f"An error occurred suspending the instance: {e}")
         return None
 
+
 def suspend_instance(name: str) -> None:
     """ Suspend an instance """
+    return asyncio.run(suspend_instance_async(name))
+
+
+async def delete_instance_async(name: str) -> None:
+    """ Delete an instance """
     try:
-        run_multipass_command(f'multipass suspend {name}')
+        instance, host = split_instance_key(name)
+        await run_multipass_command_async(['multipass', 'delete', instance], host)
+        instance_cache.invalidate()
+        instance_info_cache.invalidate(name)
     except Exception as e:
         # Handle any exceptions gracefully
-        print(f"An error occurred suspending the instance: {e}")
+        print(f"An error occurred deleting the instance: {e}")
         return None
 
+
 def delete_instance(name: str) -> None:
     """ Delete an instance """
+    return asyncio.run(delete_instance_async(name))
+
+
+async def recover_instance_async(name: str) -> None:
+    """ Recover an instance """
     try:
-        run_multipass_command(f'multipass delete {name}')
+        instance, host = split_instance_key(name)
+        await run_multipass_command_async(['multipass', 'recover', instance], host)
+        instance_cache.invalidate()
+        instance_info_cache.invalidate(name)
     except Exception as e:
         # Handle any exceptions gracefully
-        print(f"An error occurred deleting the instance: {e}")
-        return deleting
-    
+        print(f"An error occurred recovering the instance: {e}")
+        return None
+
+
 def recover_instance(name: str) -> None:
     """ Recover an instance """
+    return asyncio.run(recover_instance_async(name))
+
+
+async def clone_instance_async(source: str, name: Optional[str] = None) -> Optional[str]:
+    """
+    Copy a stopped instance with `multipass clone` (multipass 1.15 and later)
+
+    Args:
+        source (str): The instance to copy, name@host for other hosts.
+        name (str): What to call the copy, multipass picks <source>-cloneN if None.
+
+    Returns:
+        str: The new instance's key, or None if it failed
+    """
     try:
-        run_multipass_command(f'multipass recover {name}')
+        instance, host = split_instance_key(source)
+        argv = ['multipass', 'clone', instance]
+        if name:
+            argv += ['--name', name]
+        output = await run_multipass_command_async(argv, host)
+        instance_cache.invalidate()
     except Exception as e:
         # Handle any exceptions gracefully
-        print(f"An error occurred recovering the instance: {e}")
-        return recover
+        print(f"An error occurred cloning the instance: {e}")
+        return None
+    if output is None:
+        return None
+    if not name:
+        # "Cloned from foo to foo-clone1."
+        match = re.search(r'to (\S+?)\.?$', output)
+        name = match.group(1) if match else None
+    return instance_key(name, host) if name else None
 
-def quick_create_instance() -> None:
-    """ Create a quick instance """
+
+def clone_instance(source: str, name: Optional[str] = None) -> Optional[str]:
+    """ Copy a stopped instance, returning the copy's name """
+    return asyncio.run(clone_instance_async(source, name))
+
+
+@dataclass
+class Snapshot:
+    """ One snapshot of an instance, as `multipass list --snapshots` shows it """
+    # The instance's key, name@host for other hosts
+    instance: str
+    name: str
+    comment: str = ''
+    # The snapshot it was taken on top of, '' for none
+    parent: str = ''
+
+
+async def list_snapshots_async(names: Optional[Sequence[str]] = None
+                               ) -> Optional[Dict[str, List[Snapshot]]]:
+    """
+    Get the snapshots of instances, every host at once
+
+    Args:
+        names (list): The instance keys, every instance if None.
+
+    Returns:
+        dict: Instance key -> its snapshots, or None if no host could be asked
+    """
+    hosts = list(group_by_host(names)) if names is not None else [''] + get_hosts()
+
+    async def fetch(host: str) -> Optional[Dict[str, Any]]:
+        try:
+            output = await run_multipass_command_async(
+                ['multipass', 'list', '--snapshots', '--format', 'json'], host)
+            return json.loads(output)['info'] if output is not None else None
+        except Exception as e:
+            # Handle any exceptions gracefully
+            print(f"An error occurred listing snapshots{f' on {host}' if host else ''}: {e}")
+            return None
+
+    results = await asyncio.gather(*[fetch(host) for host in hosts])
+    if hosts and all(result is None for result in results):
+        return None
+    snapshots: Dict[str, List[Snapshot]] = {}
+    for host, info in zip(hosts, results):
+        for name, items in (info or {}).items():
+            key = instance_key(name, host)
+            snapshots[key] = [Snapshot(key, snapshot, item.get('comment') or '', item.get('parent') or '')
+                              for snapshot, item in (items or {}).items()]
+    if names is not None:
+        snapshots = {key: snapshots.get(key, []) for key in names}
+    return snapshots
+
+
+def list_snapshots(names: Optional[Sequence[str]] = None) -> Optional[Dict[str, List[Snapshot]]]:
+    """ Blocking version of list_snapshots_async """
+    return asyncio.run(list_snapshots_async(names))
+
+
+async def take_snapshot_async(name: str, snapshot: Optional[str] = None,
+                              comment: Optional[str] = None) -> Optional[str]:
+    """
+    Snapshot a stopped instance
+
+    Args:
+        name (str): The instance, name@host for other hosts.
+        snapshot (str): What to call it, multipass picks snapshotN if None.
+        comment (str): Stored with it.
+
+    Returns:
+        str: The snapshot's name, or None if it failed
+    """
     try:
-        run_multipass_command('multipass launch')
+        instance, host = split_instance_key(name)
+        argv = ['multipass', 'snapshot', instance]
+        if snapshot:
+            argv += ['--name', snapshot]
+        if comment:
+            argv += ['--comment', comment]
+        output = await run_multipass_command_async(argv, host)
+        instance_info_cache.invalidate(name)
     except Exception as e:
         # Handle any exceptions gracefully
-        print(f"An error occurred creating the instances: {e}")
+        print(f"An error occurred taking a snapshot: {e}")
         return None
+    if output is None:
+        return None
+    if snapshot:
+        return snapshot
+    # "Snapshot taken: foo.snapshot1"
+    match = re.search(rf'{re.escape(instance)}\.(\S+)$', output)
+    return match.group(1) if match else ''
 
-def purge_instances() -> None:
+
+def take_snapshot(name: str, snapshot: Optional[str] = None, comment: Optional[str] = None) -> Optional[str]:
+    """ Snapshot a stopped instance, returning the snapshot's name """
+    return asyncio.run(take_snapshot_async(name, snapshot, comment))
+
+
+async def restore_snapshot_async(name: str, snapshot: str, destructive: bool = False) -> bool:
+    """
+    Put a stopped instance back to a snapshot
+
+    Args:
+        name (str): The instance, name@host for other hosts.
+        snapshot (str): The snapshot's name.
+        destructive (bool): Throw away how the instance is now. Without it
+            multipass asks whether to snapshot the current state first,
+            and refuses when it can't ask.
+
+    Returns:
+        bool: Whether it worked
+    """
+    try:
+        instance, host = split_instance_key(name)
+        command = ['multipass', 'restore', *(['--destructive'] if destructive else []),
+                   f'{instance}.{snapshot}']
+        output = await run_multipass_command_async(command, host)
+        instance_cache.invalidate()
+        instance_info_cache.invalidate(name)
+    except Exception as e:
+        # Handle any exceptions gracefully
+        print(f"An error occurred restoring the snapshot: {e}")
+        return False
+    return output is not None
+
+
+def restore_snapshot(name: str, snapshot: str, destructive: bool = False) -> bool:
+    """ Put a stopped instance back to a snapshot """
+    return asyncio.run(restore_snapshot_async(name, snapshot, destructive))
+
+
+# Subcommands that take any number of instance names in one call
+MULTI_INSTANCE_SUBCOMMANDS = {'start', 'stop', 'suspend', 'restart', 'delete', 'recover'}
+
+
+async def run_bulk_instance_command_async(subcommand: str, names: Sequence[str],
+                                          extra_args: Sequence[str] = ()) -> Dict[str, bool]:
+    """
+    Run the same subcommand against many instances.
+
+    Where multipass accepts several names the instances are passed to one
+    `multipass <subcommand> a b c` call, otherwise one call per instance is
+    made in parallel, bounded by MAX_CONCURRENT_COMMANDS. Instances on other
+    hosts (name@host) go to their host, all hosts at once.
+
+    Args:
+        subcommand (str): e.g. 'start'
+        names (list): The instance names.
+        extra_args (list): Any options to put before the names.
+
+    Returns:
+        Dict: Instance name -> whether the command succeeded
+    """
+    names = list(dict.fromkeys(names))
+    if not names:
+        return {}
+
+    async def run_on_host(host: str, host_names: List[str]) -> Dict[str, bool]:
+        if subcommand in MULTI_INSTANCE_SUBCOMMANDS:
+            output = await run_multipass_command_async(
+                ['multipass', subcommand, *extra_args, *host_names], host)
+            return {instance_key(name, host): output is not None for name in host_names}
+        outputs = await asyncio.gather(*[
+            run_multipass_command_async(['multipass', subcommand, *extra_args, name], host)
+            for name in host_names])
+        return {instance_key(name, host): output is not None
+                for name, output in zip(host_names, outputs)}
+
+    try:
+        results = await asyncio.gather(*[run_on_host(host, host_names)
+                                         for host, host_names in group_by_host(names).items()])
+        return {key: ok for result in results for key, ok in result.items()}
+    finally:
+        instance_cache.invalidate()
+        for name in names:
+            instance_info_cache.invalidate(name)
+
+
+async def start_instances_async(names: Sequence[str]) -> Dict[str, bool]:
+    """ Start several instances in one go """
+    return await run_bulk_instance_command_async('start', names)
+
+
+def start_instances(names: Sequence[str]) -> Dict[str, bool]:
+    """ Start several instances in one go """
+    return asyncio.run(start_instances_async(names))
+
+
+async def stop_instances_async(names: Sequence[str]) -> Dict[str, bool]:
+    """ Stop several instances in one go """
+    return await run_bulk_instance_command_async('stop', names)
+
+
+def stop_instances(names: Sequence[str]) -> Dict[str, bool]:
+    """ Stop several instances in one go """
+    return asyncio.run(stop_instances_async(names))
+
+
+async def suspend_instances_async(names: Sequence[str]) -> Dict[str, bool]:
+    """ Suspend several instances in one go """
+    return await run_bulk_instance_command_async('suspend', names)
+
+
+def suspend_instances(names: Sequence[str]) -> Dict[str, bool]:
+    """ Suspend several instances in one go """
+    return asyncio.run(suspend_instances_async(names))
+
+
+async def delete_instances_async(names: Sequence[str]) -> Dict[str, bool]:
+    """ Delete several instances in one go """
+    return await run_bulk_instance_command_async('delete', names)
+
+
+def delete_instances(names: Sequence[str]) -> Dict[str, bool]:
+    """ Delete several instances in one go """
+    return asyncio.run(delete_instances_async(names))
+
+
+async def recover_instances_async(names: Sequence[str]) -> Dict[str, bool]:
+    """ Recover several instances in one go """
+    return await run_bulk_instance_command_async('recover', names)
+
+
+def recover_instances(names: Sequence[str]) -> Dict[str, bool]:
+    """ Recover several instances in one go """
+    return asyncio.run(recover_instances_async(names))
+
+
+# Launch stages in the order multipass goes through them, with the slice of
+# an overall 0-100 progress bar each one covers.
+LAUNCH_STAGES = {
+    'retrieving': (0, 60),
+    'verifying': (60, 65),
+    'extracting': (65, 70),
+    'preparing': (70, 75),
+    'creating': (75, 78),
+    'configuring': (78, 80),
+    'starting': (80, 85),
+    'waiting': (85, 99),
+    'launched': (100, 100),
+}
+
+_LAUNCH_PATTERNS = [
+    (re.compile(r'Retrieving image(?::\s*(?P<percent>\d+)%)?', re.I), 'retrieving'),
+    (re.compile(r'Verifying image', re.I), 'verifying'),
+    (re.compile(r'Extracting image(?::\s*(?P<percent>\d+)%)?', re.I), 'extracting'),
+    (re.compile(r'Preparing image', re.I), 'preparing'),
+    (re.compile(r'Creating (?P<name>\S+)', re.I), 'creating'),
+    (re.compile(r'Configuring (?P<name>\S+)', re.I), 'configuring'),
+    (re.compile(r'Starting (?P<name>\S+)', re.I), 'starting'),
+    (re.compile(r'Waiting for initialization', re.I), 'waiting'),
+    (re.compile(r'Launched: (?P<name>\S+)', re.I), 'launched'),
+]
+
+
+@dataclass(frozen=True)
+class LaunchProgress:
+    """ One step of a `multipass launch` """
+    stage: str
+    message: str
+    percent: Optional[int] = None
+    name: Optional[str] = None
+
+    @property
+    def overall(self) -> float:
+        """ Where this puts the launch on a 0-100 bar """
+        start, end = LAUNCH_STAGES[self.stage]
+        if self.percent is None:
+            return float(start)
+        return start + (end - start) * min(self.percent, 100) / 100
+
+
+def parse_launch_progress(line: str) -> Optional[LaunchProgress]:
+    """
+    Turn a line of `multipass launch` output into a LaunchProgress
+
+    Args:
+        line (str): e.g. '/ Retrieving image: 42%'
+
+    Returns:
+        LaunchProgress: Or None if the line isn't a progress line
+    """
+    for pattern, stage in _LAUNCH_PATTERNS:
+        match = pattern.search(line)
+        if match:
+            groups = match.groupdict()
+            percent = int(groups['percent']) if groups.get('percent') else None
+            # Drop the spinner multipass draws in front
+            message = line[match.start():].strip()
+            return LaunchProgress(stage, message, percent, groups.get('name'))
+    return None
+
+
+def build_launch_argv(name: Optional[str] = None, image: Optional[str] = None,
+                      cpus: Optional[int] = None, memory: Optional[str] = None,
+                      disk: Optional[str] = None, cloud_init: Optional[str] = None) -> List[str]:
+    """ The `multipass launch` command for the given options """
+    argv = ['multipass', 'launch']
+    if image:
+        argv.append(image)
+    if name:
+        argv += ['--name', name]
+    if cpus:
+        argv += ['--cpus', str(cpus)]
+    if memory:
+        argv += ['--memory', str(memory)]
+    if disk:
+        argv += ['--disk', str(disk)]
+    if cloud_init:
+        argv += ['--cloud-init', cloud_init]
+    return argv
+
+
+async def launch_instance_async(name: Optional[str] = None, image: Optional[str] = None,
+                                cpus: Optional[int] = None, memory: Optional[str] = None,
+                                disk: Optional[str] = None, cloud_init: Optional[str] = None,
+                                on_progress: Optional[Callable[[LaunchProgress], None]] = None
+                                ) -> Optional[str]:
+    """
+    Launch an instance, reporting progress as multipass prints it
+
+    Args:
+        name, image, cpus, memory, disk, cloud_init: As for `multipass launch`.
+        on_progress (callable): Called with a LaunchProgress for every step.
+
+    Returns:
+        str: The name of the new instance, or None if the launch failed
+    """
+    launched = [name]
+
+    def on_output(stream_name: str, line: str) -> None:
+        progress = parse_launch_progress(line)
+        if progress is None:
+            return
+        if progress.stage == 'launched':
+            launched[0] = progress.name
+        if on_progress is not None:
+            on_progress(progress)
+
+    try:
+        argv = build_launch_argv(name, image, cpus, memory, disk, cloud_init)
+        output = await stream_multipass_command_async(argv, on_output)
+        instance_cache.invalidate()
+    except Exception as e:
+        # Handle any exceptions gracefully
+        print(f"An error occurred creating the instance: {e}")
+        return None
+    if output is None:
+        return None
+    return launched[0]
+
+
+def launch_instance(name: Optional[str] = None, image: Optional[str] = None,
+                    cpus: Optional[int] = None, memory: Optional[str] = None,
+                    disk: Optional[str] = None, cloud_init: Optional[str] = None) -> Optional[str]:
+    """ Launch an instance, returning its name """
+    return asyncio.run(launch_instance_async(name, image, cpus, memory, disk, cloud_init))
+
+
+async def quick_create_instance_async(
+        on_progress: Optional[Callable[[LaunchProgress], None]] = None) -> Optional[str]:
+    """ Create a quick instance """
+    return await launch_instance_async(on_progress=on_progress)
+
+
+def quick_create_instance() -> None:
+    """ Create a quick instance """
+    return asyncio.run(quick_create_instance_async())
+
+
+async def purge_instances_async() -> None:
     """ Purge deleted instances """
     try:
-        run_multipass_command('multipass purge')
+        await run_multipass_command_async(['multipass', 'purge'])
+        instance_cache.invalidate()
+        instance_info_cache.invalidate()
     except Exception as e:
         # Handle any exceptions gracefully
         print(f"An error occurred purging the instances: {e}")
         return None
 
-def shell_into(name: str) -> None:
-    """ Shell into instance """
-    # This may be useful: https://github.com/mitosch/textual-terminal
+
+def purge_instances() -> None:
+    """ Purge deleted instances """
+    return asyncio.run(purge_instances_async())
+
+
+def shell_argv(name: str) -> List[str]:
+    """
+    The command that opens a shell in an instance, to run on a terminal
+
+    Args:
+        name (str): The instance name, name@host for other hosts.
+
+    Returns:
+        list: e.g. ['multipass', 'shell', 'vm1'], wrapped in ssh for other hosts
+    """
+    instance, host = split_instance_key(name)
+    return get_host_transport(host).interactive_argv(['multipass', 'shell', instance])
+
+
+def shell_into(name: str) -> Optional[int]:
+    """ Shell into instance on this terminal, returning the exit code once it's left """
     try:
-        print("")
-        # run_multipass_command(f'multipass shell {name}')
-        # subprocess.Popen(['start', 'cmd', '/k', 'your_command_here'])
-        # subprocess.Popen(['open', '-a', 'Terminal', 'your_command_here'])
-        # subprocess.Popen(['gnome-terminal', '--', 'your_command_here'])
-    except Exception as e:
+        return subprocess.call(shell_argv(name))
+    except (OSError, TransportError) as e:
         # Handle any exceptions gracefully
         print(f"An error occurred shelling into the instance: {e}")
         return None
 
-def get_instances_for_textual_datatable():
+
+async def get_instances_for_textual_datatable_async(
+        columns: Optional[Sequence[str]] = None, force: bool = False
+        ) -> Optional[List[List[str]]]:
     """
-    Get a json object of all instances
+    Get the instances as table rows, from the shared instance cache
 
-        Returns:
-        Dict: An object that has the multipass instances in JSON/DICT format
+    Args:
+        columns (list): Which of INSTANCE_TABLE_COLUMNS to include, by default
+            instance_table_columns().
+        force (bool): Skip the cache and ask multipass.
 
+    Returns:
+        list: The column headings, then one row of strings per instance
     """
     try:
-        output = run_multipass_command('multipass list --format csv')
-        rows = output.split('\n')
-        rows = [row for row in rows if row.strip()]
-        data = []
-        for row in rows:
-            columns = row.split(',')
-            data.append(columns)
-        return data
+        records = await instance_cache.get_records_async(force=force)
+        if records is None:
+            return None
+        columns = list(columns) if columns is not None else instance_table_columns()
+        return [columns] + instance_table_rows(records, columns)
     except Exception as e:
         # Handle any exceptions gracefully
         print(f"An error occurred getting the instances: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+def get_instances_for_textual_datatable(force: bool = False) -> Optional[List[List[str]]]:
+    """ Blocking version of get_instances_for_textual_datatable_async """
+    return asyncio.run(get_instances_for_textual_datatable_async(force=force))
@@ -1,9 +1,34 @@
 #!/usr/bin/env python3
 """tests for main.py"""
 
+import asyncio
+import io
+import json
 import os
 import re
+import stat
+import sys
+import threading
+import time
+import pytest
 from main_tui import *
+from fake_multipass import FakeMultipass, SUPPORTED as FAKE_SUPPORTED
+from benchmark import bench_startup
+from multipass_cli import print_report, run_cli, select_instances, EXIT_FAILED, EXIT_OK, EXIT_PARTIAL
+from multipass_metrics import LatencyHistogram, describe_command
+from multipass_operations import OperationQueue
+from multipass_search import InstanceIndex
+from multipass_shells import ShellPool
+from multipass_pool import WarmPool, format_pool_stats
+from multipass_catalog import ImageCatalog
+from multipass_snapshots import restore_instances_async, snapshot_instances_async
+from multipass_sync import sync_to_instances_async
+from multipass_activity import ActivityLog
+from multipass_exec import exec_on_instances_async, format_exec_summary
+from multipass_fleet import FleetSpecError, parse_fleet_spec, plan_fleet, apply_fleet
+from multipass_resources import RingBuffer, sample_from_info, sparkline
+from multipass_hosts import Host, HostInventoryError, close_hosts_async, parse_inventory, use_hosts
+from multipass_transport import SOCKET_PROTOCOL, _read_lines
 
 prg = './main.py'
 
@@ -20,6 +45,7 @@ def test_version():
 
     version = get_multipass_version()
     print(version)
+    assert version is not None
     # Like 1.13.1
     pattern = r'\b\d+\.\d+\.\d+\b'
     match = re.search(pattern, version)
@@ -104,7 +130,1025 @@ def test_get_running_multipass_instance_names():
     assert number_of_instances >= 0
 
 
+def test_run_multipass_command_does_not_use_a_shell():
+    """Test that commands are exec'd directly, so shell syntax is passed through"""
+
+    output = run_multipass_command([sys.executable, '-c',
+                                    'import sys; print(sys.argv[1])', '$HOME;|'])
+    assert output == '$HOME;|'
+
+
+def test_run_multipass_command_async_is_bounded():
+    """Test that no more than MAX_CONCURRENT_COMMANDS commands run at once"""
+
+    async def run_sleeps():
+        command = [sys.executable, '-c', 'import time; time.sleep(0.3)']
+        await asyncio.gather(*[run_multipass_command_async(command) for _ in range(4)])
+
+    set_max_concurrent_commands(2)
+    try:
+        started = time.monotonic()
+        asyncio.run(run_sleeps())
+        # 4 commands, 2 at a time, is at least two rounds of sleeping
+        assert time.monotonic() - started >= 0.6
+    finally:
+        set_max_concurrent_commands(4)
+
+
+def test_instance_cache_indexes_by_state_and_name():
+    """Test that one list result is indexed by state and name, and can be invalidated"""
+
+    cache = InstanceCache(ttl=60)
+    cache.load({"list": [
+        {"ipv4": ["10.0.0.2"], "name": "vm1", "release": "Ubuntu 22.04 LTS", "state": "Running"},
+        {"ipv4": [], "name": "vm2", "release": "Ubuntu 22.04 LTS", "state": "Stopped"},
+        {"ipv4": [], "name": "vm3", "release": "Ubuntu 22.04 LTS", "state": "Stopped"},
+    ]})
+    assert cache.is_fresh()
+    assert [item['name'] for item in cache.by_state['Stopped']] == ['vm2', 'vm3']
+    assert cache.by_name['vm1']['state'] == 'Running'
+    cache.invalidate()
+    assert not cache.is_fresh()
+
+
+def test_diff_table_rows_only_touches_what_changed():
+    """Test that a refresh adds, removes and updates only the affected rows and cells"""
+
+    current = {
+        'vm1': ['vm1', 'Running', '10.0.0.2', 'Ubuntu 22.04 LTS'],
+        'vm2': ['vm2', 'Stopped', '--', 'Ubuntu 22.04 LTS'],
+    }
+    rows = [
+        ['vm1', 'Stopped', '--', 'Ubuntu 22.04 LTS'],
+        ['vm3', 'Running', '10.0.0.4', 'Ubuntu 24.04 LTS'],
+    ]
+    added, removed, changed = diff_table_rows(current, rows)
+    assert added == [rows[1]]
+    assert removed == ['vm2']
+    assert changed == [('vm1', 1, 'Stopped'), ('vm1', 2, '--')]
+
+
+def test_diff_instances_reports_typed_events():
+    """Test that the watcher diff reports adds, removes, state and IP changes"""
+
+    old = {
+        'vm1': {'name': 'vm1', 'state': 'Starting', 'ipv4': []},
+        'vm2': {'name': 'vm2', 'state': 'Stopped', 'ipv4': []},
+    }
+    new = {
+        'vm1': {'name': 'vm1', 'state': 'Running', 'ipv4': ['10.0.0.2']},
+        'vm3': {'name': 'vm3', 'state': 'Stopped', 'ipv4': []},
+    }
+    events = diff_instances(old, new)
+    assert events == [
+        InstanceStateChanged('vm1', 'Starting', 'Running'),
+        InstanceIpChanged('vm1', (), ('10.0.0.2',)),
+        InstanceRemoved('vm2', old['vm2']),
+        InstanceAdded('vm3', new['vm3']),
+    ]
+    record = Instance('vm1', 'Running', ['10.0.0.2'])
+    assert {InstanceAdded('vm1', record), InstanceAdded('vm1', Instance('vm1', 'Running', ['10.0.0.2']))} == {
+        InstanceAdded('vm1', record)}
+
+
+def test_watcher_interval_adapts():
+    """Test that the watcher polls fast while transitioning and backs off when slow"""
+
+    watcher = InstanceWatcher(fast_interval=1, slow_interval=10, max_interval=60)
+    settled = {'list': [{'name': 'vm1', 'state': 'Running', 'ipv4': []}]}
+    busy = {'list': [{'name': 'vm1', 'state': 'Starting', 'ipv4': []}]}
+    assert watcher.next_interval(busy, 0.1) == 1
+    assert watcher.next_interval(settled, 0.1) == 10
+    # A slow daemon stretches the interval, a failure doubles it
+    assert watcher.next_interval(busy, 3) == 15
+    watcher.interval = 40
+    assert watcher.next_interval(None, 0.1) == 60
+
+
+def test_state_filters_share_one_list(fake_multipass):
+    """Test that asking for every state partition only runs multipass list once"""
+
+    fake_multipass.clear_calls()
+    running = get_running_multipass_instance_names()
+    stopped = get_stopped_multipass_instance_names()
+    suspended = get_suspended_multipass_instance_names()
+    assert (running, stopped, suspended) == (['vm-0001', 'vm-0004'],
+                                             ['vm-0002', 'vm-0005'],
+                                             ['vm-0003', 'vm-0006'])
+    assert fake_multipass.calls() == [['list', '--format', 'json']]
+
+
+def test_bulk_actions_are_one_call(fake_multipass):
+    """Test that a bulk stop passes every name to a single multipass stop"""
+
+    fake_multipass.clear_calls()
+    results = stop_instances(['vm-0001', 'vm-0004'])
+    assert results == {'vm-0001': True, 'vm-0004': True}
+    assert fake_multipass.calls() == [['stop', 'vm-0001', 'vm-0004']]
+    # The stop invalidated the cache, so this fetches again
+    assert get_running_multipass_instance_names() == []
+    # Subcommands that take one name get a call per instance instead
+    fake_multipass.clear_calls()
+    assert asyncio.run(run_bulk_instance_command_async('info', ['vm-0002', 'vm-0003'])) == {
+        'vm-0002': True, 'vm-0003': True}
+    assert sorted(fake_multipass.calls()) == [['info', 'vm-0002'], ['info', 'vm-0003']]
+
+
+def test_selection_drives_bulk_actions(fake_multipass):
+    """Test that space and * build a selection that the next action runs on with one call"""
+
+    async def run_app():
+        app = mptui()
+        async with app.run_test(size=(120, 50)) as pilot:
+            await pilot.pause(0.5)
+            table = app.query_one(DataTable)
+            table.move_cursor(row=0)
+            await pilot.press('space')
+            toggled = set(app.selected_instances)
+            await pilot.press('escape')
+            cleared = set(app.selected_instances)
+            # vm-0001 is running, like vm-0004
+            table.move_cursor(row=0)
+            await pilot.press('*')
+            same_state = set(app.selected_instances)
+            fake_multipass.clear_calls()
+            await pilot.press('[')
+            for _ in range(50):
+                if app.table_rows['vm-0004'][app.table_columns.index('State')] == 'Stopped':
+                    break
+                await pilot.pause(0.1)
+            app.action_quit()
+            return toggled, cleared, same_state
+
+    toggled, cleared, same_state = asyncio.run(run_app())
+    assert toggled == {'vm-0001'} and cleared == set()
+    assert same_state == {'vm-0001', 'vm-0004'}
+    assert [call for call in fake_multipass.calls() if call[0] == 'stop'] == [['stop', 'vm-0001', 'vm-0004']]
+    assert fake_multipass.instances_by_name()['vm-0004']['state'] == 'Stopped'
+
+
+@pytest.mark.skipif(not FAKE_SUPPORTED, reason='fake_multipass needs a POSIX system')
+def test_actions_on_an_empty_table():
+    """Test that the instance actions say there's nothing to act on when there are no instances"""
+
+    async def run_app():
+        app = mptui()
+        async with app.run_test(size=(120, 50)) as pilot:
+            await pilot.pause(0.5)
+            for key in ['space', '*', '[', 's', 'x', 'l']:
+                await pilot.press(key)
+            await pilot.pause(0.1)
+            notified = [notification.message for notification in app._notifications]
+            app.action_quit()
+            return notified
+
+    with FakeMultipass() as fake:
+        notified = asyncio.run(run_app())
+        assert [call for call in fake.calls() if call[0] in ('stop', 'shell', 'exec', 'info')] == []
+    assert notified.count('No instances') == 6
+
+
+@pytest.mark.skipif(not FAKE_SUPPORTED, reason='fake_multipass needs a POSIX system')
+def test_socket_transport_keeps_one_connection():
+    """Test that commands go over the persistent socket, and fall back to the CLI without it"""
+
+    with FakeMultipass(instances=4, serve=True) as fake:
+        async def run_queries():
+            transport = get_transport()
+            assert isinstance(transport, SocketTransport)
+            results = await asyncio.gather(*[
+                run_multipass_command_async(['multipass', 'info', name]) for name in fake.names])
+            connections = list(transport._connections.values())
+            await transport.close()
+            return results, connections
+
+        results, connections = asyncio.run(run_queries())
+        assert all(result is not None for result in results)
+        assert len(connections) == 1
+
+    # A reply far over asyncio's default 64KiB line limit comes back over the socket too
+    with FakeMultipass(instances=1000, serve=True) as fake:
+        async def list_all():
+            transport = get_transport()
+            output = await run_multipass_command_async(['multipass', 'list', '--format', 'json'])
+            connection = next(iter(transport._connections.values()))
+            closed = connection.closed
+            await transport.close()
+            return output, closed
+
+        output, closed = asyncio.run(list_all())
+        assert len(output) > 1 << 16 and len(json.loads(output)['list']) == 1000 and not closed
+        assert fake.calls() == [['list', '--format', 'json']]
+
+    # The connection dropping after a request is sent is an error, the request isn't sent again
+    with FakeMultipass(instances=2) as fake:
+        async def hang_up():
+            async def close_after_request(reader, writer):
+                await reader.readline()
+                writer.write(json.dumps({'hello': SOCKET_PROTOCOL}).encode() + b'\n')
+                await reader.readline()
+                writer.close()
+
+            path = fake.root + '/hangs-up.sock'
+            server = await asyncio.start_unix_server(close_after_request, path=path)
+            transport = SocketTransport(path, fallback=CliTransport())
+            try:
+                await transport.run(['multipass', 'delete', 'vm-0001'])
+            except TransportError:
+                return True
+            finally:
+                await transport.close()
+                server.close()
+            return False
+
+        assert asyncio.run(hang_up())
+        assert fake.calls() == []
+
+    # Something else on the socket (multipassd speaks gRPC) is given up on for the CLI
+    with FakeMultipass(instances=2) as fake:
+        async def not_ours():
+            connections = []
+
+            async def speak_http2(reader, writer):
+                connections.append(writer)
+                writer.write(b'\x00\x00\x00\x04\x00\x00\x00\x00\x00')
+                await reader.read()
+
+            path = fake.root + '/grpc.sock'
+            server = await asyncio.start_unix_server(speak_http2, path=path)
+            transport = SocketTransport(path, fallback=CliTransport())
+            try:
+                first = await transport.run(['multipass', 'list', '--format', 'json'])
+                second = await transport.run(['multipass', 'list', '--format', 'json'])
+            finally:
+                await transport.close()
+                server.close()
+            return first, second, len(connections), transport.refused
+
+        first, second, connections, refused = asyncio.run(not_ours())
+        assert first[0] == second[0] == 0 and connections == 1
+        assert refused and SOCKET_PROTOCOL in refused
+        assert fake.calls() == [['list', '--format', 'json']] * 2
+
+    # Nothing listening any more, so the CLI gets used instead
+    with FakeMultipass(instances=2) as fake:
+        set_transport(SocketTransport(fake.root + '/missing.sock', fallback=CliTransport()))
+        try:
+            assert get_running_multipass_instance_names() == ['vm-0001']
+        finally:
+            set_transport(None)
+
+
+def test_parse_launch_progress():
+    """Test that multipass launch output is turned into progress steps"""
+
+    progress = parse_launch_progress('/ Retrieving image: 42%')
+    assert (progress.stage, progress.percent, progress.message) == ('retrieving', 42,
+                                                                    'Retrieving image: 42%')
+    assert parse_launch_progress('Launched: vm9').name == 'vm9'
+    assert parse_launch_progress('Waiting for initialization to complete').stage == 'waiting'
+    assert parse_launch_progress('something else') is None
+
+
+def test_launch_streams_progress(fake_multipass):
+    """Test that launch progress arrives while the launch is still running"""
+
+    fake_multipass.set_latency({'launch': 0.5})
+    seen = []
+    arrived = []
+
+    def on_progress(progress):
+        seen.append(progress)
+        arrived.append(time.perf_counter())
+
+    async def launch():
+        return await launch_instance_async(name='new-vm', on_progress=on_progress)
+
+    assert asyncio.run(launch()) == 'new-vm'
+    finished = time.perf_counter()
+    assert arrived[0] < finished - 0.25
+    stages = [progress.stage for progress in seen]
+    assert stages[0] == 'retrieving' and stages[-1] == 'launched'
+    assert 'waiting' in stages
+    assert [progress.overall for progress in seen] == sorted(progress.overall for progress in seen)
+
+    # A character split between two reads still comes out whole
+    async def read_split():
+        pipe = asyncio.StreamReader()
+        pipe.feed_data('café ✓'.encode()[:4])
+        pipe.feed_data('café ✓'.encode()[4:] + b'\n')
+        pipe.feed_eof()
+        lines = []
+        return await _read_lines(pipe, 'stdout', lambda stream_name, line: lines.append(line)), lines
+
+    assert asyncio.run(read_split()) == ('café ✓\n', ['café ✓'])
+
+
+@pytest.mark.timing
+def test_startup_within_budget():
+    """Test that the TUI paints its first frame without waiting on a slow multipass"""
+
+    startup = bench_startup(runs=1)
+    assert startup['within_budget'], f"First frame took {startup['max_ms']:.0f}ms"
+
+
+def test_info_cache_is_lru_and_state_aware():
+    """Test that info entries are evicted oldest first and dropped when the state moves on"""
+
+    cache = InstanceInfoCache(ttl=60, size=2)
+    cache.store('vm1', {'state': 'Running'})
+    cache.store('vm2', {'state': 'Running'})
+    assert cache.peek('vm1') is not None
+    cache.store('vm3', {'state': 'Stopped'})
+    # vm1 was used more recently than vm2
+    assert set(cache.entries) == {'vm1', 'vm3'}
+    assert cache.peek('vm1', state='Stopped') is None
+    assert cache.peek('vm3', state='Stopped') == {'state': 'Stopped'}
+
+
+def test_info_is_fetched_once(fake_multipass):
+    """Test that repeated and concurrent info lookups share one multipass info"""
+
+    instance_info_cache.invalidate()
+    fake_multipass.clear_calls()
+
+    async def lookups():
+        await asyncio.gather(*[get_instance_info_async('vm-0001') for _ in range(5)])
+        return await get_instance_info_async('vm-0001', 'Running')
+
+    assert asyncio.run(lookups())['cpu_count'] == '1'
+    assert fake_multipass.calls() == [['info', 'vm-0001', '--format', 'json']]
+
+    # An optimistic label in the State column doesn't count as a state change
+    async def details_while_stopping():
+        app = mptui()
+        async with app.run_test(size=(120, 50)) as pilot:
+            await pilot.pause(0.5)
+            await get_instance_info_async('vm-0001', 'Running')
+            fake_multipass.clear_calls()
+            app.set_state_cell('vm-0001', 'Stopping…')
+            await app.show_details('vm-0001').wait()
+            app.action_quit()
+
+    asyncio.run(details_while_stopping())
+    assert [call for call in fake_multipass.calls() if call[0] == 'info'] == []
+
+
+def test_info_survives_a_missing_instance(fake_multipass):
+    """Test that one instance gone since the list doesn't cost the others their sample"""
+
+    fake_multipass.clear_calls()
+    infos = fetch_instance_info(['vm-0001', 'gone', 'vm-0004'])
+    assert sorted(infos) == ['vm-0001', 'vm-0004']
+    assert fake_multipass.calls()[0] == ['info', 'vm-0001', 'gone', 'vm-0004', '--format', 'json']
+    assert len(fake_multipass.calls()) == 4
+    args = get_args(['--sample-interval', '2.5', '--sample-retention', '120'])
+    assert (args.sample_interval, args.sample_retention) == (2.5, 120)
+
+
+def test_ring_buffer_keeps_the_newest_values():
+    """Test that resource history stays a fixed size and draws as a sparkline"""
+
+    ring = RingBuffer(4)
+    for value in [0.0, 0.25, 0.5, 0.75, 1.0, 1.0]:
+        ring.append(value)
+    assert len(ring) == 4
+    assert list(ring) == [0.5, 0.75, 1.0, 1.0]
+    assert sparkline(list(ring), 6) == '  ▅▆██'
+    assert sparkline([float('nan'), 0.0], 2) == ' ▁'
+
+
+def test_sample_from_info():
+    """Test that load, memory and disk are read from multipass info"""
+
+    sample = sample_from_info({
+        'cpu_count': '2', 'load': [1.0, 0.5, 0.2],
+        'memory': {'total': 1000, 'used': 250},
+        'disks': {'sda1': {'total': '400', 'used': '100'}},
+    })
+    assert sample == {'load': 0.5, 'memory': 0.25, 'disk': 0.25}
+
+
+def test_select_instances_by_state_and_glob():
+    """Test the headless instance filters"""
+
+    instances = [Instance('ci-1', 'Stopped'), Instance('ci-2', 'Running'), Instance('db', 'Stopped')]
+    selected = select_instances(instances, [], ['stopped'], ['ci-*'])
+    assert [item['name'] for item in selected] == ['ci-1']
+    assert len(select_instances(instances, ['db', 'ci-2'], [], [])) == 2
+
+
+def test_headless_partial_failure(fake_multipass, capsys):
+    """Test that the headless CLI reports per instance results and a partial failure exit code"""
+
+    exit_code = run_cli(get_args(['start', 'vm-0002', 'missing', '--json']))
+    report = json.loads(capsys.readouterr().out)
+    assert exit_code == EXIT_PARTIAL
+    assert [(result['name'], result['ok']) for result in report['results']] == [
+        ('vm-0002', True), ('missing', False)]
+    assert 'vm-0002' in get_running_multipass_instance_names()
+    # Nothing picked is refused, rather than meaning every instance
+    assert run_cli(get_args(['delete', '--json'])) == EXIT_FAILED
+    assert 'needs instance names' in json.loads(capsys.readouterr().out)['error']
+    assert len(get_instance_records(force=True)) == 6
+
+
+def test_fleet_spec_expands_and_orders_groups():
+    """Test fleet spec defaults, name patterns and dependency checks"""
+
+    spec = parse_fleet_spec({
+        'defaults': {'memory': '2G'},
+        'instances': {'app': {'count': 2, 'depends_on': 'db'}, 'db': {'state': 'Stopped'}},
+    })
+    assert [(item.name, item.memory, item.state) for item in spec.instances] == [
+        ('app-1', '2G', 'running'), ('app-2', '2G', 'running'), ('db', '2G', 'stopped')]
+    plan = plan_fleet(spec, [Instance('db', 'Suspended'), Instance('app-2', 'Deleted')])
+    assert [(action.name, action.steps) for action in plan] == [
+        ('db', ['stop']), ('app-1', ['launch']), ('app-2', ['recover', 'start'])]
+    try:
+        parse_fleet_spec({'instances': {'a': {'depends_on': ['b']}, 'b': {'depends_on': ['a']}}})
+        assert False, 'expected a dependency cycle'
+    except FleetSpecError:
+        pass
+
+
+def test_fleet_apply_converges(fake_multipass):
+    """Test that apply launches dependencies first and leaves nothing to do"""
+
+    spec = parse_fleet_spec({'instances': {
+        'db': {},
+        'app': {'count': 2, 'depends_on': ['db']},
+        'vm-0001': {'state': 'stopped'},
+        'vm-0002': {'state': 'absent'},
+    }})
+    results = apply_fleet(spec)
+    assert all(result.ok for result in results)
+    finished = [result.name for result in results]
+    assert finished.index('db') < finished.index('app-1')
+    assert finished.index('db') < finished.index('app-2')
+    instances = fake_multipass.instances_by_name()
+    assert instances['vm-0001']['state'] == 'Stopped'
+    assert 'vm-0002' not in instances
+    assert not any(action.changes for action in plan_fleet(spec, get_instance_records(force=True)))
+
+
+def test_operation_queue_coalesces():
+    """Test that queued operations collapse and run in order per instance"""
+
+    calls = []
+
+    async def runner(operation, names):
+        calls.append((operation, list(names)))
+        await asyncio.sleep(0.01)
+        return {name: True for name in names}
+
+    async def presses():
+        queue = OperationQueue(runner)
+        queue.submit(['vm1'], 'stop')
+        # stop is running, these wait behind it and collapse to one start
+        queue.submit(['vm1', 'vm2'], 'start')
+        queue.submit(['vm1'], 'stop')
+        queue.submit(['vm1'], 'start')
+        queue.submit(['vm3'], 'delete')
+        queue.submit(['vm3'], 'delete')
+        assert queue.label('vm1') == 'Starting…'
+        await queue.wait_idle()
+        assert queue.label('vm1') is None
+        return queue
+
+    queue = asyncio.run(presses())
+    assert calls == [('stop', ['vm1']), ('start', ['vm2']), ('delete', ['vm3']), ('start', ['vm1'])]
+    assert queue.coalesced == 3
+
+
+def test_operation_queue_uses_multipass(fake_multipass):
+    """Test that start, stop, start on a stopped instance is one multipass start"""
+
+    fake_multipass.clear_calls()
+
+    async def presses():
+        queue = OperationQueue()
+        for operation in ['start', 'stop', 'start']:
+            queue.submit(['vm-0002', 'vm-0005'], operation)
+        await queue.wait_idle()
+
+    asyncio.run(presses())
+    assert fake_multipass.calls() == [['start', 'vm-0002', 'vm-0005']]
+    assert 'vm-0002' in get_running_multipass_instance_names()
+
+
+def test_latency_histogram_percentiles():
+    """Test that the bucketed percentiles are within a bucket of the real ones"""
+
+    histogram = LatencyHistogram()
+    for ms in range(1, 101):
+        histogram.add(ms / 1000, ok=ms % 10 != 0)
+    assert histogram.count == 100 and histogram.errors == 10
+    assert 0.050 <= histogram.percentile(50) <= 0.050 * 1.1
+    assert 0.095 <= histogram.percentile(95) <= 0.095 * 1.1
+    assert histogram.percentile(100) == histogram.max == 0.1
+    assert describe_command(['multipass', 'launch', '22.04', '--name', 'web', '--cpus', '2']) == ('launch', 'web')
+    assert describe_command(['multipass', 'list', '--format', 'json']) == ('list', '')
+
+
+def test_commands_are_timed(fake_multipass, tmp_path):
+    """Test that every command through the utils layer is recorded, failures included"""
+
+    metrics = command_metrics
+    metrics.reset()
+    run_multipass_command(['multipass', 'start', 'vm-0002'])
+    run_multipass_command(['multipass', 'start', 'missing'])
+    assert metrics.summary()['start']['count'] == 2
+    assert metrics.summary()['start']['errors'] == 1
+    failure = metrics.failures()[0]
+    assert failure.instance == 'missing' and 'does not exist' in failure.stderr
+    assert metrics.export_jsonl(str(tmp_path / 'metrics.jsonl')) == 2
+    records = [json.loads(line) for line in open(tmp_path / 'metrics.jsonl')]
+    assert [record['returncode'] != 0 for record in records] == [False, True]
+
+
+def test_instances_parse_once_into_table_rows(fake_multipass):
+    """Test that the table comes from the cached JSON list and keeps every IPv4"""
+
+    record = Instance.from_json({'name': 'multi', 'state': 'Running', 'release': 'Ubuntu 24.04 LTS',
+                                 'ipv4': ['10.0.0.2', '172.17.0.1']})
+    assert record['ipv4'] == ['10.0.0.2', '172.17.0.1']
+    assert instance_table_rows([record]) == [['multi', 'Running', '10.0.0.2, 172.17.0.1',
+                                              'Ubuntu 24.04 LTS']]
+    assert instance_table_rows([record], ['Name', 'State']) == [['multi', 'Running']]
+
+    get_multipass_instances(force=True)
+    fake_multipass.clear_calls()
+    rows = get_instances_for_textual_datatable()
+    assert rows[0] == ['Name', 'State', 'IPv4', 'Release']
+    assert len(rows) == 7
+    assert fake_multipass.calls() == []
+
+
+def test_instance_index_filters_and_sorts():
+    """Test filter terms, natural and IP sorting, and results kept across updates"""
+
+    records = [Instance('vm10', 'Running', ['10.0.0.9'], 'Ubuntu 24.04 LTS'),
+               Instance('vm2', 'Stopped', [], 'Ubuntu 22.04 LTS'),
+               Instance('web', 'Running', ['10.0.0.10'], 'Ubuntu 22.04 LTS')]
+    index = InstanceIndex()
+    index.update(records)
+    assert index.view() == ['vm2', 'vm10', 'web']
+    assert index.view('state:run') == ['vm10', 'web']
+    assert index.view('state:run 22.04') == ['web']
+    assert index.view('ip:10.0.0.1') == ['web']
+    assert index.view('', 'ipv4') == ['vm10', 'web', 'vm2']
+    assert index.view('', 'state', reverse=True) == ['vm2', 'vm10', 'web']
+
+    # A refresh patches the kept results rather than searching again
+    index.update([records[0], Instance('vm2', 'Running', [], 'Ubuntu 22.04 LTS')])
+    assert index.results['state:run'][1] == {'vm10', 'vm2'}
+    assert index.view('state:run') == ['vm2', 'vm10']
+
+
+@pytest.mark.timing
+def test_instance_index_keystrokes_are_quick():
+    """Test that typing a filter over 5,000 instances stays well under a frame per keystroke"""
+
+    states = ['Running', 'Stopped', 'Suspended']
+    index = InstanceIndex()
+    index.update([Instance(f'vm-{number:04d}', states[number % 3], [f'10.0.{number // 256}.{number % 256}'],
+                           'Ubuntu 24.04 LTS') for number in range(5000)])
+    index.view()
+    slowest = 0.0
+    query = ''
+    for key in 'vm-12 state:run':
+        query += key
+        started = time.perf_counter()
+        index.view(query)
+        slowest = max(slowest, time.perf_counter() - started)
+    assert index.view(query) == [f'vm-12{number:02d}' for number in range(100) if (1200 + number) % 3 == 0]
+    assert slowest < 0.016
+
+
 # TODO
 # Assert I can get machines from multipass (0 *, 1 ,many)
 # Assert I can get only ones running (0, 1 ,many)
 # Assert I can get ones with snapshots (0, 1 ,many)
+
+
+def test_host_inventory():
+    """Test the short and long forms of an inventory entry, and bad host names"""
+
+    hosts = parse_inventory({'hosts': {'build1': 'build1.example.com',
+                                       'build2': {'address': '10.0.0.12', 'user': 'ci', 'port': 2222}}})
+    assert hosts == [Host('build1', 'build1.example.com'), Host('build2', '10.0.0.12', 'ci', 2222)]
+    for bad in ({'hosts': {'a@b': 'x'}}, {'hosts': {'local': 'x'}}, {'hosts': {'b': {'port': 'ssh'}}}, {}):
+        try:
+            parse_inventory(bad)
+        except HostInventoryError:
+            continue
+        raise AssertionError(f'{bad} was accepted')
+
+
+def test_hosts_are_queried_at_once(fake_multipass):
+    """Test that listing every host takes as long as the slowest host, not all of them added up"""
+
+    fake_multipass.set_latency({'list': 0.2})
+    fake_multipass.add_host('build1', instances=2, latency={'list': 0.8})
+    fake_multipass.add_host('build2', instances=2, latency={'list': 0.5})
+    use_hosts([Host('build1', 'build1'), Host('build2', 'build2')], fake_multipass.ssh_control_dir)
+    command_metrics.reset()
+    started = time.perf_counter()
+    records = get_instance_records(force=True)
+    elapsed = time.perf_counter() - started
+    assert len(records) == 10
+    assert {record.key for record in records if record.host} == {
+        'vm-0001@build1', 'vm-0002@build1', 'vm-0001@build2', 'vm-0002@build2'}
+    durations = [record.duration for record in command_metrics.recent]
+    assert sorted(record.host for record in command_metrics.recent) == ['', 'build1', 'build2']
+    assert elapsed >= 0.8
+    assert elapsed < max(durations) + 0.3 < sum(durations)
+    assert get_instances_for_textual_datatable()[0] == ['Name', 'State', 'IPv4', 'Release', 'Host']
+
+    # A long stream on one host doesn't take another host's stream slot
+    async def stream_on_both():
+        async def timed(command, host):
+            started = time.perf_counter()
+            result = await execute_multipass_stream_async(command, lambda stream_name, line: None, host)
+            return result[0], time.perf_counter() - started
+
+        return await asyncio.gather(timed(['multipass', 'exec', 'vm-0001', '--', 'sleep', '1'], 'build1'),
+                                    timed(['multipass', 'exec', 'vm-0001', '--', 'true'], ''))
+
+    set_max_concurrent_streams(1)
+    try:
+        (slow_rc, slow), (quick_rc, quick) = asyncio.run(stream_on_both())
+    finally:
+        set_max_concurrent_streams(4)
+    assert slow_rc == quick_rc == 0
+    assert slow >= 1.0 and quick < 0.8
+
+
+def test_bulk_actions_route_to_hosts(fake_multipass):
+    """Test that each instance's action goes to the host it is on, and ssh connections are reused"""
+
+    fake_multipass.add_host('build1', instances=2, handshake=0.5)
+    fake_multipass.add_host('build2', instances=2)
+    use_hosts([Host('build1', 'build1'), Host('build2', 'build2')], fake_multipass.ssh_control_dir)
+    fake_multipass.clear_calls()
+    started = time.perf_counter()
+    results = start_instances(['vm-0002@build1', 'vm-0002'])
+    assert time.perf_counter() - started >= 0.5
+    assert results == {'vm-0002@build1': True, 'vm-0002': True}
+    assert fake_multipass.calls() == [['start', 'vm-0002']]
+    assert fake_multipass.host_calls('build1') == [['start', 'vm-0002']]
+    assert fake_multipass.host_calls('build2') == []
+    assert get_instance('vm-0002@build1').state == 'Running'
+    assert get_instance('vm-0002@build2').state == 'Stopped'
+    # The first connection is still open, so no second handshake
+    started = time.perf_counter()
+    assert stop_instances(['vm-0002@build1']) == {'vm-0002@build1': True}
+    assert time.perf_counter() - started < 0.5
+
+
+def test_ssh_control_dir_is_private(fake_multipass):
+    """Test that a shared control directory is refused, and the default one is removed on close"""
+
+    fake_multipass.add_host('build1', instances=2)
+    shared = os.path.join(fake_multipass.root, 'shared')
+    os.makedirs(shared)
+    os.chmod(shared, 0o755)
+    use_hosts([Host('build1', 'build1')], shared)
+    fake_multipass.clear_calls()
+    assert start_instances(['vm-0002@build1']) == {'vm-0002@build1': False}
+    assert fake_multipass.host_calls('build1') == []
+    assert os.listdir(shared) == []
+
+    use_hosts([Host('build1', 'build1')])
+    assert start_instances(['vm-0002@build1']) == {'vm-0002@build1': True}
+    control_dir = get_host_transport('build1').control_dir
+    assert stat.S_IMODE(os.stat(control_dir).st_mode) == 0o700
+    asyncio.run(close_hosts_async())
+    assert not os.path.exists(control_dir)
+
+
+def test_shell_pool_evicts_least_recently_used():
+    """Test that sessions are reused, the oldest is closed past the cap, and the shown one is kept"""
+
+    closed = []
+    pool = ShellPool(lambda name: {'name': name, 'alive': True},
+                     lambda name, session: closed.append(name),
+                     lambda session: session['alive'], size=2)
+    first, reused = pool.attach('a')
+    assert not reused
+    assert pool.prewarm('b') is not None
+    assert pool.prewarm('b') is None
+    assert pool.attach('a') == (first, True)
+    pool.attach('c')
+    assert closed == ['b'] and pool.names() == ['a', 'c']
+    # 'c' is on screen, so a pre-warm pushes out 'a' rather than it
+    pool.prewarm('d')
+    assert closed == ['b', 'a'] and pool.active == 'c'
+    # An exited shell is opened again
+    pool.sessions['c']['alive'] = False
+    session, reused = pool.attach('c')
+    assert not reused and session['alive'] and closed[-1] == 'c'
+
+    # With room for one, the shell going off screen is closed, not the one just opened
+    closed.clear()
+    pool = ShellPool(lambda name: {'name': name, 'alive': True},
+                     lambda name, session: closed.append(name),
+                     lambda session: session['alive'], size=1)
+    pool.attach('a')
+    session, reused = pool.attach('b')
+    assert session['name'] == 'b' and not reused
+    assert closed == ['a'] and pool.names() == ['b'] and pool.active == 'b'
+    assert pool.prewarm('c') is None and pool.names() == ['b']
+
+
+def test_shells_reattach_without_a_new_handshake(fake_multipass):
+    """Test that going back to an instance's shell reuses the running session"""
+
+    fake_multipass.set_latency({'shell': 1.0})
+
+    async def run_app():
+        app = mptui(shell_pool_size=2)
+        async with app.run_test(size=(120, 50)) as pilot:
+            await pilot.pause(0.5)
+            table = app.query_one(DataTable)
+            await pilot.press('s')
+            first = app.shells.sessions['vm-0001']
+            while not any('ubuntu@vm-0001' in line.plain for line in first._display.lines):
+                await pilot.pause(0.1)
+            table.move_cursor(row=3)
+            await pilot.press('ctrl+f1', 's')
+            assert app.shells.names() == ['vm-0001', 'vm-0004']
+            table.move_cursor(row=0)
+            await pilot.press('ctrl+f1', 's')
+            assert app.shells.active == 'vm-0001' and app.shells.reused == 1
+            assert app.shells.sessions['vm-0001'] is first and first.display
+            await pilot.press('ctrl+f1', 's')
+            assert not app.query_one('#shells').has_class('open')
+            app.action_quit()
+
+    asyncio.run(run_app())
+    assert [call for call in fake_multipass.calls() if call[0] == 'shell'] == [
+        ['shell', 'vm-0001'], ['shell', 'vm-0004']]
+
+
+
+def test_exec_runs_on_instances_at_once(fake_multipass):
+    """Test that exec runs everywhere at once, streams each line and sums up the exit codes"""
+
+    lines = []
+    started = time.perf_counter()
+    results = asyncio.run(exec_on_instances_async(
+        ['vm-0001', 'vm-0004', 'vm-0002'], ['sleep', '0.5'],
+        lambda name, stream_name, line: lines.append((name, stream_name, line))))
+    elapsed = time.perf_counter() - started
+    assert [(result.name, result.returncode) for result in results][:2] == [('vm-0001', 0), ('vm-0004', 0)]
+    # vm-0002 is stopped
+    assert not results[2].ok and 'not running' in results[2].tail[-1]
+    assert elapsed < sum(result.seconds for result in results)
+    assert lines == [('vm-0002', 'stderr', 'instance "vm-0002" is not running')]
+    summary = format_exec_summary(results)
+    assert summary[0].startswith('vm-0002') and summary[-1].startswith('2/3 succeeded')
+
+
+def test_exec_output_is_capped(fake_multipass):
+    """Test that past the per instance limit lines are counted, not passed on"""
+
+    lines = []
+    results = asyncio.run(exec_on_instances_async(
+        ['vm-0001'], ['seq', '2000'], lambda name, stream_name, line: lines.append(line),
+        output_limit=100))
+    assert (results[0].lines, results[0].dropped) == (100, 1900)
+    assert lines[:100] == [str(number) for number in range(1, 101)]
+    assert lines[100] == '... 1900 more lines not shown' and len(lines) == 101
+    assert results[0].tail == ['1998', '1999', '2000']
+
+    # A consumer that blows up stops the commands instead of leaving them blocked on the queue
+    def broken(name, stream_name, line):
+        raise ValueError(line)
+
+    async def run_broken():
+        try:
+            await asyncio.wait_for(exec_on_instances_async(['vm-0001', 'vm-0004'], ['seq', '2000'], broken), 10)
+        except ValueError as e:
+            return str(e)
+
+    assert asyncio.run(run_broken()) == '1'
+    # A failure that never ran has no tail, which isn't shown as None
+    report = {'command': 'exec', 'results': [
+        {'name': 'vm-0002', 'ok': False, 'returncode': 127, 'seconds': 0.0, 'tail': [], 'error': None}]}
+    out = io.StringIO()
+    print_report(report, out=out)
+    assert 'None' not in out.getvalue() and out.getvalue().startswith('vm-0002')
+
+
+def test_warm_pool_hands_out_copies(fake_multipass):
+    """Test that the pool fills up, hands out started copies quickly, and stops members others started"""
+
+    fake_multipass.set_latency({'launch': 1.0, 'clone': 0.1})
+    pool = WarmPool(2, cpus=2)
+
+    async def run():
+        assert await pool.take_async() is None
+        assert await pool.refill_async() == 2
+        assert sorted(pool.ready) == ['warm-1', 'warm-2']
+        started = time.perf_counter()
+        name = await pool.take_async()
+        took = time.perf_counter() - started
+        # Nothing to do while it's full
+        assert await pool.refill_async() == 0
+        return name, took
+
+    name, took = asyncio.run(run())
+    assert name == 'quick-1' and took < 1.0
+    instances = fake_multipass.instances_by_name()
+    assert instances['quick-1']['state'] == 'Running' and instances['quick-1']['cpus'] == 2
+    assert [instances[member]['state'] for member in ('warm-1', 'warm-2')] == ['Stopped', 'Stopped']
+    assert (pool.hits, pool.misses, pool.refills.count) == (1, 1, 2)
+    assert 'hits 1 misses 1 (50%)' in format_pool_stats(pool)
+    start_instances(['warm-2'])
+    delete_instances(['warm-1'])
+    assert asyncio.run(pool.refill_async()) == 1
+    instances = fake_multipass.instances_by_name()
+    assert instances['warm-2']['state'] == 'Stopped' and instances['warm-3']['state'] == 'Stopped'
+    assert pool.given == set()
+    # Only what the pool launched is a member, after a restart too: someone's own warm-9 is left running
+    asyncio.run(launch_instance_async(name='warm-9'))
+    restarted = WarmPool(2)
+    assert asyncio.run(restarted.refill_async()) == 0
+    assert sorted(restarted.ready) == ['warm-2', 'warm-3'] and not restarted.is_member('warm-9')
+    assert fake_multipass.instances_by_name()['warm-9']['state'] == 'Running'
+
+
+def test_restore_runs_in_parallel(fake_multipass):
+    """Test that instances are stopped, restored together, and the running ones started again"""
+
+    names = ['vm-0001', 'vm-0002', 'vm-0004', 'vm-0005']
+    results = asyncio.run(snapshot_instances_async(names, 'golden'))
+    assert [result.made for result in results] == ['golden'] * 4
+    assert list_snapshots(['vm-0001', 'vm-0003']) == {
+        'vm-0001': [Snapshot('vm-0001', 'golden')], 'vm-0003': []}
+    fake_multipass.set_latency({'restore': 0.5})
+    stages = []
+    started = time.perf_counter()
+    results = asyncio.run(restore_instances_async(
+        names + ['vm-0003'], 'golden', True, lambda name, stage: stages.append((name, stage))))
+    elapsed = time.perf_counter() - started
+    assert [result.ok for result in results] == [True] * 4 + [False]
+    assert results[4].failed_at == 'restore'
+    assert elapsed < sum(result.seconds for result in results[:4])
+    assert [stage for name, stage in stages if name == 'vm-0001'] == ['stopping', 'restore', 'starting', 'done']
+    assert [stage for name, stage in stages if name == 'vm-0002'] == ['restore', 'done']
+    # vm-0003 has no golden snapshot, it is started again rather than left stopped
+    assert get_running_multipass_instance_names() == ['vm-0001', 'vm-0003', 'vm-0004']
+    # Headless, the whole fleet or the current state are only thrown away when asked for
+    fake_multipass.clear_calls()
+    for argv in (['restore', '--snapshot', 'golden', '--state', 'Stopped'], ['clone', '--match', 'vm-*'],
+                 ['restore', '--all', '--snapshot', 'golden']):
+        assert run_cli(get_args(argv + ['--json'])) == EXIT_FAILED
+    assert fake_multipass.calls() == []
+
+
+def test_image_catalog_is_served_stale_while_it_refreshes(fake_multipass, tmp_path):
+    """Test that the catalog is fetched once, reused from disk, and refreshed behind a stale copy"""
+
+    fake_multipass.set_latency({'find': 0.5})
+    path = str(tmp_path / 'find.json')
+    catalog = ImageCatalog(path)
+    images = asyncio.run(catalog.get_async())
+    assert catalog.lookup('Noble').name == '24.04' and catalog.lookup('docker').blueprint
+    assert catalog.lookup('daily:plucky').name == 'daily:25.04' and catalog.lookup('sid') is None
+    assert catalog.complete('no') == 'noble' and catalog.complete('x') is None
+
+    async def get_stale(catalog):
+        started = time.perf_counter()
+        images = await catalog.get_async()
+        took = time.perf_counter() - started
+        refreshing = catalog._refresh is not None and not catalog._refresh.done()
+        await catalog.wait_for_refresh()
+        return images, took, refreshing
+
+    # Another process reads it from disk, without asking multipass
+    fake_multipass.clear_calls()
+    restarted = ImageCatalog(path)
+    assert [image.name for image in asyncio.run(restarted.get_async())] == [image.name for image in images]
+    assert fake_multipass.calls() == []
+    restarted.invalidate()
+    stale, took, refreshing = asyncio.run(get_stale(ImageCatalog(path)))
+    assert len(stale) == len(images) and took < 0.3 and refreshing
+    assert fake_multipass.calls() == [['find', '--format', 'json']]
+    # The refresh was saved
+    refreshed = ImageCatalog(path)
+    assert refreshed.load() and not refreshed.is_stale()
+
+
+def test_sync_sends_only_changed_files(fake_multipass, tmp_path):
+    """Test that a re-sync hashes once and transfers only what changed, to every instance at once"""
+
+    source = tmp_path / 'app'
+    (source / 'lib').mkdir(parents=True)
+    for index in range(5):
+        (source / 'lib' / f'mod{index}.py').write_text(f'x = {index}\n')
+    (source / 'main.py').write_text('print(1)\n')
+    names = ['vm-0001', 'vm-0004']
+    results = asyncio.run(sync_to_instances_async(str(source), '/home/ubuntu/app', names))
+    assert [(result.ok, result.sent, result.skipped) for result in results] == [(True, 6, 0)] * 2
+    files = fake_multipass.instances_by_name()['vm-0004']['files']
+    assert sorted(files) == ['/home/ubuntu/app/.multipasser-sync', '/home/ubuntu/app/lib/mod0.py', '/home/ubuntu/app/lib/mod1.py',
+                             '/home/ubuntu/app/lib/mod2.py', '/home/ubuntu/app/lib/mod3.py',
+                             '/home/ubuntu/app/lib/mod4.py', '/home/ubuntu/app/main.py']
+
+    (source / 'lib' / 'mod3.py').write_text('x = 33\n')
+    fake_multipass.clear_calls()
+    results = asyncio.run(sync_to_instances_async(str(source), '/home/ubuntu/app/', names + ['vm-0002']))
+    assert [(result.ok, result.sent, result.skipped) for result in results[:2]] == [(True, 1, 5)] * 2
+    assert not results[2].ok and 'not running' in results[2].error
+    # A new token then one call for the changed file per instance, vm-0002 stops at the token
+    assert sorted(call[-1] for call in fake_multipass.calls() if call[0] == 'transfer') == [
+        'vm-0001:/home/ubuntu/app/.multipasser-sync', 'vm-0001:/home/ubuntu/app/lib/',
+        'vm-0002:/home/ubuntu/app/.multipasser-sync',
+        'vm-0004:/home/ubuntu/app/.multipasser-sync', 'vm-0004:/home/ubuntu/app/lib/']
+    assert fake_multipass.instances_by_name()['vm-0001']['files']['/home/ubuntu/app/lib/mod3.py'] != \
+        files['/home/ubuntu/app/lib/mod3.py']
+
+    # A new instance under the same name doesn't have the old one's token, so it gets everything
+    assert run_cli(get_args(['delete', 'vm-0004', '--json'])) == EXIT_OK
+    run_multipass_command(['multipass', 'purge'])
+    fake_multipass.clear_calls()
+    asyncio.run(launch_instance_async(name='vm-0004'))
+    results = asyncio.run(sync_to_instances_async(str(source), '/home/ubuntu/app', names))
+    assert [(result.ok, result.sent) for result in results] == [(True, 0), (True, 6)]
+    assert len(fake_multipass.instances_by_name()['vm-0004']['files']) == 7
+    # Nor does one put back to a snapshot from before the last sync, even one restored behind our back
+    stop_instances(['vm-0001'])
+    run_multipass_command(['multipass', 'snapshot', 'vm-0001'])
+    start_instances(['vm-0001'])
+    (source / 'main.py').write_text('print(2)\n')
+    asyncio.run(sync_to_instances_async(str(source), '/home/ubuntu/app', ['vm-0001']))
+    stop_instances(['vm-0001'])
+    run_multipass_command(['multipass', 'restore', '--destructive', 'vm-0001.snapshot1'])
+    start_instances(['vm-0001'])
+    results = asyncio.run(sync_to_instances_async(str(source), '/home/ubuntu/app', ['vm-0001']))
+    assert [(result.ok, result.sent) for result in results] == [(True, 6)]
+
+
+def test_activity_log_is_bounded_and_searchable(tmp_path):
+    """Test that the log keeps a fixed number of entries, spills and rotates the rest, and searches both"""
+
+    path = str(tmp_path / 'activity.log')
+    activity = ActivityLog(capacity=50, path=path, max_bytes=4096, backups=2)
+    for index in range(1000):
+        activity.add(f'line {index}', f'vm-{index % 4:04d}', 'exec', 'failed' if index % 100 == 7 else '')
+    assert len(activity) == 50 and len(activity.entries) == 50
+    assert [entry.text for entry in activity][0] == 'line 950' and activity[49].text == 'line 999'
+    assert activity.spilled == 950
+    assert activity.files() == [path, path + '.1', path + '.2']
+    assert all(os.path.getsize(file) < 4096 + 200 for file in activity.files())
+    # Matches come from memory and from what's left on disk, the oldest file is gone
+    assert [entry.text for entry in activity.search('vm-0003 line 99')] == [
+        'line 899', 'line 991', 'line 995', 'line 999']
+    assert [entry.text for entry in activity.search('result:failed op:exec')] == ['line 907']
+    assert activity.search('line 807') == []
+    assert [entry.text for entry in activity.search('line', limit=3)] == ['line 997', 'line 998', 'line 999']
+    activity.close()
+    assert len(activity) == 0 and activity.search('line 999')[0].instance == 'vm-0003'
+
+
+def test_activity_search_runs_in_a_thread(fake_multipass, tmp_path):
+    """Test that searching the activity log doesn't read the files on the UI's event loop"""
+
+    activity = ActivityLog(capacity=50, path=str(tmp_path / 'activity.log'))
+    for index in range(200):
+        activity.add(f'line {index}', 'vm-0001', 'exec')
+    threads = []
+    search = activity.search
+
+    def recording_search(query, *args, **kwargs):
+        threads.append(threading.get_ident())
+        return search(query, *args, **kwargs)
+
+    activity.search = recording_search
+
+    async def run_app():
+        app = mptui(activity_log=activity)
+        async with app.run_test(size=(120, 50)) as pilot:
+            await pilot.pause(0.2)
+            view = app.query_one(ActivityView)
+            view.search('line 15')
+            assert view.border_title.startswith('Activity: searching')
+            for _ in range(50):
+                if view.matches is not None:
+                    break
+                await pilot.pause(0.1)
+            found = [entry.text for entry in view.matches]
+            view.search('')
+            return found, view.matches
+
+    found, cleared = asyncio.run(run_app())
+    assert found == ['line 15', 'line 115'] + [f'line {index}' for index in range(150, 160)]
+    assert cleared is None
+    assert threads and threading.get_ident() not in threads
+    # The app closed the log when it exited, without q, so what was in memory is on disk
+    assert len(activity) == 0
+    assert 'line 199' in (tmp_path / 'activity.log').read_text()
+